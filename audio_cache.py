@@ -0,0 +1,99 @@
+"""
+This module caches recordings decoded to the 16 kHz mono float32 samples Whisper works on.
+
+Given a file path, openai-whisper and faster-whisper start an ffmpeg process to decode
+it, so every re-run with another model, every retry and every prompt experiment decodes
+the same audio again. Here a WAV file is decoded once, in-process (see resample), into
+a .npy file named by the hash of its PCM audio (see transcription_cache.audio_hash).
+Later loads memory-map that file, so they cost almost nothing and worker processes
+share its pages.
+
+The cache lives in "audio_cache_dir" in config.json, by default audio_cache in the data
+directory. Like the transcription cache it is bounded by size, "audio_cache_max_mb"
+(2048 by default): loading an array refreshes its modification time, and the least
+recently used arrays are removed once the cache grows past its limit. With a limit of 0
+nothing is stored and each file is decoded in memory.
+
+Functions:
+- load_audio(file_path): Return the audio of a WAV file as 16 kHz mono float32 samples.
+"""
+
+import os
+import threading
+
+from audio_metadata import get_metadata
+from metrics import record_metrics
+from resample import output_length, resampled_blocks
+from settings import config, data_dir
+from transcription_cache import audio_hash, evict_least_recently_used
+
+
+def _cache_dir():
+    return config.get("audio_cache_dir", os.path.join(data_dir(), "audio_cache"))
+
+
+def _entry_path(key):
+    return os.path.join(_cache_dir(), key[:2], f"{key}.npy")
+
+
+def _decode(file_path, metadata, path):
+    """Decode a WAV file into a new .npy file at path, replacing it in one step."""
+    import numpy as np
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Without the .npy extension, so eviction never counts a file being written.
+    tmp_path = f"{path}.tmp.{os.getpid()}.{threading.get_ident()}"
+    audio = np.lib.format.open_memmap(
+        tmp_path, mode="w+", dtype=np.float32, shape=(output_length(metadata),)
+    )
+    written = 0
+    for samples in resampled_blocks(file_path, metadata):
+        audio[written : written + len(samples)] = samples
+        written += len(samples)
+    audio.flush()
+    del audio
+    try:
+        os.replace(tmp_path, path)
+    except OSError:
+        # Another worker cached the same audio first and has it mapped.
+        os.remove(tmp_path)
+
+
+def load_audio(file_path):
+    """
+    Return the audio of a WAV file as 16 kHz mono float32 samples, decoding it only when
+    it is not cached.
+
+    Args:
+        file_path (str): Path to the audio file.
+
+    Returns:
+        numpy.ndarray: The samples, memory-mapped copy-on-write from the cache, so they
+        can be handed to Whisper as they are. Files that are not WAV files are returned
+        as their path, for the backend to decode itself.
+    """
+    import numpy as np
+
+    metadata = get_metadata(file_path)
+    if "data_offset" not in metadata:
+        return file_path
+    max_bytes = config.get("audio_cache_max_mb", 2048) * 1024 * 1024
+    if not max_bytes or not output_length(metadata):
+        blocks = list(resampled_blocks(file_path, metadata))
+        return np.concatenate(blocks) if blocks else np.zeros(0, dtype=np.float32)
+
+    path = _entry_path(audio_hash(file_path))
+    try:
+        audio = np.load(path, mmap_mode="c")
+        os.utime(path)
+        record_metrics("audio_cache", hits=1)
+        return audio
+    except (OSError, ValueError):
+        pass
+
+    _decode(file_path, metadata, path)
+    record_metrics("audio_cache", misses=1, audio_seconds=metadata["duration"])
+    # Mapped before evicting, so a file bigger than the whole cache can still be used.
+    audio = np.load(path, mmap_mode="c")
+    evict_least_recently_used(_cache_dir(), ".npy", max_bytes, os.path.getsize(path))
+    return audio
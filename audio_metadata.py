@@ -0,0 +1,302 @@
+"""
+This module reads audio metadata straight from RIFF/WAV headers, without starting an
+ffprobe process or decoding any audio.
+
+Results are cached keyed by path and validated against the file size and modification
+time, so a directory is only parsed once between changes. The cache is held in memory
+and loaded from disk once per process. It is written back, without the entries of files
+that no longer exist, after each scan_directory and when the process exits, so single
+lookups never touch the disk. Every file is given a status so later stages can skip
+recordings that are empty, truncated or corrupt.
+
+Functions:
+- read_wav_header(file_path): Parse the header of a WAV file.
+- get_metadata(file_path): Return the metadata of a single file, using the cache.
+- scan_directory(directory, workers=SCAN_WORKERS): Return the metadata of every file in a directory.
+- usable_wav_files(directory): Return the paths of the WAV files in a directory that can be transcribed.
+- wav_header(metadata, data_bytes): Build a canonical WAV header for audio in the format of metadata.
+"""
+
+import atexit
+import json
+import os
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from settings import data_dir
+
+METADATA_CACHE_FILE_NAME = "audio_metadata.json"
+WAV_HEADER_BYTES = 44
+SCAN_WORKERS = 8
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+_cache_lock = threading.Lock()
+_cache = None
+_cache_changed = False
+
+
+def read_wav_header(file_path):
+    """
+    Parse the header of a WAV file.
+
+    Walks the RIFF chunks to find "fmt " and "data". The status of the result is one of:
+    - "ok": the header is valid and the data chunk is complete.
+    - "empty": the file has zero bytes.
+    - "truncated": the data chunk is shorter than its header claims, n_frames and
+      duration only cover the audio that is actually present.
+    - "corrupt": the file is not a readable WAV file, see "error".
+
+    Args:
+        file_path (str): Path to the WAV file.
+
+    Returns:
+        dict: The metadata of the file.
+    """
+    stat = os.stat(file_path)
+    metadata = {
+        "size": stat.st_size,
+        "mtime": stat.st_mtime_ns,
+        "status": "ok",
+        "error": None,
+    }
+    if stat.st_size == 0:
+        metadata["status"] = "empty"
+        return metadata
+
+    try:
+        with open(file_path, "rb") as file:
+            riff, _, wave_id = struct.unpack("<4sI4s", file.read(12))
+            if riff != b"RIFF" or wave_id != b"WAVE":
+                raise ValueError("not a RIFF/WAVE file")
+
+            fmt = None
+            while True:
+                chunk_header = file.read(8)
+                if len(chunk_header) < 8:
+                    break
+                chunk_id, chunk_size = struct.unpack("<4sI", chunk_header)
+                chunk_start = file.tell()
+
+                if chunk_id == b"fmt ":
+                    fmt = file.read(chunk_size)
+                    if len(fmt) < 16:
+                        raise ValueError("fmt chunk is too short")
+                    (
+                        format_tag,
+                        channels,
+                        sample_rate,
+                        _,
+                        block_align,
+                        bits_per_sample,
+                    ) = struct.unpack("<HHIIHH", fmt[:16])
+                    if format_tag == WAVE_FORMAT_EXTENSIBLE and len(fmt) >= 26:
+                        format_tag = struct.unpack("<H", fmt[24:26])[0]
+                    metadata.update(
+                        {
+                            "format_tag": format_tag,
+                            "channels": channels,
+                            "sample_rate": sample_rate,
+                            "bits_per_sample": bits_per_sample,
+                            "block_align": block_align,
+                        }
+                    )
+                elif chunk_id == b"data":
+                    if fmt is None:
+                        raise ValueError("data chunk before fmt chunk")
+                    if not metadata["block_align"] or not metadata["sample_rate"]:
+                        raise ValueError("invalid fmt chunk")
+                    available = stat.st_size - chunk_start
+                    data_bytes = min(chunk_size, available)
+                    if available < chunk_size:
+                        metadata["status"] = "truncated"
+                        metadata["error"] = (
+                            f"data chunk claims {chunk_size} bytes, {available} present"
+                        )
+                    n_frames = data_bytes // metadata["block_align"]
+                    metadata.update(
+                        {
+                            "data_offset": chunk_start,
+                            "data_bytes": n_frames * metadata["block_align"],
+                            "n_frames": n_frames,
+                            "duration": n_frames / metadata["sample_rate"],
+                        }
+                    )
+                    return metadata
+
+                # Chunks are word aligned, odd sized chunks carry a pad byte.
+                file.seek(chunk_start + chunk_size + (chunk_size & 1))
+
+            raise ValueError("no data chunk found")
+    except (OSError, ValueError, struct.error) as e:
+        metadata["status"] = "corrupt"
+        metadata["error"] = str(e)
+        return metadata
+
+
+def _cache_file():
+    return os.path.join(data_dir(), METADATA_CACHE_FILE_NAME)
+
+
+def _load_cache():
+    """Load the metadata cache from disk."""
+    cache_file = _cache_file()
+    if not os.path.exists(cache_file):
+        return {}
+    try:
+        with open(cache_file, "r", encoding="utf-8") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def _get_cache():
+    """Return the in-memory metadata cache, loading it on first use. Hold _cache_lock."""
+    global _cache
+    if _cache is None:
+        _cache = _load_cache()
+    return _cache
+
+
+def _save_cache():
+    """
+    Write the metadata cache to disk if it changed, first dropping the entries of files
+    that no longer exist. Hold _cache_lock.
+    """
+    global _cache_changed
+    if _cache is None:
+        return
+    removed = [key for key in _cache if not os.path.exists(key)]
+    for key in removed:
+        del _cache[key]
+    if not (_cache_changed or removed):
+        return
+    cache_file = _cache_file()
+    os.makedirs(data_dir(), exist_ok=True)
+    tmp_file = f"{cache_file}.tmp.{os.getpid()}.{threading.get_ident()}"
+    with open(tmp_file, "w", encoding="utf-8") as file:
+        json.dump(_cache, file)
+    os.replace(tmp_file, cache_file)
+    _cache_changed = False
+
+
+@atexit.register
+def _save_cache_at_exit():
+    with _cache_lock:
+        _save_cache()
+
+
+def _cached_or_read(cache, file_path):
+    """Return the cached metadata for file_path if size and mtime still match, else parse it."""
+    key = os.path.abspath(file_path)
+    stat = os.stat(file_path)
+    cached = cache.get(key)
+    if cached and cached["size"] == stat.st_size and cached["mtime"] == stat.st_mtime_ns:
+        return key, cached
+    return key, read_wav_header(file_path)
+
+
+def get_metadata(file_path):
+    """
+    Return the metadata of a single file, using and updating the in-memory cache.
+
+    Only files in the data directory are cached. Others, such as the temporary files of
+    vad, are parsed on every call so they never leave entries behind.
+    """
+    global _cache_changed
+    if not os.path.abspath(file_path).startswith(os.path.abspath(data_dir()) + os.sep):
+        return read_wav_header(file_path)
+    with _cache_lock:
+        cache = _get_cache()
+        key, metadata = _cached_or_read(cache, file_path)
+        if cache.get(key) is not metadata:
+            cache[key] = metadata
+            _cache_changed = True
+    return metadata
+
+
+def scan_directory(directory, workers=SCAN_WORKERS):
+    """
+    Return the metadata of every file in a directory in one pass.
+
+    Headers are parsed in parallel and only for files that changed since they were last
+    cached, and the cache is then written to disk. Files that are not WAV files are
+    reported as corrupt.
+
+    Args:
+        directory (str): The directory to scan.
+        workers (int): Number of headers to parse concurrently.
+
+    Returns:
+        dict: Mapping of file name to its metadata.
+    """
+    file_names = [
+        file_name
+        for file_name in os.listdir(directory)
+        if os.path.isfile(os.path.join(directory, file_name))
+    ]
+
+    global _cache_changed
+    with _cache_lock:
+        cache = _get_cache()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(
+                executor.map(
+                    lambda file_name: _cached_or_read(
+                        cache, os.path.join(directory, file_name)
+                    ),
+                    file_names,
+                )
+            )
+
+        metadata_by_name = {}
+        for file_name, (key, metadata) in zip(file_names, results):
+            if cache.get(key) is not metadata:
+                cache[key] = metadata
+                _cache_changed = True
+            metadata_by_name[file_name] = metadata
+        _save_cache()
+
+    return metadata_by_name
+
+
+def usable_wav_files(directory):
+    """
+    Return the paths of the WAV files in directory that can be transcribed.
+
+    Empty and corrupt files are left out, truncated files are kept with a warning since
+    the audio that is present can still be used.
+    """
+    usable = []
+    for file_name, metadata in sorted(scan_directory(directory).items()):
+        if not file_name.endswith(".wav"):
+            continue
+        if metadata["status"] in ("empty", "corrupt"):
+            print(f"Skipping {file_name}: {metadata['status']} {metadata['error'] or ''}")
+            continue
+        if metadata["status"] == "truncated":
+            print(f"Warning: {file_name} is truncated, {metadata['error']}")
+        usable.append(os.path.join(directory, file_name))
+    return usable
+
+
+def wav_header(metadata, data_bytes):
+    """Build a canonical 44 byte WAV header for data_bytes of audio in the format of metadata."""
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF",
+        WAV_HEADER_BYTES - 8 + data_bytes,
+        b"WAVE",
+        b"fmt ",
+        16,
+        metadata["format_tag"],
+        metadata["channels"],
+        metadata["sample_rate"],
+        metadata["sample_rate"] * metadata["block_align"],
+        metadata["block_align"],
+        metadata["bits_per_sample"],
+        b"data",
+        data_bytes,
+    )
@@ -0,0 +1,366 @@
+"""
+A local stand-in for the parts of the Google Drive v3 API the pipeline uses.
+
+It serves files().list with queries and paging, files().get for metadata and media
+(with Range requests, so resumed downloads work), files().create and files().update with
+multipart and resumable uploads, and the batch endpoint. Files live in memory. Every
+request can be delayed and a share of them failed with a 503 to model a slow or flaky
+connection.
+
+Use drive_service() to get a googleapiclient service object that talks to the server
+instead of Google.
+"""
+
+import email.parser
+import hashlib
+import itertools
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+FOLDER_MIME_TYPE = "application/vnd.google-apps.folder"
+_TOKEN_PATTERN = re.compile(r"'(?:[^'\\]|\\.)*'|!=|=|\(|\)|[A-Za-z_]+")
+
+
+class _Query:
+    """Evaluates the subset of the Drive query language the pipeline sends."""
+
+    def __init__(self, query):
+        self.tokens = _TOKEN_PATTERN.findall(query or "")
+        self.position = 0
+
+    def _next(self):
+        token = self.tokens[self.position]
+        self.position += 1
+        return token
+
+    def _peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    @staticmethod
+    def _literal(token):
+        if token.startswith("'"):
+            return re.sub(r"\\(.)", r"\1", token[1:-1])
+        return {"true": True, "false": False}.get(token, token)
+
+    def parse(self):
+        if not self.tokens:
+            return lambda file: True
+        return self._or()
+
+    def _or(self):
+        terms = [self._and()]
+        while self._peek() == "or":
+            self._next()
+            terms.append(self._and())
+        return lambda file: any(term(file) for term in terms)
+
+    def _and(self):
+        factors = [self._factor()]
+        while self._peek() == "and":
+            self._next()
+            factors.append(self._factor())
+        return lambda file: all(factor(file) for factor in factors)
+
+    def _factor(self):
+        token = self._next()
+        if token == "not":
+            factor = self._factor()
+            return lambda file: not factor(file)
+        if token == "(":
+            expression = self._or()
+            self._next()
+            return expression
+        if token.startswith("'"):
+            value = self._literal(token)
+            self._next()  # in
+            field = self._next()
+            return lambda file: value in file.get(field, [])
+        operator = self._next()
+        value = self._literal(self._next())
+        if operator == "contains":
+            return lambda file: value in file.get(token, "")
+        if operator == "!=":
+            return lambda file: file.get(token) != value
+        return lambda file: file.get(token) == value
+
+
+class FakeDrive:
+    """
+    An in-memory Drive served over HTTP on localhost.
+
+    Args:
+        latency (float): Seconds to wait before answering each request.
+        failure_rate (float): Share of requests answered with a 503.
+        seed (int): Seed for the failure injection.
+    """
+
+    def __init__(self, latency=0.0, failure_rate=0.0, seed=0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.files = {}
+        self.request_counts = {}
+        self._uploads = {}
+        self._ids = itertools.count(1)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self.root_url = None
+
+    def add_file(self, name, content, mime_type, parents=()):
+        """Store a file and return its ID."""
+        with self._lock:
+            file_id = f"file{next(self._ids)}"
+            self.files[file_id] = {
+                "id": file_id,
+                "name": name,
+                "mimeType": mime_type,
+                "parents": list(parents),
+                "trashed": False,
+                "content": content,
+                "modifiedTime": time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime()),
+            }
+        return file_id
+
+    def start(self):
+        """Start serving on a free port and return the root URL."""
+        drive = self
+
+        class Handler(_Handler):
+            pass
+
+        Handler.drive = drive
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self.root_url = f"http://127.0.0.1:{self._server.server_address[1]}/"
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self.root_url
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def _count(self, kind):
+        with self._lock:
+            self.request_counts[kind] = self.request_counts.get(kind, 0) + 1
+
+    def _metadata(self, file):
+        metadata = {key: value for key, value in file.items() if key != "content"}
+        if file["mimeType"] != FOLDER_MIME_TYPE:
+            metadata["size"] = str(len(file["content"]))
+            metadata["md5Checksum"] = hashlib.md5(file["content"]).hexdigest()
+        return metadata
+
+    def handle(self, method, url, headers, body):
+        """
+        Answer one API request.
+
+        Returns:
+            tuple: The status, the response headers and the response body.
+        """
+        parsed = urlparse(url)
+        path = parsed.path
+        params = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+
+        if path.startswith("/batch/"):
+            return self._batch(headers, body)
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            fail = self._random.random() < self.failure_rate
+        if fail:
+            self._count("failed")
+            return self._error(503, "injected failure")
+
+        if path == "/drive/v3/files" and method == "GET":
+            return self._list(params)
+        if path == "/drive/v3/files" and method == "POST":
+            self._count("create")
+            metadata = json.loads(body or b"{}")
+            file_id = self.add_file(
+                metadata.get("name"),
+                b"",
+                metadata.get("mimeType", "application/octet-stream"),
+                metadata.get("parents", []),
+            )
+            return self._json(self._metadata(self.files[file_id]))
+        if path.startswith("/drive/v3/files/") and method == "GET":
+            file = self.files.get(path.rsplit("/", 1)[-1])
+            if file is None:
+                return self._error(404, "not found")
+            if params.get("alt") == "media":
+                return self._media(file, headers)
+            self._count("get")
+            return self._json(self._metadata(file))
+        if path.startswith("/upload/drive/v3/files"):
+            return self._upload(method, path, params, headers, body)
+        return self._error(404, "not found")
+
+    def _json(self, value, status=200):
+        return status, {"Content-Type": "application/json"}, json.dumps(value).encode()
+
+    def _error(self, status, message):
+        return self._json({"error": {"code": status, "message": message}}, status)
+
+    def _list(self, params):
+        self._count("list")
+        matches = _Query(params.get("q")).parse()
+        files = sorted(
+            (file for file in self.files.values() if matches(file)),
+            key=lambda file: file["id"],
+        )
+        page_size = int(params.get("pageSize", 100))
+        start = int(params.get("pageToken", 0))
+        response = {
+            "files": [self._metadata(file) for file in files[start : start + page_size]]
+        }
+        if start + page_size < len(files):
+            response["nextPageToken"] = str(start + page_size)
+        return self._json(response)
+
+    def _media(self, file, headers):
+        self._count("get_media")
+        content = file["content"]
+        byte_range = headers.get("range") or headers.get("Range")
+        if not byte_range:
+            return 200, {"Content-Type": "application/octet-stream"}, content
+        start, _, end = byte_range.split("=", 1)[1].partition("-")
+        start = int(start)
+        end = min(int(end) if end else len(content) - 1, len(content) - 1)
+        return (
+            206,
+            {
+                "Content-Type": "application/octet-stream",
+                "Content-Range": f"bytes {start}-{end}/{len(content)}",
+            },
+            content[start : end + 1],
+        )
+
+    def _upload(self, method, path, params, headers, body):
+        file_id = path.rsplit("/", 1)[-1] if path.count("/") > 4 else None
+        upload_type = params.get("uploadType")
+
+        if upload_type == "multipart":
+            self._count("upload")
+            content_type = headers.get("content-type") or headers.get("Content-Type")
+            message = email.parser.BytesParser().parsebytes(
+                f"Content-Type: {content_type}\r\n\r\n".encode() + body
+            )
+            metadata_part, media_part = message.get_payload()
+            metadata = json.loads(metadata_part.get_payload(decode=True) or b"{}")
+            return self._store(file_id, metadata, media_part.get_payload(decode=True))
+
+        if upload_type == "media":
+            self._count("upload")
+            return self._store(file_id, {}, body)
+
+        if "upload_id" in params:
+            self._count("upload_chunk")
+            upload = self._uploads[params["upload_id"]]
+            upload["content"] += body
+            total = (headers.get("content-range") or headers.get("Content-Range", "")).rsplit(
+                "/", 1
+            )[-1]
+            if total != "*" and len(upload["content"]) >= int(total):
+                del self._uploads[params["upload_id"]]
+                return self._store(upload["file_id"], upload["metadata"], upload["content"])
+            return 308, {"Range": f"bytes=0-{len(upload['content']) - 1}"}, b""
+
+        self._count("upload_session")
+        upload_id = uuid.uuid4().hex
+        self._uploads[upload_id] = {
+            "file_id": file_id,
+            "metadata": json.loads(body) if body else {},
+            "content": b"",
+        }
+        location = f"{self.root_url.rstrip('/')}{path}?uploadType=resumable&upload_id={upload_id}"
+        return 200, {"Location": location}, b""
+
+    def _store(self, file_id, metadata, content):
+        if file_id:
+            with self._lock:
+                self.files[file_id]["content"] = content
+        else:
+            file_id = self.add_file(
+                metadata.get("name"),
+                content,
+                metadata.get("mimeType", "application/octet-stream"),
+                metadata.get("parents", []),
+            )
+        return self._json({"id": file_id})
+
+    def _batch(self, headers, body):
+        self._count("batch")
+        content_type = headers.get("content-type") or headers.get("Content-Type")
+        message = email.parser.BytesParser().parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode() + body
+        )
+        boundary = f"batch_{uuid.uuid4().hex}"
+        parts = []
+        for part in message.get_payload():
+            request = part.get_payload(decode=True) or part.get_payload().encode()
+            head, _, sub_body = request.partition(b"\r\n\r\n")
+            if not _:
+                head, _, sub_body = request.partition(b"\n\n")
+            lines = head.decode().splitlines()
+            method, url, _ = lines[0].split(" ", 2)
+            sub_headers = dict(
+                line.split(": ", 1) for line in lines[1:] if ": " in line
+            )
+            status, response_headers, response_body = self.handle(
+                method, url, sub_headers, sub_body
+            )
+            # Long Content-IDs arrive folded over several lines.
+            content_id = re.sub(r"\s*\n\s*", " ", part["Content-ID"])
+            response = f"HTTP/1.1 {status} OK\r\n" + "".join(
+                f"{key}: {value}\r\n" for key, value in response_headers.items()
+            )
+            parts.append(
+                f"--{boundary}\r\nContent-Type: application/http\r\n"
+                f"Content-ID: <response-{content_id[1:]}\r\n\r\n"
+                f"{response}\r\n{response_body.decode()}\r\n"
+            )
+        payload = ("".join(parts) + f"--{boundary}--\r\n").encode()
+        return 200, {"Content-Type": f"multipart/mixed; boundary={boundary}"}, payload
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    drive = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _serve(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        status, headers, payload = self.drive.handle(
+            self.command, self.path, dict(self.headers.items()), body
+        )
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    do_GET = do_POST = do_PUT = do_PATCH = _serve
+
+
+def drive_service(root_url):
+    """Build a googleapiclient Drive v3 service that sends every request to root_url."""
+    from googleapiclient.discovery import build_from_document
+    from googleapiclient.discovery_cache import get_static_doc
+    from googleapiclient.http import build_http
+
+    document = json.loads(get_static_doc("drive", "v3"))
+    document["rootUrl"] = root_url
+    document["baseUrl"] = f"{root_url}drive/v3/"
+    # build_http stops httplib2 from treating the 308 of resumable uploads as a redirect.
+    return build_from_document(document, http=build_http())
@@ -0,0 +1,157 @@
+"""
+A local stand-in for the Whisper and Lemonfox transcription endpoints.
+
+It accepts the same multipart form the pipeline posts and answers with a verbose_json
+transcript whose segments cover the duration of the uploaded WAV. Each request takes a
+fixed latency plus a latency per megabyte uploaded, and a share of requests can be
+answered with a 429 carrying a Retry-After header or a 503, to exercise the retry path.
+"""
+
+import email.parser
+import json
+import random
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SEGMENT_SECONDS = 5.0
+
+
+def _wav_duration(content):
+    """Return the duration of WAV bytes in seconds, or 0 if the header cannot be read."""
+    position = 12
+    byte_rate = None
+    while position + 8 <= len(content):
+        chunk_id = content[position : position + 4]
+        (chunk_size,) = struct.unpack("<I", content[position + 4 : position + 8])
+        if chunk_id == b"fmt ":
+            (byte_rate,) = struct.unpack("<I", content[position + 16 : position + 20])
+        elif chunk_id == b"data" and byte_rate:
+            return min(chunk_size, len(content) - position - 8) / byte_rate
+        position += 8 + chunk_size + (chunk_size & 1)
+    return 0.0
+
+
+class FakeTranscriptionAPI:
+    """
+    A transcription endpoint served over HTTP on localhost.
+
+    Args:
+        latency (float): Seconds every request takes.
+        latency_per_mb (float): Extra seconds per megabyte of audio uploaded.
+        failure_rate (float): Share of requests that fail.
+        retry_after (float): Retry-After value sent with the 429 failures.
+        seed (int): Seed for the failure injection.
+    """
+
+    def __init__(
+        self, latency=0.0, latency_per_mb=0.0, failure_rate=0.0, retry_after=1, seed=0
+    ):
+        self.latency = latency
+        self.latency_per_mb = latency_per_mb
+        self.failure_rate = failure_rate
+        self.retry_after = retry_after
+        self.requests = 0
+        self.failures = 0
+        self.bytes_received = 0
+        self.audio_seconds = 0.0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self.url = None
+
+    def start(self):
+        """Start serving on a free port and return the transcription URL."""
+        api = self
+
+        class Handler(_Handler):
+            pass
+
+        Handler.api = api
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self.url = (
+            f"http://127.0.0.1:{self._server.server_address[1]}/v1/audio/transcriptions"
+        )
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self.url
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def transcribe(self, content_type, body):
+        """
+        Answer one transcription request.
+
+        Returns:
+            tuple: The status, the response headers and the response body.
+        """
+        message = email.parser.BytesParser().parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode() + body
+        )
+        audio = b""
+        for part in message.get_payload():
+            if part.get_param("name", header="content-disposition") == "file":
+                audio = part.get_payload(decode=True)
+
+        with self._lock:
+            self.requests += 1
+            self.bytes_received += len(audio)
+            failure = self._random.random() < self.failure_rate
+            status = self._random.choice((429, 503)) if failure else 200
+        time.sleep(self.latency + self.latency_per_mb * len(audio) / 1024 / 1024)
+
+        if status != 200:
+            with self._lock:
+                self.failures += 1
+            headers = {"Content-Type": "application/json"}
+            if status == 429:
+                headers["Retry-After"] = str(self.retry_after)
+            return status, headers, b'{"error": "injected failure"}'
+
+        duration = _wav_duration(audio)
+        with self._lock:
+            self.audio_seconds += duration
+        segments = []
+        start = 0.0
+        while start < duration:
+            end = min(start + SEGMENT_SECONDS, duration)
+            segments.append(
+                {
+                    "id": len(segments),
+                    "start": round(start, 3),
+                    "end": round(end, 3),
+                    "text": f" Segment {len(segments)}.",
+                }
+            )
+            start = end
+        result = {
+            "text": "".join(segment["text"] for segment in segments),
+            "language": "en",
+            "duration": duration,
+            "segments": segments,
+        }
+        return 200, {"Content-Type": "application/json"}, json.dumps(result).encode()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    api = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        status, headers, payload = self.api.transcribe(
+            self.headers.get("Content-Type"), body
+        )
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
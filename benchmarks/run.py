@@ -0,0 +1,312 @@
+"""
+Benchmark the pipeline end to end against local stand-ins for Google Drive and the API.
+
+A synthetic recording day is generated and stored in a fake Drive (fake_drive), then the
+real download_files, chunk_files, new_transcribe and upload_files are run against it with
+a fake Lemonfox endpoint (fake_transcription), inside a temporary data directory with its
+own config.json. Every stage reports its wall time, throughput and the latency
+percentiles of the files it handled, and the results are written as JSON so they can be
+compared between releases.
+
+Usage:
+    python benchmarks/run.py [--scenario small|medium|large] [--workers <n>]
+        [--drive-latency <s>] [--api-latency <s>] [--api-latency-per-mb <s>]
+        [--api-failure-rate <0-1>] [--vad] [--canonical-audio]
+        [--api-encoding wav|flac|opus] [--output-dir <dir>] [--compare <results.json>]
+"""
+
+import argparse
+import datetime
+import functools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from fake_drive import FakeDrive, drive_service  # noqa: E402
+from fake_transcription import FakeTranscriptionAPI  # noqa: E402
+from synthetic_audio import SCENARIOS, make_day  # noqa: E402
+
+DATE_PREFIX = "20240101"
+
+
+def percentile(values, fraction):
+    """Return the nearest-rank percentile of values."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+
+class StageTimer:
+    """Collects the duration and size of every file a stage handles."""
+
+    def __init__(self):
+        self.latencies = []
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    def wrap(self, func, size_of):
+        """Return func timed per call, counting size_of(*args) bytes for each call."""
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                with self._lock:
+                    self.latencies.append(elapsed)
+                    self.bytes += size_of(*args)
+
+        return wrapper
+
+    def report(self, wall_seconds):
+        return {
+            "wall_seconds": round(wall_seconds, 4),
+            "items": len(self.latencies),
+            "bytes": self.bytes,
+            "items_per_second": round(len(self.latencies) / wall_seconds, 3)
+            if wall_seconds
+            else None,
+            "mb_per_second": round(self.bytes / 1024 / 1024 / wall_seconds, 3)
+            if wall_seconds
+            else None,
+            "latency_ms": {
+                name: round(percentile(self.latencies, fraction) * 1000, 2)
+                if self.latencies
+                else None
+                for name, fraction in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99), ("max", 1))
+            },
+        }
+
+
+def write_config(workspace, api_url, chunk_mb, extra=None):
+    """Write the config.json of the benchmark run and point the pipeline at it."""
+    config = {
+        "data_dir": os.path.join(workspace, "data"),
+        "TOKEN_FILE": os.path.join(workspace, "token.json"),
+        "CREDENTIALS_FILE": os.path.join(workspace, "credentials.json"),
+        "DRIVE_ID": "benchmark-drive",
+        "lemonfoxAPIURL": api_url,
+        "whisperAPIURL": api_url,
+        "audio_prompt": "Drive-through order.",
+        "lemonfox_api_file_size_limit": chunk_mb,
+        "whisper_api_file_size_limit": chunk_mb,
+        "lemonfox_api_requests_per_minute": 100000,
+        "lemonfox_api_mb_per_minute": 1000000,
+        **(extra or {}),
+    }
+    path = os.path.join(workspace, "config.json")
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(config, file, indent=2)
+    os.environ["TRANSCRIBE_CONFIG"] = path
+    return config
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=REPO_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args, workspace):
+    """Run every stage once and return the results."""
+    scenario = SCENARIOS[args.scenario]
+    drive = FakeDrive(latency=args.drive_latency)
+    api = FakeTranscriptionAPI(
+        latency=args.api_latency,
+        latency_per_mb=args.api_latency_per_mb,
+        failure_rate=args.api_failure_rate,
+        retry_after=args.api_retry_after,
+    )
+    drive.start()
+    write_config(
+        workspace, api.start(), scenario["chunk_mb"], {"vad_enabled": args.vad}
+    )
+
+    print(f"Generating the {args.scenario} day...")
+    audio_seconds = 0
+    for path in make_day(os.path.join(workspace, "source"), DATE_PREFIX, args.scenario):
+        with open(path, "rb") as file:
+            drive.add_file(os.path.basename(path), file.read(), "audio/wav")
+        audio_seconds += scenario["minutes"] * 60
+
+    # Imported only now, so the modules read the benchmark's config.json.
+    import google_drive_functions
+    import main
+    import metrics
+    import transcribe_api
+
+    service = drive_service(drive.root_url)
+    google_drive_functions.create_directory(
+        os.path.join(workspace, "data", DATE_PREFIX, "Text")
+    )
+    thread_services = threading.local()
+
+    def get_thread_service():
+        if not hasattr(thread_services, "service"):
+            thread_services.service = drive_service(drive.root_url)
+        return thread_services.service
+
+    google_drive_functions.get_thread_service = get_thread_service
+
+    timers = {name: StageTimer() for name in ("download", "chunk", "transcribe", "upload")}
+    google_drive_functions._download_item = timers["download"].wrap(
+        google_drive_functions._download_item,
+        lambda service, item, *args: int(item.get("size", 0)),
+    )
+    main.chunk_file = timers["chunk"].wrap(
+        main.chunk_file, lambda date_prefix, audio_file, metadata, *args: metadata["size"]
+    )
+    transcribe_api._transcribe_file = timers["transcribe"].wrap(
+        transcribe_api._transcribe_file,
+        lambda file_path, *args: os.path.getsize(file_path),
+    )
+    google_drive_functions._upload_file = timers["upload"].wrap(
+        google_drive_functions._upload_file,
+        lambda service, file_path, *args: os.path.getsize(file_path),
+    )
+
+    stages = {
+        "download": lambda: google_drive_functions.download_files(
+            service, DATE_PREFIX, "Audio", workers=args.workers
+        ),
+        "chunk": lambda: main.chunk_files(
+            DATE_PREFIX,
+            scenario["chunk_mb"],
+            workers=args.workers,
+            canonical=args.canonical_audio,
+            encoding=args.api_encoding,
+        ),
+        "transcribe": lambda: transcribe_api.new_transcribe(
+            DATE_PREFIX, "lemonfox", "benchmark-key", workers=args.workers
+        ),
+        "upload": lambda: google_drive_functions.upload_files(
+            service, DATE_PREFIX, "Text", workers=args.workers
+        ),
+    }
+    results = {}
+    for name, stage in stages.items():
+        print(f"Running {name}...")
+        start = time.perf_counter()
+        stage()
+        results[name] = timers[name].report(time.perf_counter() - start)
+
+    results["transcribe"]["retries"] = transcribe_api.get_retry_stats().get(
+        "lemonfox", {}
+    )
+    drive.stop()
+    api.stop()
+    return {
+        "scenario": args.scenario,
+        "scenario_settings": scenario,
+        "audio_seconds": audio_seconds,
+        "settings": {
+            "workers": args.workers,
+            "drive_latency": args.drive_latency,
+            "api_latency": args.api_latency,
+            "api_latency_per_mb": args.api_latency_per_mb,
+            "api_failure_rate": args.api_failure_rate,
+            "vad": args.vad,
+            "canonical_audio": args.canonical_audio,
+            "api_encoding": args.api_encoding,
+        },
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "stages": results,
+        "stage_metrics": metrics.get_stage_metrics(),
+        "drive_requests": drive.request_counts,
+        "api_requests": {
+            "requests": api.requests,
+            "failures": api.failures,
+            "bytes": api.bytes_received,
+        },
+    }
+
+
+def compare(results, baseline_path):
+    """Print the change in throughput and latency of each stage against a baseline run."""
+    with open(baseline_path, "r", encoding="utf-8") as file:
+        baseline = json.load(file)
+    print(f"\nCompared with {baseline_path} ({baseline.get('revision')}):")
+    for name, stage in results["stages"].items():
+        before = baseline["stages"].get(name)
+        if not before or not before["wall_seconds"]:
+            continue
+        print(
+            f"{name:12} wall {stage['wall_seconds'] / before['wall_seconds']:6.2f}x  "
+            f"p90 {stage['latency_ms']['p90']} ms (was {before['latency_ms']['p90']} ms)"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline end to end.")
+    parser.add_argument("--scenario", choices=SCENARIOS, default="small")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--drive-latency", type=float, default=0.01)
+    parser.add_argument("--api-latency", type=float, default=0.2)
+    parser.add_argument("--api-latency-per-mb", type=float, default=0.05)
+    parser.add_argument("--api-failure-rate", type=float, default=0.0)
+    parser.add_argument("--api-retry-after", type=float, default=1)
+    parser.add_argument("--vad", help="Trim silence before transcription", action="store_true")
+    parser.add_argument(
+        "--canonical-audio",
+        help="Convert recordings to 16 kHz mono before chunking",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--api-encoding",
+        help="Format of the chunks sent to the API (flac and opus need ffmpeg)",
+        choices=["wav", "flac", "opus"],
+        default="wav",
+    )
+    parser.add_argument(
+        "--output-dir", default=os.path.join(BENCHMARK_DIR, "results")
+    )
+    parser.add_argument("--compare", help="A results JSON file to compare against")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workspace:
+        results = run(args, workspace)
+
+    print()
+    for name, stage in results["stages"].items():
+        print(
+            f"{name:12} {stage['items']:4} files {stage['wall_seconds']:8.2f}s "
+            f"{stage['mb_per_second'] or 0:8.2f} MB/s  "
+            f"p50 {stage['latency_ms']['p50']} ms  p99 {stage['latency_ms']['p99']} ms"
+        )
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    output = os.path.join(
+        args.output_dir,
+        f"{results['timestamp'].replace(':', '-')}_{args.scenario}.json",
+    )
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump(results, file, indent=2)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Measure how long main.py takes to start for each mode.
+
+Each mode is timed in a fresh interpreter: importing main, then the libraries that mode
+imports when its stage runs. Nothing is downloaded or transcribed, and config.json is not
+needed since it is only read once a setting is used. Libraries that are not installed are
+reported as unavailable rather than failing the run.
+
+Usage:
+    python benchmarks/startup.py [--repeat <n>] [--output <file.json>]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODES = {
+    "cli": [],
+    "download": ["googleapiclient.discovery", "googleapiclient.http"],
+    "upload": ["googleapiclient.discovery", "googleapiclient.http"],
+    "api": ["requests", "requests.adapters"],
+    "whisper": ["torch", "whisper"],
+    "ctranslate2": ["faster_whisper"],
+}
+
+TIMING_SCRIPT = """
+import importlib, json, sys, time
+start = time.perf_counter()
+import main
+main_seconds = time.perf_counter() - start
+for module in sys.argv[1:]:
+    importlib.import_module(module)
+print(json.dumps({"main": main_seconds, "total": time.perf_counter() - start}))
+"""
+
+
+def time_mode(modules, repeat):
+    """
+    Import main and modules in a fresh interpreter repeat times.
+
+    Returns:
+        dict: The median seconds to import main and to import everything, or the error
+        if one of the modules could not be imported.
+    """
+    runs = []
+    for _ in range(repeat):
+        result = subprocess.run(
+            [sys.executable, "-c", TIMING_SCRIPT, *modules],
+            cwd=REPO_DIR,
+            capture_output=True,
+            text=True,
+        )
+        if result.returncode != 0:
+            return {"error": result.stderr.strip().splitlines()[-1]}
+        runs.append(json.loads(result.stdout.strip().splitlines()[-1]))
+    return {
+        "main_seconds": statistics.median(run["main"] for run in runs),
+        "total_seconds": statistics.median(run["total"] for run in runs),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure main.py startup time per mode.")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = {}
+    for mode, modules in MODES.items():
+        results[mode] = time_mode(modules, args.repeat)
+        if "error" in results[mode]:
+            print(f"{mode:12} unavailable: {results[mode]['error']}")
+        else:
+            print(
+                f"{mode:12} main {results[mode]['main_seconds'] * 1000:7.1f}ms  "
+                f"total {results[mode]['total_seconds'] * 1000:7.1f}ms"
+            )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Generate synthetic recording days for the benchmarks.
+
+Recordings alternate bursts of speech-like tones with stretches of near silence, like the
+drive-through recordings the pipeline processes, in whatever sample rate, channel count
+and bit depth is asked for. Audio is written in one second blocks chosen from a few
+precomputed ones, so generating hours of audio takes seconds.
+
+SCENARIOS describes the recording days the benchmark suite runs on, with the API file
+size limit each one is chunked to.
+"""
+
+import math
+import os
+import random
+import struct
+
+SCENARIOS = {
+    "small": {
+        "files": 4,
+        "minutes": 2,
+        "sample_rate": 16000,
+        "channels": 1,
+        "bits": 16,
+        "chunk_mb": 1,
+    },
+    "medium": {
+        "files": 8,
+        "minutes": 10,
+        "sample_rate": 44100,
+        "channels": 2,
+        "bits": 16,
+        "chunk_mb": 10,
+    },
+    "large": {
+        "files": 12,
+        "minutes": 30,
+        "sample_rate": 48000,
+        "channels": 2,
+        "bits": 24,
+        "chunk_mb": 25,
+    },
+}
+
+
+def _block(seconds, sample_rate, channels, bits, speech, rng):
+    """Return one block of interleaved PCM, speech-like tones or low noise."""
+    max_value = 2 ** (bits - 1) - 1
+    tones = [rng.uniform(120, 300), rng.uniform(500, 1500), rng.uniform(2000, 3500)]
+    samples = []
+    for index in range(int(seconds * sample_rate)):
+        t = index / sample_rate
+        if speech:
+            envelope = 0.5 + 0.5 * math.sin(2 * math.pi * 4 * t)
+            value = envelope * sum(
+                math.sin(2 * math.pi * tone * t) / (n + 1) for n, tone in enumerate(tones)
+            ) / 1.9
+            value += rng.uniform(-0.02, 0.02)
+        else:
+            value = rng.uniform(-0.002, 0.002)
+        sample = int(max(-1.0, min(1.0, value * 0.6)) * max_value)
+        samples.extend([sample] * channels)
+    if bits == 16:
+        return struct.pack(f"<{len(samples)}h", *samples)
+    if bits == 24:
+        return b"".join(struct.pack("<i", sample)[:3] for sample in samples)
+    return struct.pack(f"<{len(samples)}i", *samples)
+
+
+def write_wav(
+    path, seconds, sample_rate=16000, channels=1, bits=16, speech_ratio=0.4, seed=0
+):
+    """
+    Write a synthetic recording of the given length and format.
+
+    Args:
+        path (str): The file to write.
+        seconds (int): Length of the recording in seconds.
+        sample_rate (int): Samples per second.
+        channels (int): Number of channels.
+        bits (int): Bits per sample, 16, 24 or 32.
+        speech_ratio (float): Share of the seconds that contain speech.
+        seed (int): Seed choosing where the speech falls.
+
+    Returns:
+        int: The size of the file in bytes.
+    """
+    rng = random.Random(seed)
+    speech_blocks = [
+        _block(1, sample_rate, channels, bits, True, rng) for _ in range(3)
+    ]
+    silence_block = _block(1, sample_rate, channels, bits, False, rng)
+    block_align = channels * bits // 8
+    data_bytes = seconds * sample_rate * block_align
+
+    with open(path, "wb") as file:
+        file.write(
+            struct.pack(
+                "<4sI4s4sIHHIIHH4sI",
+                b"RIFF",
+                36 + data_bytes,
+                b"WAVE",
+                b"fmt ",
+                16,
+                1,
+                channels,
+                sample_rate,
+                sample_rate * block_align,
+                block_align,
+                bits,
+                b"data",
+                data_bytes,
+            )
+        )
+        speaking = False
+        for _ in range(seconds):
+            # Speech and silence come in runs of a few seconds rather than alternating.
+            if rng.random() < 0.2:
+                speaking = rng.random() < speech_ratio
+            file.write(rng.choice(speech_blocks) if speaking else silence_block)
+    return os.path.getsize(path)
+
+
+def make_day(directory, date_prefix, scenario):
+    """
+    Write the recordings of one scenario day into directory.
+
+    Returns:
+        list: The paths of the recordings.
+    """
+    settings = SCENARIOS[scenario]
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for index in range(settings["files"]):
+        path = os.path.join(directory, f"{date_prefix}_recording{index}.wav")
+        write_wav(
+            path,
+            settings["minutes"] * 60,
+            settings["sample_rate"],
+            settings["channels"],
+            settings["bits"],
+            seed=index,
+        )
+        paths.append(path)
+    return paths
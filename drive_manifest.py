@@ -0,0 +1,108 @@
+"""
+This module keeps a local manifest of Google Drive listings so repeated runs for the same
+query can be answered without going back to Drive.
+
+The manifest is a JSON file stored in the data directory, keyed by the Drive query string.
+Each entry records when the listing was fetched and the file metadata that was returned.
+A second file caches the IDs of the Drive folders uploads go into, keyed by folder path.
+
+Functions:
+- load_manifest(): Load the manifest from disk.
+- get_cached_listing(query, max_age=None): Return a cached listing if it is still fresh.
+- store_listing(query, files): Store a listing in the manifest.
+- load_folder_cache(): Load the cached folder path to folder ID mapping.
+- save_folder_cache(folders): Write the folder path to folder ID mapping.
+"""
+
+import json
+import os
+import threading
+import time
+
+from settings import config, data_dir
+
+MANIFEST_FILE_NAME = "drive_manifest.json"
+FOLDER_CACHE_FILE_NAME = "drive_folders.json"
+
+_manifest_lock = threading.Lock()
+
+
+def _manifest_file():
+    return os.path.join(data_dir(), MANIFEST_FILE_NAME)
+
+
+def _folder_cache_file():
+    return os.path.join(data_dir(), FOLDER_CACHE_FILE_NAME)
+
+
+def load_manifest():
+    """Load the manifest from disk, returning an empty one if missing or unreadable."""
+    manifest_file = _manifest_file()
+    if not os.path.exists(manifest_file):
+        return {}
+    try:
+        with open(manifest_file, "r", encoding="utf-8") as file:
+            return json.load(file)
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable manifest {manifest_file}: {e}")
+        return {}
+
+
+def get_cached_listing(query, max_age=None):
+    """
+    Return the cached files for query, or None if there is no entry or it is stale.
+
+    Args:
+        query (str): The Drive query string the listing was made with.
+        max_age (float): Maximum age of the entry in seconds, by default
+            "manifest_max_age_seconds" from config.json.
+    """
+    if max_age is None:
+        max_age = config.get("manifest_max_age_seconds", 3600)
+    entry = load_manifest().get(query)
+    if not entry or time.time() - entry["fetched_at"] > max_age:
+        return None
+    return entry["files"]
+
+
+def store_listing(query, files):
+    """
+    Store the files returned for query in the manifest.
+
+    The manifest is written to a temporary file first and then moved into place so an
+    interrupted run never leaves a half written manifest behind. Threads store their
+    listings one at a time, so none of them is lost to a concurrent update.
+    """
+    with _manifest_lock:
+        manifest = load_manifest()
+        manifest[query] = {"fetched_at": time.time(), "files": files}
+
+        manifest_file = _manifest_file()
+        os.makedirs(data_dir(), exist_ok=True)
+        tmp_file = f"{manifest_file}.tmp.{os.getpid()}.{threading.get_ident()}"
+        with open(tmp_file, "w", encoding="utf-8") as file:
+            json.dump(manifest, file)
+        os.replace(tmp_file, manifest_file)
+
+
+def load_folder_cache():
+    """Load the cached Drive folder path to folder ID mapping."""
+    cache_file = _folder_cache_file()
+    if not os.path.exists(cache_file):
+        return {}
+    try:
+        with open(cache_file, "r", encoding="utf-8") as file:
+            return json.load(file)
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable folder cache {cache_file}: {e}")
+        return {}
+
+
+def save_folder_cache(folders):
+    """Write the Drive folder path to folder ID mapping to disk."""
+    cache_file = _folder_cache_file()
+    os.makedirs(data_dir(), exist_ok=True)
+    tmp_file = f"{cache_file}.tmp"
+    with open(tmp_file, "w", encoding="utf-8") as file:
+        json.dump(folders, file, indent=2)
+    os.replace(tmp_file, cache_file)
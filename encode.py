@@ -0,0 +1,197 @@
+"""
+This module encodes the chunks sent to a transcription API as FLAC or Opus with ffmpeg.
+
+WAV chunks carry raw PCM, so each request holds only as much audio as fits the API's
+size limit uncompressed. FLAC is lossless and typically halves the size of speech, and
+Opus at a speech bitrate ("opus_bitrate_kbps" in config.json, 32 by default) is a small
+fraction of that. Both are accepted by the Whisper and Lemonfox APIs, so a recording
+goes up in fewer, smaller requests.
+
+How large FLAC audio is cannot be known before it is encoded, so a stretch from the
+middle of the recording is encoded first to measure its bytes per second. Opus is
+encoded with constrained VBR, which keeps it within a few percent of its bitrate, so its
+bytes per second follow from the bitrate without a probe. The chunk duration is set from
+that to fit the limit with some margin. The chunks are then
+encoded from the recording directly, one single-threaded ffmpeg process each with up to
+workers running at once, so a long recording is encoded on several cores. If a chunk
+still comes out over the limit, the recording is encoded again in more, shorter chunks.
+
+ffmpeg must be on the PATH.
+
+Functions:
+- is_encoded(file_name): Check whether a file is a FLAC or Opus chunk.
+- encode_chunks(file_path, target_size_mb, date_prefix, encoding, workers=1, metadata=None, canonical=False): Encode a WAV file into chunks that fit the size limit.
+"""
+
+import math
+import os
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from audio_metadata import get_metadata
+from metrics import record_metrics
+from resample import TARGET_SAMPLE_RATE
+from settings import config, data_dir
+
+ENCODINGS = {
+    "flac": {"extension": ".flac", "args": ["-c:a", "flac"]},
+    # Opus is always sent as 16 kHz mono, the bandwidth its speech mode is tuned for.
+    "opus": {
+        "extension": ".ogg",
+        "args": [
+            "-c:a",
+            "libopus",
+            "-application",
+            "voip",
+            "-ac",
+            "1",
+            "-ar",
+            str(TARGET_SAMPLE_RATE),
+            "-vbr",
+            "constrained",
+        ],
+    },
+}
+CANONICAL_ARGS = ["-ac", "1", "-ar", str(TARGET_SAMPLE_RATE), "-sample_fmt", "s16"]
+PROBE_SECONDS = 60
+# Chunks are sized to this share of the limit, as the bitrate varies along a recording.
+SIZE_MARGIN = 0.9
+MAX_ATTEMPTS = 3
+
+
+def is_encoded(file_name):
+    """Check whether a file is a chunk in one of the encodings of this module."""
+    extension = os.path.splitext(file_name)[1]
+    return any(extension == encoding["extension"] for encoding in ENCODINGS.values())
+
+
+def _encoder_args(encoding, canonical):
+    """Return the ffmpeg output options of an encoding."""
+    args = list(ENCODINGS[encoding]["args"])
+    if encoding == "opus":
+        args += ["-b:a", f"{config.get('opus_bitrate_kbps', 32)}k"]
+    elif canonical:
+        args += CANONICAL_ARGS
+    return args
+
+
+def _encode(file_path, output_path, args, start, duration=None):
+    """
+    Encode duration seconds of file_path from start, or up to its end, to output_path.
+
+    Returns:
+        int: The size of the encoded file in bytes.
+
+    Raises:
+        RuntimeError: If ffmpeg is missing or fails.
+    """
+    command = ["ffmpeg", "-nostdin", "-hide_banner", "-loglevel", "error", "-y"]
+    command += ["-ss", f"{start:.6f}"]
+    if duration is not None:
+        command += ["-t", f"{duration:.6f}"]
+    command += ["-i", file_path, "-map_metadata", "-1", "-threads", "1", *args]
+    try:
+        result = subprocess.run(command + [output_path], capture_output=True, text=True)
+    except FileNotFoundError:
+        raise RuntimeError("ffmpeg is needed to encode chunks but is not on the PATH")
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg could not encode {output_path}: {result.stderr.strip()}")
+    return os.path.getsize(output_path)
+
+
+def _bytes_per_second(file_path, duration, args, extension):
+    """Encode up to PROBE_SECONDS from the middle of a recording and return its bitrate."""
+    probe_seconds = min(PROBE_SECONDS, duration)
+    descriptor, probe_path = tempfile.mkstemp(suffix=extension, prefix="probe_")
+    os.close(descriptor)
+    try:
+        size = _encode(
+            file_path, probe_path, args, (duration - probe_seconds) / 2, probe_seconds
+        )
+    finally:
+        os.remove(probe_path)
+    return size / max(probe_seconds, 0.001)
+
+
+def encode_chunks(
+    file_path,
+    target_size_mb,
+    date_prefix,
+    encoding,
+    workers=1,
+    metadata=None,
+    canonical=False,
+):
+    """
+    Encode a WAV file into chunks of at most target_size_mb megabytes.
+
+    Args:
+        file_path (str): Path to the WAV file.
+        target_size_mb (float): The size limit of a chunk in megabytes.
+        date_prefix (str): Date prefix of the recordings, used to name the chunks.
+        encoding (str): "flac" or "opus".
+        workers (int): Number of chunks to encode concurrently.
+        metadata (dict): The header metadata of the file from audio_metadata, read if
+            not given.
+        canonical (bool): Downmix FLAC to 16 kHz 16 bit mono, see resample.
+
+    Returns:
+        list: The names of the chunk files, written to the Audio directory of the date.
+
+    Raises:
+        RuntimeError: If ffmpeg fails, or the chunks stay over the limit.
+    """
+    metadata = metadata or get_metadata(file_path)
+    target_size_bytes = target_size_mb * 1024 * 1024
+    duration = metadata["duration"]
+    args = _encoder_args(encoding, canonical)
+    extension = ENCODINGS[encoding]["extension"]
+    file_name = os.path.splitext(os.path.basename(file_path))[0]
+    audio_dir = f"{data_dir()}/{date_prefix}/Audio"
+
+    if encoding == "opus":
+        bytes_per_second = config.get("opus_bitrate_kbps", 32) * 1000 / 8
+    else:
+        bytes_per_second = _bytes_per_second(file_path, duration, args, extension)
+    total_chunks = max(
+        1, math.ceil(duration * bytes_per_second / (target_size_bytes * SIZE_MARGIN))
+    )
+    for _ in range(MAX_ATTEMPTS):
+        chunk_seconds = duration / total_chunks
+        chunk_names = [
+            f"{date_prefix}_chunk{i}_{file_name}{extension}" for i in range(total_chunks)
+        ]
+
+        def export(i):
+            print("encoding", chunk_names[i])
+            # The last chunk runs to the end, so no frames are lost to rounding.
+            return _encode(
+                file_path,
+                f"{audio_dir}/{chunk_names[i]}",
+                args,
+                i * chunk_seconds,
+                chunk_seconds if i < total_chunks - 1 else None,
+            )
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            sizes = list(executor.map(export, range(total_chunks)))
+        if max(sizes) <= target_size_bytes:
+            break
+        # Every name of the shorter split is reused, so no stale chunks are left.
+        total_chunks = math.ceil(
+            total_chunks * max(sizes) / (target_size_bytes * SIZE_MARGIN)
+        )
+    else:
+        raise RuntimeError(
+            f"Could not encode {file_path} into chunks under {target_size_mb}mb"
+        )
+
+    print("Total chunks = ", total_chunks)
+    record_metrics(
+        "chunk",
+        bytes=metadata["data_bytes"],
+        chunks=total_chunks,
+        encoded_bytes=sum(sizes),
+    )
+    return chunk_names
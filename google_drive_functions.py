@@ -4,30 +4,46 @@ This module provides functions for interacting with Google Drive, including crea
 Functions:
 - create_directory(path): Create a directory if it does not exist.
 - find_or_create_folder(service, folder_name, parent_id=None, drive_id=None): Find a folder by name or create it if it doesn't exist.
-- download_files(service, date_prefix, file_type): Download files from Google Drive with a specific prefix and type.
+- resolve_folder_paths(service, paths, drive_id=None): Resolve folder paths to IDs through a persistent cache and batch requests.
+- list_drive_files(service, query, refresh=False): List every file matching a query, using the local manifest cache.
+- download_files(service, date_prefix, file_type, workers=1, refresh=False): Download files from Google Drive with a specific prefix and type.
+- list_date_files(service, date_prefix, file_type, refresh=False): List the Drive files of a date and type.
+- download_file(service, item, date_prefix, file_type): Download one listed Drive file of a date.
+- download_transcript_files(service, workers=1, refresh=False): Download the annotated transcript files from Google Drive.
 - authenticate_google_drive(): Authenticate with Google Drive and return the service object.
-- upload_files(service, date_prefix, file_type, drive_id=DRIVE_ID, model="base"): Upload files to a specific path in Google Drive.
+- get_thread_service(): Return a Drive service object owned by the calling thread.
+- file_md5(path): Return the md5 digest of a local file, for comparison with Drive's md5Checksum.
+- upload_files(service, date_prefix, file_type, drive_id=None, model="base", workers=1, delta=False, in_place=False, pending_only=False): Upload files to a specific path in Google Drive, optionally only the new or changed ones.
+- UploadTarget(service, date_prefix, drive_id=None, model="base", delta=False, in_place=False): The Drive folder the transcripts of a date are uploaded into.
+- upload_file(service, file_path, date_prefix, target): Upload one file into an UploadTarget.
 """
 
 import io
 import os
 import datetime
-import json
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload, MediaIoBaseDownload
-
-with open("config.json", "r", encoding="utf-8") as f:
-    config = json.load(f)
+from drive_manifest import (
+    get_cached_listing,
+    load_folder_cache,
+    save_folder_cache,
+    store_listing,
+)
+from job_store import record_stage, stage_done
+from metrics import record_metrics
+from settings import config, data_dir
 
 SCOPES = ["https://www.googleapis.com/auth/drive"]
-DATA_DIR = config["data_dir"]
-TOKEN_FILE = config["TOKEN_FILE"]
-CREDENTIALS_FILE = config["CREDENTIALS_FILE"]
-DRIVE_ID = config["DRIVE_ID"]
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+DOWNLOAD_CHUNK_SIZE = 100 * 1024 * 1024
+FOLDER_MIME_TYPE = "application/vnd.google-apps.folder"
+LIST_FIELDS = "nextPageToken, files(id, name, size, md5Checksum, modifiedTime)"
+
+_credentials = None
+_thread_local = threading.local()
 
 
 def create_directory(path):
@@ -36,16 +52,47 @@ def create_directory(path):
         os.makedirs(path)
 
 
-def find_or_create_folder(service, folder_name, parent_id=None, drive_id=None):
-    """Find a folder by name or create it if it doesn't exist."""
-    query = f'mimeType="application/vnd.google-apps.folder" and name="{folder_name}"'
+def _escape_query_value(value):
+    """Escape a value for use inside a single quoted Drive query string."""
+    return value.replace("\\", "\\\\").replace("'", "\\'")
+
+
+def _folder_query(folder_name, parent_id=None):
+    """Build the Drive query matching a folder by name and, optionally, parent."""
+    query = (
+        f"mimeType='{FOLDER_MIME_TYPE}' and trashed=false "
+        f"and name='{_escape_query_value(folder_name)}'"
+    )
     if parent_id:
-        query += f' and "{parent_id}" in parents'
+        query += f" and '{_escape_query_value(parent_id)}' in parents"
+    return query
+
 
+def _create_folder(service, folder_name, parent_id=None):
+    """Create a folder and return its ID."""
+    folder_metadata = {
+        "name": folder_name,
+        "mimeType": FOLDER_MIME_TYPE,
+        "parents": [parent_id] if parent_id else [],
+    }
+    folder = (
+        service.files()
+        .create(
+            body=folder_metadata,
+            supportsAllDrives=True,
+            fields="id",
+        )
+        .execute()
+    )
+    return folder.get("id")
+
+
+def find_or_create_folder(service, folder_name, parent_id=None, drive_id=None):
+    """Find a folder by name or create it if it doesn't exist."""
     response = (
         service.files()
         .list(
-            q=query,
+            q=_folder_query(folder_name, parent_id),
             spaces="drive",
             corpora="drive",
             driveId=drive_id,
@@ -57,185 +104,946 @@ def find_or_create_folder(service, folder_name, parent_id=None, drive_id=None):
     folder = response.get("files")
 
     if not folder:
-        folder_metadata = {
-            "name": folder_name,
-            "mimeType": "application/vnd.google-apps.folder",
-            "parents": [parent_id] if parent_id else [],
-        }
-        folder = (
-            service.files()
-            .create(
-                body=folder_metadata,
-                supportsAllDrives=True,
-                fields="id",
-            )
-            .execute()
-        )
-        return folder.get("id")
+        return _create_folder(service, folder_name, parent_id)
 
     return folder[0].get("id")
 
 
-def download_transcript_files(service):
+def _execute_batch(service, requests):
     """
-    Download files from Google Drive with a specific prefix and type.
+    Execute requests through the Drive batch endpoint in a single round trip.
+
+    Args:
+        service: The Drive service object.
+        requests (dict): Mapping of request key to HttpRequest.
+
+    Returns:
+        dict: Mapping of request key to the response, or None where the request failed.
     """
-    try:
-        file_path = f"{DATA_DIR}/transcripts/"
-        create_directory(file_path)
-        query = (
-            f"name contains 'af_24' or name contains 'bs_24' or name contains 'fp_24' or name contains 'ik_24'  or name contains 'jbjc_24' or name contains 'tc_24' or name contains 'jlyc_24' or name contains 'yx_24' or name contains 'ajh_24' or name contains 'mz_24' or name contains 'pg_24'"
+    responses = {}
+
+    def callback(request_id, response, exception):
+        responses[request_id] = None if exception else response
+
+    batch = service.new_batch_http_request(callback=callback)
+    for key, request in requests.items():
+        batch.add(request, request_id=key)
+    batch.execute()
+    return responses
+
+
+def _validate_cached_folders(service, cached):
+    """
+    Check cached folder IDs with one batched files().get round trip.
+
+    Args:
+        service: The Drive service object.
+        cached (dict): Mapping of cache key to (folder ID, expected parent ID).
+
+    Returns:
+        set: The cache keys whose folders still exist, are not trashed and still
+        have the expected parent.
+    """
+    responses = _execute_batch(
+        service,
+        {
+            key: service.files().get(
+                fileId=folder_id, fields="id, trashed, parents", supportsAllDrives=True
+            )
+            for key, (folder_id, _) in cached.items()
+        },
+    )
+    valid = set()
+    for key, (_, parent_id) in cached.items():
+        response = responses.get(key)
+        if not response or response.get("trashed"):
+            continue
+        if parent_id and parent_id not in response.get("parents", []):
+            continue
+        valid.add(key)
+    return valid
+
+
+def _folder_list_request(service, folder_name, parent_id, drive_id, page_token=None):
+    """Build the request for one page of the folders named folder_name under parent_id."""
+    return service.files().list(
+        q=_folder_query(folder_name, parent_id),
+        spaces="drive",
+        corpora="drive",
+        driveId=drive_id,
+        includeItemsFromAllDrives=True,
+        supportsAllDrives=True,
+        pageSize=1000,
+        pageToken=page_token,
+        fields="nextPageToken, files(id, parents)",
+    )
+
+
+def _list_all_folders(service, folder_name, parent_id, drive_id, first_page=None):
+    """
+    Return every folder named folder_name under parent_id, following all result pages.
+
+    first_page is a response already fetched, e.g. through a batch. If it is missing
+    because its request failed, the first page is requested again, so a failure raises
+    rather than looking like a folder that does not exist.
+    """
+    folders = []
+    response = first_page
+    page_token = None
+    while True:
+        if response is None:
+            response = _folder_list_request(
+                service, folder_name, parent_id, drive_id, page_token
+            ).execute()
+        folders.extend(response.get("files", []))
+        page_token = response.get("nextPageToken")
+        if not page_token:
+            break
+        response = None
+    if parent_id:
+        folders = [folder for folder in folders if parent_id in folder.get("parents", [])]
+    return folders
+
+
+def resolve_folder_paths(service, paths, drive_id=None):
+    """
+    Resolve Drive folder paths to folder IDs, creating any folders that are missing.
+
+    IDs are kept in a persistent path to ID cache. On a warm run every cached ID is
+    validated with a single batch request and nothing else is sent. Folders missing
+    from the cache are looked up by name with one batch of list requests per level of
+    the tree, each scoped to the ID of its parent from the level above, and only folders
+    that do not exist at all are created.
+
+    Args:
+        service: The Drive service object.
+        paths (list): Folder paths as tuples of folder names, including the path of every
+            parent of a path.
+        drive_id (str): The shared drive to resolve the folders in, by default
+            "DRIVE_ID" from config.json.
+
+    Returns:
+        dict: Mapping of each path tuple to its folder ID.
+    """
+    drive_id = drive_id or config["DRIVE_ID"]
+    folder_cache = load_folder_cache()
+
+    def cache_key(path):
+        return f"{drive_id}:{'/'.join(path)}"
+
+    folder_ids = {}
+    cached = {}
+    for path in paths:
+        key = cache_key(path)
+        if key in folder_cache:
+            parent_key = cache_key(path[:-1]) if len(path) > 1 else None
+            cached[key] = (folder_cache[key], folder_cache.get(parent_key))
+
+    if cached:
+        valid = _validate_cached_folders(service, cached)
+        for path in paths:
+            key = cache_key(path)
+            if key in valid:
+                folder_ids[path] = folder_cache[key]
+            else:
+                folder_cache.pop(key, None)
+
+    # One level at a time, so every lookup is scoped to the folder ID of its parent and
+    # a folder of the same name under another parent is never mistaken for it.
+    for depth in sorted({len(path) for path in paths}):
+        missing = [
+            path for path in paths if len(path) == depth and path not in folder_ids
+        ]
+        if not missing:
+            continue
+        parent_ids = {
+            path: folder_ids[path[:-1]] if len(path) > 1 else None for path in missing
+        }
+        responses = _execute_batch(
+            service,
+            {
+                cache_key(path): _folder_list_request(
+                    service, path[-1], parent_ids[path], drive_id
+                )
+                for path in missing
+            },
         )
+        for path in missing:
+            parent_id = parent_ids[path]
+            # A failed or partial response is listed again in full before anything is created.
+            candidates = _list_all_folders(
+                service, path[-1], parent_id, drive_id, responses.get(cache_key(path))
+            )
+            if candidates:
+                folder_ids[path] = candidates[0]["id"]
+            else:
+                print(f"Creating folder {'/'.join(path)}")
+                folder_ids[path] = _create_folder(service, path[-1], parent_id)
+            folder_cache[cache_key(path)] = folder_ids[path]
+
+    save_folder_cache(folder_cache)
+    return folder_ids
+
+
+def list_drive_files(service, query, refresh=False):
+    """
+    List every file in the shared drive matching query.
+
+    All result pages are followed and only the fields in LIST_FIELDS are requested.
+    Listings are cached in the local manifest keyed by query, so repeated runs for the
+    same query answer from the cache until it goes stale. With refresh set the cache is
+    neither read nor written, as for the single-use listings of folder contents.
+
+    Args:
+        service: The Drive service object.
+        query (str): The Drive query string.
+        refresh (bool): Ignore any cached listing, query Drive again and do not cache
+            the result.
+
+    Returns:
+        list: The file metadata dicts for the matching files.
+    """
+    if not refresh:
+        cached = get_cached_listing(query)
+        if cached is not None:
+            print(f"Using cached listing of {len(cached)} files.")
+            return cached
+
+    files = []
+    page_token = None
+    while True:
         results = (
             service.files()
             .list(
                 q=query,
                 corpora="drive",
-                driveId=DRIVE_ID,
+                driveId=config["DRIVE_ID"],
                 supportsAllDrives=True,
                 includeItemsFromAllDrives=True,
                 spaces="drive",
-                fields="nextPageToken, files(id, name)",
+                pageSize=1000,
+                pageToken=page_token,
+                fields=LIST_FIELDS,
             )
             .execute()
         )
-        items = results.get("files", [])
+        files.extend(results.get("files", []))
+        page_token = results.get("nextPageToken")
+        if not page_token:
+            break
 
-        if not items:
-            print("No files found.")
+    if not refresh:
+        store_listing(query, files)
+    return files
+
+
+class _ByteBudget:
+    """Limit the number of bytes being downloaded at the same time across workers."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_flight = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, size):
+        """Block until size bytes fit in the budget. Returns the amount actually held."""
+        # A single file larger than the budget is still allowed through on its own.
+        size = min(size, self.limit)
+        with self.condition:
+            while self.in_flight and self.in_flight + size > self.limit:
+                self.condition.wait()
+            self.in_flight += size
+        return size
+
+    def release(self, size):
+        """Return size bytes to the budget."""
+        with self.condition:
+            self.in_flight -= size
+            self.condition.notify_all()
+
+
+class _DownloadProgress:
+    """Aggregate progress of concurrent downloads into a single report."""
+
+    def __init__(self, total_files, total_bytes):
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.done_files = 0
+        self.done_bytes = 0
+        self.last_percent = -1
+        self.lock = threading.Lock()
+
+    def advance(self, n_bytes):
+        """Record n_bytes more received and print when the overall percentage moves on."""
+        with self.lock:
+            self.done_bytes += n_bytes
+            if not self.total_bytes:
+                return
+            percent = int(self.done_bytes * 100 / self.total_bytes)
+            if percent // 5 > self.last_percent // 5:
+                self.last_percent = percent
+                print(
+                    f"Download {percent}% ({self.done_files}/{self.total_files} files, "
+                    f"{self.done_bytes / 1024 / 1024:.1f}mb)."
+                )
+
+    def file_done(self, name, skipped=False):
+        """Record a completed or skipped file."""
+        with self.lock:
+            self.done_files += 1
+            action = "Skipped up to date" if skipped else "Downloaded"
+            print(f"{action} {name} ({self.done_files}/{self.total_files}).")
+
+
+def file_md5(path):
+    """Return the hex md5 digest of a local file, read in 1mb blocks."""
+    digest = hashlib.md5()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _matches_drive_copy(path, item):
+    """Check whether the local file at path is identical to the Drive item."""
+    if not os.path.isfile(path):
+        return False
+    if "size" in item and os.path.getsize(path) != int(item["size"]):
+        return False
+    if "md5Checksum" in item:
+        return file_md5(path) == item["md5Checksum"]
+    return "size" in item
+
+
+def _partial_path(file_path, name):
+    """
+    Return where the partial download of name is kept.
+
+    Partial files live next to, rather than inside, the destination directory so the
+    chunking and transcription stages never pick them up.
+    """
+    partial_dir = os.path.join(os.path.dirname(os.path.normpath(file_path)), ".partial")
+    create_directory(partial_dir)
+    return os.path.join(partial_dir, name)
+
+
+def _download_media(request, fh, offset, on_chunk):
+    """
+    Download the media of request into fh from byte offset onwards, one Range request
+    of DOWNLOAD_CHUNK_SIZE bytes at a time, through the request's authorized http.
+
+    Args:
+        request: The HttpRequest of files().get_media.
+        fh: The file to append the bytes to.
+        offset (int): The first byte to download, the size of what fh already holds.
+        on_chunk: Called with the bytes downloaded so far and the total size after
+            each chunk.
+
+    Raises:
+        googleapiclient.errors.HttpError: If Drive answers with an error.
+    """
+    from googleapiclient.errors import HttpError
+
+    uri = request.uri
+    while True:
+        headers = dict(request.headers)
+        headers["range"] = f"bytes={offset}-{offset + DOWNLOAD_CHUNK_SIZE - 1}"
+        response, content = request.http.request(uri, "GET", headers=headers)
+        if response.status == 416 and response.get("content-range", "").endswith("/0"):
+            # An empty file has no range to satisfy.
             return
+        if response.status not in (200, 206):
+            raise HttpError(response, content, uri=uri)
+        uri = response.get("content-location", uri)
 
-        for item in items:
-            if item["name"].startswith("."):
-                continue
+        if response.status == 200:
+            # The whole file was sent, the first offset bytes of it are already in fh.
+            content = content[offset:]
+            total = offset + len(content)
+        else:
+            total = int(response["content-range"].rsplit("/", 1)[1])
+        fh.write(content)
+        offset += len(content)
+        on_chunk(offset, total)
+        if offset >= total or not content:
+            return
+
+
+def _download_item(service, item, file_path, progress=None):
+    """
+    Sync a single Drive file into file_path, reporting to progress when given.
+
+    The download is skipped when a local copy (including one already renamed with the
+    under_api_ prefix by the chunking stage) matches the Drive size and md5Checksum.
+    Otherwise the file is downloaded into a partial file which is resumed from where a
+    previous run stopped, verified against md5Checksum and then moved into place.
+
+    Returns:
+        str: The local path of the file, the under_api_ copy if that is the one matched.
+    """
+    name = item["name"]
+    size = int(item.get("size", 0))
+    destination = f"{file_path}{name}"
+
+    for local_name in (name, f"under_api_{name}"):
+        if _matches_drive_copy(f"{file_path}{local_name}", item):
+            if progress is None:
+                print(f"{name} is up to date, skipping.")
+            else:
+                progress.advance(size)
+                progress.file_done(name, skipped=True)
+            record_metrics("download", files_skipped=1)
+            return f"{file_path}{local_name}"
+
+    partial = _partial_path(file_path, name)
+    transferred = 0
+    for attempt in range(2):
+        offset = os.path.getsize(partial) if os.path.exists(partial) else 0
+        if size and offset > size:
+            os.remove(partial)
+            offset = 0
+        if offset and progress is None:
+            print(f"Resuming {name} from {offset / 1024 / 1024:.1f}mb.")
+        if progress is not None:
+            progress.advance(offset)
+
+        if not size or offset < size:
+            received = offset
+
+            def on_chunk(downloaded, total):
+                nonlocal received
+                if progress is None:
+                    print(f"Download {int(downloaded / total * 100) if total else 100}%.")
+                else:
+                    progress.advance(downloaded - received)
+                received = downloaded
 
-            print(f"{item['name']} ({item['id']})")
             request = service.files().get_media(fileId=item["id"])
-            with io.FileIO(f'{file_path}{item["name"]}', "wb") as fh:
-                downloader = MediaIoBaseDownload(fh, request)
-                done = False
-                while not done:
-                    status, done = downloader.next_chunk()
-                    print(f"Download {int(status.progress() * 100)}%.")
-    except Exception as e:
-        print(f"An error occurred: {e}")
+            with io.FileIO(partial, "ab") as fh:
+                _download_media(request, fh, offset, on_chunk)
+            transferred += os.path.getsize(partial) - offset
+
+        if "md5Checksum" not in item or file_md5(partial) == item["md5Checksum"]:
+            break
+        print(f"Checksum mismatch for {name}, downloading again.")
+        os.remove(partial)
+        if progress is not None:
+            progress.advance(-size)
+    else:
+        raise ValueError(f"Checksum mismatch for {name} after retrying.")
 
+    os.replace(partial, destination)
+    record_metrics("download", files=1, bytes=transferred)
+    if progress is not None:
+        progress.file_done(name)
+    return destination
 
-def download_files(service, date_prefix, file_type):
+
+def _download_items(service, items, file_path, workers=1):
+    """
+    Download the listed Drive items into file_path.
+
+    With a single worker the items are fetched one after another on the given service.
+    Otherwise they are fanned out over a thread pool where each worker uses its own
+    service object (see get_thread_service), the total size of the files being
+    downloaded at once is capped by "download_max_bytes_in_flight_mb" and progress is reported
+    for the whole batch rather than per chunk.
+
+    Returns:
+        list: The names of the files that are now up to date locally.
+    """
+    items = [item for item in items if not item["name"].startswith(".")]
+    completed = []
+
+    if workers <= 1:
+        for item in items:
+            print(f"{item['name']} ({item['id']})")
+            _download_item(service, item, file_path)
+            completed.append(item["name"])
+        return completed
+
+    budget = _ByteBudget(
+        config.get("download_max_bytes_in_flight_mb", 1024) * 1024 * 1024
+    )
+    progress = _DownloadProgress(
+        len(items), sum(int(item.get("size", 0)) for item in items)
+    )
+
+    def download(item):
+        held = budget.acquire(int(item.get("size", 0)))
+        try:
+            _download_item(get_thread_service(), item, file_path, progress)
+        finally:
+            budget.release(held)
+
+    print(f"Downloading {len(items)} files with {workers} workers...")
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(download, item): item for item in items}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Failed to download {futures[future]['name']}: {e}")
+            else:
+                completed.append(futures[future]["name"])
+    return completed
+
+
+def download_transcript_files(service, workers=1, refresh=False):
     """
     Download files from Google Drive with a specific prefix and type.
+
+    Files already present locally with a matching checksum are skipped and interrupted
+    downloads are resumed, see _download_item.
+    When workers is greater than one the files are fetched concurrently, see _download_items.
+    The listing is served from the local manifest unless it is stale or refresh is set.
     """
     try:
-        file_path = f"{DATA_DIR}/{date_prefix}/{file_type}/"
+        file_path = f"{data_dir()}/transcripts/"
         create_directory(file_path)
         query = (
-            f"name contains '{date_prefix}' and not name contains 'chunk' and not name contains 'transcribed' and mimeType = 'audio/wav'"
-            if file_type == "Audio"
-            else f"name contains 'export_{date_prefix[:4]}-{date_prefix[4:6]}-{date_prefix[6:8]}' and mimeType = 'application/json'"
-        )
-        results = (
-            service.files()
-            .list(
-                q=query,
-                corpora="drive",
-                driveId=DRIVE_ID,
-                supportsAllDrives=True,
-                includeItemsFromAllDrives=True,
-                spaces="drive",
-                fields="nextPageToken, files(id, name)",
-            )
-            .execute()
+            f"name contains 'af_24' or name contains 'bs_24' or name contains 'fp_24' or name contains 'ik_24'  or name contains 'jbjc_24' or name contains 'tc_24' or name contains 'jlyc_24' or name contains 'yx_24' or name contains 'ajh_24' or name contains 'mz_24' or name contains 'pg_24'"
         )
-        items = results.get("files", [])
+        items = list_drive_files(service, query, refresh=refresh)
 
         if not items:
             print("No files found.")
             return
 
-        for item in items:
-            if item["name"].startswith("."):
-                continue
+        _download_items(service, items, file_path, workers)
+    except Exception as e:
+        print(f"An error occurred: {e}")
 
-            print(f"{item['name']} ({item['id']})")
-            request = service.files().get_media(fileId=item["id"])
-            with io.FileIO(f'{file_path}{item["name"]}', "wb") as fh:
-                downloader = MediaIoBaseDownload(fh, request)
-                done = False
-                while not done:
-                    status, done = downloader.next_chunk()
-                    print(f"Download {int(status.progress() * 100)}%.")
+
+def download_files(service, date_prefix, file_type, workers=1, refresh=False):
+    """
+    Download files from Google Drive with a specific prefix and type.
+
+    Files already present locally with a matching checksum are skipped and interrupted
+    downloads are resumed, see _download_item.
+    When workers is greater than one the files are fetched concurrently, see _download_items.
+    The listing is served from the local manifest unless it is stale or refresh is set.
+    """
+    try:
+        file_path = f"{data_dir()}/{date_prefix}/{file_type}/"
+        create_directory(file_path)
+        items = list_date_files(service, date_prefix, file_type, refresh=refresh)
+
+        if not items:
+            print("No files found.")
+            return
+
+        for file_name in _download_items(service, items, file_path, workers):
+            if file_type == "Audio":
+                record_stage(date_prefix, file_name, "downloaded", "done")
     except Exception as e:
         print(f"An error occurred: {e}")
 
 
+def list_date_files(service, date_prefix, file_type, refresh=False):
+    """List the Drive files of a date and type ("Audio" or "Logs")."""
+    query = (
+        f"name contains '{date_prefix}' and not name contains 'chunk' and not name contains 'transcribed' and mimeType = 'audio/wav'"
+        if file_type == "Audio"
+        else f"name contains 'export_{date_prefix[:4]}-{date_prefix[4:6]}-{date_prefix[6:8]}' and mimeType = 'application/json'"
+    )
+    return list_drive_files(service, query, refresh=refresh)
+
+
+def download_file(service, item, date_prefix, file_type):
+    """
+    Download one Drive file listed by list_date_files, see _download_item.
+
+    Audio files are recorded as downloaded in the job store.
+
+    Returns:
+        str: The local path of the file, which is the under_api_ copy of a small
+        recording the chunking stage already renamed.
+    """
+    file_path = f"{data_dir()}/{date_prefix}/{file_type}/"
+    create_directory(file_path)
+    local_path = _download_item(service, item, file_path)
+    if file_type == "Audio":
+        record_stage(date_prefix, item["name"], "downloaded", "done")
+    return local_path
+
+
 def authenticate_google_drive():
     """
     Authenticate with Google Drive and return the service object.
     """
+    from google.auth.transport.requests import Request
+    from google.oauth2.credentials import Credentials
+    from google_auth_oauthlib.flow import InstalledAppFlow
+    from googleapiclient.discovery import build
+
+    global _credentials
+
+    token_file = config["TOKEN_FILE"]
     creds = None
-    if os.path.exists(TOKEN_FILE):
-        creds = Credentials.from_authorized_user_file(TOKEN_FILE, SCOPES)
+    if os.path.exists(token_file):
+        creds = Credentials.from_authorized_user_file(token_file, SCOPES)
 
     if not creds or not creds.valid:
         if creds and creds.expired and creds.refresh_token:
             creds.refresh(Request())
         else:
             flow = InstalledAppFlow.from_client_secrets_file(
-                CREDENTIALS_FILE, SCOPES)
+                config["CREDENTIALS_FILE"], SCOPES)
             creds = flow.run_local_server(port=0)
 
-        with open(TOKEN_FILE, "w", encoding="utf-8") as token:
+        with open(token_file, "w", encoding="utf-8") as token:
             token.write(creds.to_json())
 
+    _credentials = creds
     return build("drive", "v3", credentials=creds)
 
 
-def upload_files(service, date_prefix, file_type, drive_id=DRIVE_ID, model="base"):
-    """Upload files to a specific path in Google Drive."""
-    base_folder_id = find_or_create_folder(
-        service, "Recording Prep", drive_id=drive_id)
-    pilot_folder_id = find_or_create_folder(
-        service, "Pilot recordings", parent_id=base_folder_id, drive_id=drive_id
+def get_thread_service():
+    """
+    Return a Drive service object owned by the calling thread.
+
+    httplib2 is not thread-safe, so every worker thread builds its own authorized
+    client from the credentials obtained by authenticate_google_drive().
+    """
+    service = getattr(_thread_local, "service", None)
+    if service is None:
+        from googleapiclient.discovery import build
+
+        if _credentials is None:
+            raise RuntimeError(
+                "authenticate_google_drive() must be called before starting workers."
+            )
+        service = build(
+            "drive", "v3", credentials=_credentials, cache_discovery=False
+        )
+        _thread_local.service = service
+    return service
+
+
+class UploadTarget:
+    """
+    The Drive folder the transcripts of a date are uploaded into.
+
+    By default every upload goes into a new timestamped run folder, which is only created
+    when the first file is uploaded. With delta set, local files are compared by md5
+    against what earlier runs of the same model already uploaded so only new or changed
+    files are sent. With in_place set, a stable folder named after the model is used
+    instead of a run folder and changed files are updated in place rather than uploaded
+    again as new files.
+    """
+
+    def __init__(
+        self,
+        service,
+        date_prefix,
+        drive_id=None,
+        model="base",
+        delta=False,
+        in_place=False,
+    ):
+        session_path = ("Recording Prep", "Pilot recordings", "Recording Sessions")
+        date_path = session_path + (
+            f"{date_prefix[6:8]}_{date_prefix[4:6]}_{date_prefix[:4]}",
+        )
+        text_path = date_path + ("Text",)
+        folder_paths = [
+            session_path[:1],
+            session_path[:2],
+            session_path,
+            session_path + ("Transcripts",),
+            date_path,
+            text_path,
+        ]
+        if in_place:
+            folder_paths.append(text_path + (str(model),))
+        folder_ids = resolve_folder_paths(service, folder_paths, drive_id=drive_id)
+
+        self.model = model
+        self.text_folder_id = folder_ids[text_path]
+        self._folder_id = None
+        self._lock = threading.Lock()
+        self.in_place = in_place
+        self.remote_files = None
+        if in_place:
+            self._folder_id = folder_ids[text_path + (str(model),)]
+            self.remote_files = _list_folder_files(service, [self._folder_id])
+        elif delta:
+            run_folders = list_drive_files(
+                service,
+                f"mimeType='{FOLDER_MIME_TYPE}' and trashed=false "
+                f"and '{self.text_folder_id}' in parents",
+                refresh=True,
+            )
+            self.remote_files = _list_folder_files(
+                service,
+                [
+                    folder["id"]
+                    for folder in run_folders
+                    if folder["name"].endswith(f"_{model}")
+                ],
+            )
+
+    def select_changed(self, file_paths):
+        """
+        Pick the files that need uploading, see _select_changed_files.
+
+        Returns:
+            tuple: The file paths to upload and a mapping of file name to the ID of the
+            remote file each one replaces. Only in_place replaces files, in delta mode
+            changed files are uploaded as new files into the new run folder.
+        """
+        if self.remote_files is None:
+            return list(file_paths), {}
+        file_paths, existing_ids = _select_changed_files(file_paths, self.remote_files)
+        return file_paths, existing_ids if self.in_place else {}
+
+    def folder_id(self, service):
+        """
+        Return the ID of the folder to upload into, creating the run folder if needed.
+
+        The target is shared between upload threads, so it keeps no service object of its
+        own and uses the one of the calling thread.
+        """
+        with self._lock:
+            if self._folder_id is None:
+                # Run folders are timestamped, so there is never an existing one to find.
+                self._folder_id = _create_folder(
+                    service,
+                    f"{datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}_{self.model}",
+                    parent_id=self.text_folder_id,
+                )
+            return self._folder_id
+
+
+def upload_files(
+    service,
+    date_prefix,
+    file_type,
+    drive_id=None,
+    model="base",
+    workers=1,
+    delta=False,
+    in_place=False,
+    pending_only=False,
+):
+    """
+    Upload files to a specific path in Google Drive.
+
+    The target folder and the delta and in_place modes are described in UploadTarget.
+    With pending_only set, files the job store already records as uploaded are skipped,
+    which is how --resume continues an interrupted upload.
+
+    When workers is greater than one the files are uploaded concurrently, see _upload_paths.
+    """
+    target = UploadTarget(service, date_prefix, drive_id, model, delta, in_place)
+
+    upload_path = f"{data_dir()}/{date_prefix}/{file_type}/"
+    file_paths = [
+        os.path.join(upload_path, file_name)
+        for file_name in os.listdir(upload_path)
+        if os.path.isfile(os.path.join(upload_path, file_name))
+        and not (pending_only and stage_done(date_prefix, file_name, "uploaded"))
+    ]
+    file_paths, existing_ids = target.select_changed(file_paths)
+
+    if not file_paths:
+        print("All files are already up to date in Google Drive.")
+        return
+
+    for file_path in _upload_paths(
+        service, file_paths, target.folder_id(service), workers, existing_ids
+    ):
+        record_stage(date_prefix, os.path.basename(file_path), "uploaded", "done")
+
+
+def upload_file(service, file_path, date_prefix, target):
+    """
+    Upload one file into an UploadTarget unless it is already up to date there.
+
+    Returns:
+        bool: True if the file was uploaded.
+    """
+    changed, existing_ids = target.select_changed([file_path])
+    if not changed:
+        return False
+    file_name = os.path.basename(file_path)
+    file_id, _ = _upload_file(
+        service, file_path, target.folder_id(service), existing_ids.get(file_name)
     )
-    session_folder_id = find_or_create_folder(
-        service, "Recording Sessions", parent_id=pilot_folder_id, drive_id=drive_id
+    print(f"Uploaded {file_name}: {file_id}")
+    record_stage(date_prefix, file_name, "uploaded", "done")
+    return True
+
+
+def _list_folder_files(service, folder_ids):
+    """List the files directly inside any of the given folders, bypassing the cache."""
+    if not folder_ids:
+        return []
+    parents = " or ".join(f"'{folder_id}' in parents" for folder_id in folder_ids)
+    return list_drive_files(
+        service,
+        f"mimeType!='{FOLDER_MIME_TYPE}' and trashed=false and ({parents})",
+        refresh=True,
     )
-    transcripts_folder_id = find_or_create_folder(
-        service, "Transcripts", parent_id=session_folder_id, drive_id=drive_id
+
+
+def _select_changed_files(file_paths, remote_files):
+    """
+    Pick the local files that are missing remotely or whose content differs.
+
+    Args:
+        file_paths (list): Local file paths.
+        remote_files (list): Drive file metadata including name and md5Checksum.
+
+    Returns:
+        tuple: The file paths to upload and a mapping of file name to the ID of the
+        remote file with that name, for files that exist remotely but have changed.
+    """
+    remote_checksums = {}
+    remote_ids = {}
+    for remote_file in remote_files:
+        remote_checksums.setdefault(remote_file["name"], set()).add(
+            remote_file.get("md5Checksum")
+        )
+        remote_ids.setdefault(remote_file["name"], remote_file["id"])
+
+    changed = []
+    existing_ids = {}
+    for file_path in file_paths:
+        file_name = os.path.basename(file_path)
+        if file_md5(file_path) in remote_checksums.get(file_name, ()):
+            continue
+        changed.append(file_path)
+        if file_name in remote_ids:
+            existing_ids[file_name] = remote_ids[file_name]
+
+    print(
+        f"{len(changed)} of {len(file_paths)} files are new or changed "
+        f"({len(existing_ids)} changed)."
     )
-    date_folder_id = find_or_create_folder(
-        service,
-        f"{date_prefix[6:8]}_{date_prefix[4:6]}_{date_prefix[:4]}",
-        parent_id=session_folder_id,
-        drive_id=drive_id,
+    return changed, existing_ids
+
+
+def _upload_file(service, file_path, parent_id, file_id=None):
+    """
+    Upload a single file into parent_id, or replace the content of file_id if given.
+
+    Files up to "resumable_upload_threshold_mb" are sent as one multipart request. Larger
+    files use a resumable upload sent in UPLOAD_CHUNK_SIZE chunks, so a dropped
+    connection only repeats the current chunk.
+
+    Returns:
+        tuple: The file ID and the number of HTTP requests the upload took.
+    """
+    from googleapiclient.http import MediaFileUpload
+
+    resumable = os.path.getsize(file_path) > (
+        config.get("resumable_upload_threshold_mb", 5) * 1024 * 1024
     )
-    text_folder_id = find_or_create_folder(
-        service, "Text", parent_id=date_folder_id, drive_id=drive_id
+    media = MediaFileUpload(
+        file_path,
+        mimetype="text/plain",
+        resumable=resumable,
+        chunksize=UPLOAD_CHUNK_SIZE if resumable else -1,
     )
-    run_folder_id = find_or_create_folder(
-        service,
-        f"{datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}_{model}",
-        parent_id=text_folder_id,
-        drive_id=drive_id,
+    if file_id:
+        request = service.files().update(
+            fileId=file_id,
+            supportsAllDrives=True,
+            media_body=media,
+            fields="id",
+        )
+    else:
+        request = service.files().create(
+            body={"name": os.path.basename(file_path), "parents": [parent_id]},
+            supportsAllDrives=True,
+            media_body=media,
+            fields="id",
+        )
+    if not resumable:
+        response = request.execute(num_retries=3)
+        request_count = 1
+    else:
+        # One request opens the upload session, then one per chunk.
+        request_count = 1
+        response = None
+        while response is None:
+            _, response = request.next_chunk(num_retries=3)
+            request_count += 1
+    record_metrics(
+        "upload", files=1, bytes=os.path.getsize(file_path), requests=request_count
     )
+    return response.get("id"), request_count
 
-    upload_path = f"{DATA_DIR}/{date_prefix}/{file_type}/"
-
-    for file_name in os.listdir(upload_path):
-        file_path = os.path.join(upload_path, file_name)
-        if os.path.isfile(file_path):
-            print(f"Uploading {file_name}...")
-            file_metadata = {"name": file_name, "parents": [run_folder_id]}
-
-            media = MediaFileUpload(file_path, mimetype="text/plain")
-            file = (
-                service.files()
-                .create(
-                    body=file_metadata,
-                    supportsAllDrives=True,
-                    media_body=media,
-                    fields="id",
-                )
-                .execute()
+
+def _upload_paths(service, file_paths, parent_id, workers=1, existing_ids=None):
+    """
+    Upload the given local files into parent_id and report the request rate.
+
+    Files whose name appears in existing_ids replace the content of that Drive file
+    instead of being created as a new one.
+
+    With a single worker the files are uploaded one after another on the given service,
+    otherwise they are spread over a thread pool where each worker uses its own service
+    object (see get_thread_service).
+
+    Note that the Drive batch endpoint does not accept media uploads, so small files
+    cannot be grouped into batch requests. Running them concurrently is what hides the
+    per-request latency instead.
+
+    Returns:
+        list: The paths of the files that were uploaded.
+    """
+    existing_ids = existing_ids or {}
+    start = time.perf_counter()
+    request_count = 0
+    uploaded = []
+
+    if workers <= 1:
+        for file_path in file_paths:
+            print(f"Uploading {os.path.basename(file_path)}...")
+            file_id, requests_made = _upload_file(
+                service,
+                file_path,
+                parent_id,
+                existing_ids.get(os.path.basename(file_path)),
+            )
+            request_count += requests_made
+            uploaded.append(file_path)
+            print(f"Uploaded file with ID: {file_id}")
+    else:
+
+        def upload(file_path):
+            return _upload_file(
+                get_thread_service(),
+                file_path,
+                parent_id,
+                existing_ids.get(os.path.basename(file_path)),
             )
-            print(f"Uploaded file with ID: {file.get('id')}")
+
+        print(f"Uploading {len(file_paths)} files with {workers} workers...")
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(upload, file_path): file_path
+                for file_path in file_paths
+            }
+            for future in as_completed(futures):
+                file_name = os.path.basename(futures[future])
+                try:
+                    file_id, requests_made = future.result()
+                except Exception as e:
+                    print(f"Failed to upload {file_name}: {e}")
+                    continue
+                request_count += requests_made
+                uploaded.append(futures[future])
+                print(
+                    f"Uploaded {file_name} ({len(uploaded)}/{len(file_paths)}): {file_id}"
+                )
+
+    elapsed = time.perf_counter() - start
+    print(
+        f"Uploaded {len(uploaded)} files using {request_count} requests in {elapsed:.1f}s "
+        f"({request_count / elapsed if elapsed else 0:.1f} requests/s)."
+    )
+    return uploaded
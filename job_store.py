@@ -0,0 +1,256 @@
+"""
+This module keeps the processing state of every file in a small SQLite database.
+
+Each row records one stage of one file of a date: the stage name (downloaded, chunked,
+transcribed or uploaded), the backend for transcription stages, its status (running, done
+or failed), when it started and finished and the error if it failed. Selecting the work
+that is left is an indexed query rather than a comparison of file names, and a crash
+leaves the running stages marked so they are picked up again on the next run.
+
+Runs are recorded too, so `main.py --resume` can repeat the last run that did not finish.
+
+Functions:
+- record_stage(date_prefix, file_name, stage, status, backend="", error=None, parent=None): Record the status of a stage.
+- stage_done(date_prefix, file_name, stage, backend=""): Check whether a stage has completed.
+- files_with_stage(date_prefix, stage, backend=""): Return the files that completed a stage.
+- pending_transcription(date_prefix, backend, ready_stages=("chunked",)): Return the files still to transcribe.
+- import_directory(date_prefix, audio_dir, text_dir): Record files created before the job store existed.
+- start_run(date_prefix, argv): Record the start of a run.
+- finish_run(run_id): Record that a run completed.
+- last_unfinished_run(): Return the most recent run if it did not complete.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from settings import data_dir
+
+JOB_STORE_FILE_NAME = "jobs.sqlite3"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS stages (
+    date_prefix TEXT NOT NULL,
+    file_name TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    backend TEXT NOT NULL DEFAULT '',
+    status TEXT NOT NULL,
+    parent TEXT,
+    started_at REAL,
+    finished_at REAL,
+    error TEXT,
+    PRIMARY KEY (date_prefix, file_name, stage, backend)
+);
+CREATE INDEX IF NOT EXISTS stages_by_status
+    ON stages (date_prefix, stage, backend, status);
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    date_prefix TEXT NOT NULL,
+    argv TEXT NOT NULL,
+    started_at REAL NOT NULL,
+    finished_at REAL
+);
+"""
+
+_local = threading.local()
+
+
+def _connection():
+    """Return the SQLite connection of the calling thread, creating the database if needed."""
+    connection = getattr(_local, "connection", None)
+    if connection is None:
+        os.makedirs(data_dir(), exist_ok=True)
+        connection = sqlite3.connect(
+            os.path.join(data_dir(), JOB_STORE_FILE_NAME), timeout=30
+        )
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript(SCHEMA)
+        _local.connection = connection
+    return connection
+
+
+def record_stage(
+    date_prefix, file_name, stage, status, backend="", error=None, parent=None
+):
+    """
+    Record the status of a stage of a file.
+
+    A "running" status stamps the start time, "done" and "failed" stamp the finish time.
+
+    Args:
+        date_prefix (str): The date the file belongs to.
+        file_name (str): The name of the file.
+        stage (str): One of "downloaded", "chunked", "transcribed" or "uploaded".
+        status (str): One of "running", "done" or "failed".
+        backend (str): The transcription backend, for the transcribed stage.
+        error (str): The error message of a failed stage.
+        parent (str): The file this file was created from, for chunks.
+    """
+    now = time.time()
+    with _connection() as connection:
+        connection.execute(
+            """
+            INSERT INTO stages
+                (date_prefix, file_name, stage, backend, status, parent,
+                 started_at, finished_at, error)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (date_prefix, file_name, stage, backend) DO UPDATE SET
+                status = excluded.status,
+                parent = COALESCE(excluded.parent, parent),
+                started_at = CASE WHEN excluded.status = 'running'
+                    THEN excluded.started_at ELSE COALESCE(started_at, excluded.started_at) END,
+                finished_at = excluded.finished_at,
+                error = excluded.error
+            """,
+            (
+                date_prefix,
+                file_name,
+                stage,
+                backend,
+                status,
+                parent,
+                now,
+                None if status == "running" else now,
+                error,
+            ),
+        )
+
+
+def stage_done(date_prefix, file_name, stage, backend=""):
+    """Check whether a stage of a file has completed."""
+    row = (
+        _connection()
+        .execute(
+            """
+            SELECT 1 FROM stages
+            WHERE date_prefix = ? AND file_name = ? AND stage = ? AND backend = ?
+                AND status = 'done'
+            """,
+            (date_prefix, file_name, stage, backend),
+        )
+        .fetchone()
+    )
+    return row is not None
+
+
+def files_with_stage(date_prefix, stage, backend=""):
+    """Return the names of the files of a date that completed a stage."""
+    rows = _connection().execute(
+        """
+        SELECT file_name FROM stages
+        WHERE date_prefix = ? AND stage = ? AND backend = ? AND status = 'done'
+        ORDER BY file_name
+        """,
+        (date_prefix, stage, backend),
+    )
+    return [row["file_name"] for row in rows]
+
+
+def pending_transcription(date_prefix, backend, ready_stages=("chunked",)):
+    """
+    Return the files of a date that are ready to transcribe but not transcribed by backend.
+
+    Files that failed or were interrupted while transcribing are included again.
+
+    Args:
+        date_prefix (str): The date to select files for.
+        backend (str): The transcription backend.
+        ready_stages (tuple): The stages after which a file is ready to transcribe.
+    """
+    placeholders = ", ".join("?" for _ in ready_stages)
+    rows = _connection().execute(
+        f"""
+        SELECT DISTINCT ready.file_name FROM stages AS ready
+        WHERE ready.date_prefix = ? AND ready.stage IN ({placeholders})
+            AND ready.status = 'done'
+            AND NOT EXISTS (
+                SELECT 1 FROM stages AS done
+                WHERE done.date_prefix = ready.date_prefix
+                    AND done.file_name = ready.file_name
+                    AND done.stage = 'transcribed' AND done.backend = ?
+                    AND done.status = 'done'
+            )
+        ORDER BY ready.file_name
+        """,
+        (date_prefix, *ready_stages, backend),
+    )
+    return [row["file_name"] for row in rows]
+
+
+def import_directory(date_prefix, audio_dir, text_dir):
+    """
+    Record audio files the job store does not know about yet.
+
+    This covers data from runs made before the job store existed, or files copied in by
+    hand. Their stage is inferred once from the naming conventions of the older runs:
+    names containing "chunk" or starting with "under_api_" are chunked, other recordings
+    are downloaded, and a matching transcript in text_dir marks them as transcribed.
+    """
+    known = {
+        row["file_name"]
+        for row in _connection().execute(
+            "SELECT DISTINCT file_name FROM stages WHERE date_prefix = ?",
+            (date_prefix,),
+        )
+    }
+    transcripts = set(os.listdir(text_dir)) if os.path.isdir(text_dir) else set()
+
+    for file_name in os.listdir(audio_dir):
+        if not file_name.endswith(".wav") or file_name in known:
+            continue
+        chunked = "chunk" in file_name or file_name.startswith("under_api_")
+        record_stage(
+            date_prefix, file_name, "chunked" if chunked else "downloaded", "done"
+        )
+        stem = os.path.splitext(file_name)[0]
+        if f"transcribed_api_{stem}.json" in transcripts:
+            record_stage(date_prefix, file_name, "transcribed", "done", backend="api")
+        if f"transcribed_{stem}.json" in transcripts:
+            record_stage(date_prefix, file_name, "transcribed", "done", backend="local")
+
+
+def start_run(date_prefix, argv):
+    """Record the start of a run with its command line arguments. Returns the run ID."""
+    with _connection() as connection:
+        cursor = connection.execute(
+            "INSERT INTO runs (date_prefix, argv, started_at) VALUES (?, ?, ?)",
+            (date_prefix, json.dumps(argv), time.time()),
+        )
+    return cursor.lastrowid
+
+
+def finish_run(run_id):
+    """Record that a run completed."""
+    with _connection() as connection:
+        connection.execute(
+            "UPDATE runs SET finished_at = ? WHERE run_id = ?", (time.time(), run_id)
+        )
+
+
+def last_unfinished_run():
+    """
+    Return the most recent run if it did not complete, or None.
+
+    Returns:
+        dict: The run ID, date prefix and command line arguments of the run.
+    """
+    row = (
+        _connection()
+        .execute(
+            """
+            SELECT run_id, date_prefix, argv, finished_at FROM runs
+            ORDER BY run_id DESC LIMIT 1
+            """
+        )
+        .fetchone()
+    )
+    if row is None or row["finished_at"] is not None:
+        return None
+    return {
+        "run_id": row["run_id"],
+        "date_prefix": row["date_prefix"],
+        "argv": json.loads(row["argv"]),
+    }
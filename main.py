@@ -9,19 +9,44 @@ The script provides the following functionalities:
 - Uploading transcribed text files to Google Drive.
 
 The script requires a configuration file named "config.json" in the same directory,
-which contains the API key and data directory path.
+which contains the API key and data directory path. It is read the first time a setting
+is needed, see settings.py, and the Google Drive, HTTP and Whisper libraries are only
+imported by the stages that use them.
 
 Usage:
-    python main.py --date <date> [--download] [--transcribe] [--upload] [--whispermodel <model>] [--split <seconds>] [--api <api_key>]
+    python main.py --date <date> [--download] [--download-workers <n>] [--transcribe] [--upload] [--whispermodel <model>] [--split <seconds>] [--api <api_key>]
 
 Arguments:
-    --date: The date of the recordings in dd/mm/yyyy format. (required)
+    --date: The date of the recordings in dd/mm/yyyy format. (required unless resuming)
+    --dates: Several comma separated dates to process in one run.
+    --date-range: Every date from the first to the last, as dd/mm/yyyy:dd/mm/yyyy.
+    --resume: Repeat the last run that did not finish, skipping the work it already did.
     --download: Download audio files from Google Drive.
+    --download-workers: Number of files to download concurrently (default 1).
+    --refresh-listing: Ignore the cached Google Drive listing and query Drive again.
     --transcribe: Transcribe audio files.
     --upload: Upload transcribed text files to Google Drive.
+    --upload-workers: Number of files to upload concurrently (default 1).
+    --delta-upload: Only upload transcripts that are new or changed since earlier uploads.
+    --upload-in-place: Keep one folder per model in Google Drive and update it in place.
     --whispermodel:> Version of the Whisper model to use for transcription.
+    --whisper-workers: Number of local Whisper worker processes (default 1).
+    --backend: Local inference backend, pytorch (default) or ctranslate2 for int8 CPU inference.
+    --no-daemon: Do not submit files to a running transcription_daemon.py server.
+    --whisper-batch-size: Number of 30 second windows, across files, to decode together locally (default 1).
     --split: Split audio files into chunks of specified seconds.
     --api: Use the Whisper API for transcription.
+    --api-workers: Number of files to send to the transcription API concurrently (default 1).
+    --split-workers: Number of audio chunks to export or encode concurrently (default 1).
+    --canonical-audio: Convert recordings to 16 kHz 16 bit mono before chunking them for an API.
+    --api-encoding: Send API chunks as wav (default), lossless flac or opus, see encode.py.
+    --pipeline: Stream each recording through download, chunking, transcription and upload
+                with all stages running at once, instead of one stage after another.
+    --pipeline-queue-size: Number of files that can wait in front of each pipeline stage (default 4).
+    --profile: Profile each stage with cProfile and tracemalloc, see metrics.py.
+
+Every run writes the time, bytes and audio handled by each stage to metrics/run_<id>.json
+in the data directory and to a Prometheus textfile, see metrics.py.
 
 Example:
     python main.py --date 01/01/2022 --download --transcribe --upload --whispermodel large --split 30 --api <api_key>
@@ -31,133 +56,225 @@ Whispermodel cannot be changed when using the whisper API, it defaults to large-
 """
 
 import argparse
-import json
+import datetime
 import math
 import os
 import sys
-import wave
-
-from pydub import AudioSegment
-from pydub.utils import make_chunks, mediainfo
-
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from audio_metadata import (
+    WAV_HEADER_BYTES,
+    get_metadata,
+    read_wav_header,
+    scan_directory,
+    wav_header,
+)
 from google_drive_functions import (
+    UploadTarget,
     authenticate_google_drive,
     create_directory,
+    download_file,
     download_files,
+    get_thread_service,
+    list_date_files,
+    upload_file,
     upload_files,
 )
-from transcribe_api import new_transcribe
-from wspr_transcribe import transcribe_audio_whisper_local
-
-with open("config.json", "r", encoding="utf-8") as f:
-    config = json.load(f)
+from encode import encode_chunks
+from job_store import (
+    finish_run,
+    import_directory,
+    last_unfinished_run,
+    pending_transcription,
+    record_stage,
+    stage_done,
+    start_run,
+)
+from metrics import enable_profiling, record_metrics, stage, write_report
+from pipeline import Stage, run_pipeline
+from resample import is_canonical, to_canonical
+from settings import config, data_dir
+from transcribe_api import (
+    get_retry_stats,
+    is_api_input,
+    new_transcribe,
+    transcribe_file,
+)
+from whisper_backends import BACKENDS
+from wspr_transcribe import (
+    LocalTranscriber,
+    get_files_to_transcribe,
+    transcribe_audio_whisper_local,
+)
 
-DATA_DIR = config["data_dir"]
+COPY_BLOCK_BYTES = 4 * 1024 * 1024
 
 
 def validate_date(input_date):
-    """Validate and format date input."""
+    """Validate a dd/mm/yyyy date and return it as a zero padded yyyymmdd prefix."""
+    try:
+        return datetime.datetime.strptime(input_date.strip(), "%d/%m/%Y").strftime("%Y%m%d")
+    except ValueError:
+        return None
+
+
+def expand_date_range(date_range):
+    """
+    Expand "dd/mm/yyyy:dd/mm/yyyy" into every date from the first to the last, inclusive.
+
+    Returns:
+        list: The date prefixes in yyyymmdd format, or None if the range is invalid.
+    """
     try:
-        month, day, year = input_date.split("/")
-        month = int(month)
-        day = int(day)
-        year = int(year)
-        return f"{year}{day}{month}"
+        first, last = (
+            datetime.datetime.strptime(date.strip(), "%d/%m/%Y").date()
+            for date in date_range.split(":")
+        )
     except ValueError:
         return None
+    return [
+        (first + datetime.timedelta(days=offset)).strftime("%Y%m%d")
+        for offset in range((last - first).days + 1)
+    ]
 
 
-def split_wav_by_size(file_path, target_size_mb, date_prefix):
+def split_wav_by_size(file_path, target_size_mb, date_prefix, workers=1, metadata=None):
     """
     Splits a WAV file into multiple parts, each with a size approximately equal to target_size_mb megabytes.
 
+    The PCM frames are copied straight from the data chunk of the input to the chunk files
+    in blocks of COPY_BLOCK_BYTES, so memory use stays flat however long the recording is
+    and the audio is never decoded or re-encoded.
+
     :param file_path: Path to the input WAV file.
     :param target_size_mb: Desired maximum size of each split file in megabytes.
-    :return: None
+    :param date_prefix: Date prefix of the recordings, used to name the chunks.
+    :param workers: Number of chunks to export concurrently.
+    :param metadata: Header metadata of the file from audio_metadata, read if not given.
+    :return: The names of the chunk files.
     """
 
-    target_size_bytes = target_size_mb * 1024 * 1024
-
-    with wave.open(file_path, "rb") as wav_file:
-        frame_rate = wav_file.getframerate()
-        n_channels = wav_file.getnchannels()
-        sampwidth = wav_file.getsampwidth()
-        duration_in_seconds = wav_file.getnframes() / float(wav_file.getframerate())
-        bit_rate = int(mediainfo(file_path)["bits_per_sample"])
-
-        print("sample_width=", sampwidth)
-        print("channel_count=", n_channels)
-        print("duration_in_sec=", duration_in_seconds)
-        print("frame_rate=", frame_rate)
-        print("bit_rate=", bit_rate)
+    target_size_bytes = int(target_size_mb * 1024 * 1024)
+    metadata = metadata or get_metadata(file_path)
+
+    frame_size = metadata["block_align"]
+    n_frames = metadata["n_frames"]
+
+    print("sample_width=", metadata["bits_per_sample"] // 8)
+    print("channel_count=", metadata["channels"])
+    print("duration_in_sec=", metadata["duration"])
+    print("frame_rate=", metadata["sample_rate"])
+    print("bit_rate=", metadata["bits_per_sample"])
+    print("wav_file_size = ", metadata["data_bytes"])
+    print("")
+
+    frames_per_chunk = max(1, (target_size_bytes - WAV_HEADER_BYTES) // frame_size)
+    total_chunks = math.ceil(n_frames / frames_per_chunk)
+
+    file_name = os.path.splitext(os.path.basename(file_path))[0]
+
+    chunk_names = [
+        f"{date_prefix}_chunk{i}_{file_name}.wav" for i in range(total_chunks)
+    ]
+
+    def export(i):
+        chunk_name = f"{data_dir()}/{date_prefix}/Audio/{chunk_names[i]}"
+        print("exporting", chunk_name)
+        start_frame = i * frames_per_chunk
+        _copy_wav_frames(
+            file_path,
+            chunk_name,
+            metadata,
+            start_frame,
+            min(frames_per_chunk, n_frames - start_frame),
+        )
 
-        wav_file_size = (frame_rate * bit_rate * n_channels * duration_in_seconds) / 8
-        print("wav_file_size = ", wav_file_size)
+    if workers <= 1:
+        for i in range(total_chunks):
+            export(i)
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(export, range(total_chunks)))
+    print("Total chunks = ", total_chunks)
+    record_metrics("chunk", bytes=metadata["data_bytes"], chunks=total_chunks)
+    return chunk_names
 
-        print("")
-        audio = AudioSegment.from_file(file_path, "wav")
 
-        total_chunks = wav_file_size // target_size_bytes
-        chunk_length_in_sec = math.ceil(
-            (duration_in_seconds * target_size_bytes) / wav_file_size
-        )
-        chunk_length_ms = chunk_length_in_sec * 1000
-        chunks = make_chunks(audio, chunk_length_ms)
+def _copy_wav_frames(source_path, chunk_path, metadata, start_frame, n_frames):
+    """
+    Copy n_frames frames starting at start_frame from source_path into a new WAV file.
 
-        file_name = os.path.splitext(os.path.basename(file_path))[0]
-        for i, chunk in enumerate(chunks):
-            chunk_name = (
-                f"{DATA_DIR}/{date_prefix}/Audio/{date_prefix}_chunk{i}_{file_name}.wav"
-            )
-            print("exporting", chunk_name)
-            chunk.export(chunk_name, format="wav")
-        print("Total chunks = ", total_chunks)
+    Each call opens its own file handles, so chunks can be exported from several threads at once.
+    """
+    data_bytes = n_frames * metadata["block_align"]
+    with open(source_path, "rb") as reader, open(chunk_path, "wb") as writer:
+        writer.write(wav_header(metadata, data_bytes))
+        reader.seek(metadata["data_offset"] + start_frame * metadata["block_align"])
+        remaining = data_bytes
+        while remaining > 0:
+            block = reader.read(min(COPY_BLOCK_BYTES, remaining))
+            if not block:
+                break
+            writer.write(block)
+            remaining -= len(block)
 
 
 def delete_zero_byte_files(date_prefix):
     """Delete zero byte wav files."""
-    for file in os.listdir(f"{DATA_DIR}/{date_prefix}/Audio"):
-        if os.path.getsize(f"{DATA_DIR}/{date_prefix}/Audio/{file}") == 0:
-            os.remove(f"{DATA_DIR}/{date_prefix}/Audio/{file}")
+    audio_dir = f"{data_dir()}/{date_prefix}/Audio"
+    for file, metadata in scan_directory(audio_dir).items():
+        if metadata["status"] == "empty":
+            os.remove(f"{audio_dir}/{file}")
 
 
 def main():
     """
     Main function to handle command line arguments and call other functions.
+
+    Several dates are processed in one process, sharing the Drive service, the HTTP
+    sessions and the loaded Whisper model between them.
     """
-    args, date_prefix, API_KEY = parse_args()
+    args, date_prefixes, API_KEY = parse_args()
+    run_id = args.run_id or start_run(",".join(date_prefixes), sys.argv[1:])
+    if args.profile:
+        enable_profiling(f"{data_dir()}/metrics/run_{run_id}_profile")
 
     service = authenticate_google_drive() if args.download or args.upload else None
 
-    if args.download:
-        download_files(service, date_prefix, "Audio")
-        download_files(service, date_prefix, "Logs")
-        print(f"Download completed for date: {date_prefix}")
-    delete_zero_byte_files(date_prefix)
-
-    create_directory(f"{DATA_DIR}/{date_prefix}/Text")
-    if args.whisper:
-        transcribe_audio_whisper_local(date_prefix)
-    if args.whisperapi:
-        chunk_for_api("whisper_api_file_size_limit", date_prefix)
-        new_transcribe(date_prefix, "whisper", API_KEY)
-    if args.lemonfoxapi:
-        chunk_for_api("lemonfox_api_file_size_limit", date_prefix)
-        new_transcribe(date_prefix, "lemonfox", API_KEY)
-
-    if args.upload:
-        upload_files(service, date_prefix, "Text", model=args.whispermodel)
+    if args.pipeline:
+        if args.download:
+            for date_prefix in date_prefixes:
+                with stage("download", date_prefix):
+                    download_files(
+                        service,
+                        date_prefix,
+                        "Logs",
+                        workers=args.download_workers,
+                        refresh=args.refresh_listing,
+                    )
+        with stage("pipeline"):
+            run_streaming(args, date_prefixes, service, API_KEY)
+    else:
+        for date_prefix in date_prefixes:
+            process_date(args, date_prefix, service, API_KEY)
+
+    finish_run(run_id)
+    print(f"Metrics written to {write_report(run_id, retries=get_retry_stats())}")
 
     print("Operation completed.")
 
 
-def chunk_for_api(config_param, date_prefix):
+def chunk_for_api(config_param, date_prefix, workers=1, canonical=False, encoding="wav"):
     """
     Chunks audio files into smaller sizes based on the specified configuration parameter.
 
     Args:
         config_param (str): The configuration parameter used to determine the file size limit.
         date_prefix (str): The date prefix used to identify the files to chunk.
+        workers (int): Number of chunks to export concurrently.
+        canonical (bool): Convert the recordings to 16 kHz 16 bit mono first, see chunk_file.
+        encoding (str): The format of the chunks, "wav", "flac" or "opus", see chunk_file.
 
     Examples:
         >>> chunk_for_api("whisperFileLimit", "2022-01-01")
@@ -167,37 +284,357 @@ def chunk_for_api(config_param, date_prefix):
     print(
         f"Splitting audio files into sizes of {file_limit}mb as per whisper API requirements."
     )
-    chunk_files(date_prefix, file_limit)
+    chunk_files(date_prefix, file_limit, workers, canonical, encoding)
 
 
-def chunk_files(date_prefix, file_limit):
+def chunk_files(date_prefix, file_limit, workers=1, canonical=False, encoding="wav"):
     """
     Chunks audio files into smaller sizes based on the specified file size limit.
 
+    Files the job store records as already chunked, including the chunks themselves,
+    are skipped, so re-running after a crash only chunks what is left.
+
     Args:
         date_prefix (str): The date prefix used to identify the files to chunk.
         file_limit (float): The file size limit in megabytes.
+        workers (int): Number of chunks to export concurrently.
+        canonical (bool): Convert the recordings to 16 kHz 16 bit mono first, see chunk_file.
+        encoding (str): The format of the chunks, "wav", "flac" or "opus", see chunk_file.
 
     Examples:
         >>> chunk_files("2022-01-01", 10.0)
     """
 
-    for audio_file in os.listdir(f"{DATA_DIR}/{date_prefix}/Audio"):
-        audio_length = (
-            os.path.getsize(f"{DATA_DIR}/{date_prefix}/Audio/{audio_file}")
-            / 1024
-            / 1024
+    audio_dir = f"{data_dir()}/{date_prefix}/Audio"
+    import_directory(date_prefix, audio_dir, f"{data_dir()}/{date_prefix}/Text")
+    for audio_file, metadata in scan_directory(audio_dir).items():
+        if stage_done(date_prefix, audio_file, "chunked"):
+            continue
+        chunk_file(
+            date_prefix, audio_file, metadata, file_limit, workers, canonical, encoding
         )
 
-        if audio_length > file_limit:
+
+def chunk_file(
+    date_prefix,
+    audio_file,
+    metadata,
+    file_limit,
+    workers=1,
+    canonical=False,
+    encoding="wav",
+):
+    """
+    Chunk one audio file of a date and record it and its chunks in the job store.
+
+    Files over file_limit megabytes are split, smaller ones are renamed with the
+    under_api_ prefix so they are sent whole.
+
+    With canonical set, a recording that is not already 16 kHz 16 bit mono is converted
+    to it first (see resample), which is all Whisper uses, and the converted copy is
+    split instead, so each chunk carries several times more audio. Its chunks are named
+    as when splitting, even if there is only one, and the recording itself is left as
+    it is so it still matches its copy on Drive.
+
+    With encoding set to "flac" or "opus", every recording is encoded by ffmpeg into
+    chunks sized by their encoded size instead (see encode), which fit several times more
+    audio into each request. They are named like WAV chunks with the extension of the
+    encoding, and the recording is again left as it is.
+
+    Returns:
+        list: The names of the resulting files, empty if the file is empty or corrupt.
+    """
+    audio_dir = f"{data_dir()}/{date_prefix}/Audio"
+    if metadata["status"] in ("empty", "corrupt"):
+        print(f"Skipping {audio_file}: {metadata['status']} {metadata['error'] or ''}")
+        return []
+    if metadata["status"] == "truncated":
+        print(f"Warning: {audio_file} is truncated, {metadata['error']}")
+
+    audio_length = metadata["size"] / 1024 / 1024
+
+    record_stage(date_prefix, audio_file, "chunked", "running")
+    try:
+        if encoding != "wav":
+            print(f"Encoding {audio_file} as {encoding}...")
+            chunk_names = encode_chunks(
+                f"{audio_dir}/{audio_file}",
+                file_limit,
+                date_prefix,
+                encoding,
+                workers,
+                metadata,
+                canonical,
+            )
+        elif canonical and not is_canonical(metadata):
+            chunk_names = _chunk_canonical(
+                date_prefix, audio_file, metadata, file_limit, workers
+            )
+        elif audio_length > file_limit:
             print(f"Splitting {audio_file} into chunks...")
-            split_wav_by_size(
-                f"{DATA_DIR}/{date_prefix}/Audio/{audio_file}", file_limit, date_prefix
+            chunk_names = split_wav_by_size(
+                f"{audio_dir}/{audio_file}",
+                file_limit,
+                date_prefix,
+                workers,
+                metadata,
             )
         else:
+            chunk_names = [f"under_api_{audio_file}"]
             os.rename(
-                f"{DATA_DIR}/{date_prefix}/Audio/{audio_file}",
-                f"{DATA_DIR}/{date_prefix}/Audio/under_api_{audio_file}",
+                f"{audio_dir}/{audio_file}",
+                f"{audio_dir}/{chunk_names[0]}",
+            )
+    except Exception as e:
+        record_stage(date_prefix, audio_file, "chunked", "failed", error=str(e))
+        raise
+    for chunk_name in chunk_names:
+        record_stage(date_prefix, chunk_name, "chunked", "done", parent=audio_file)
+    record_stage(date_prefix, audio_file, "chunked", "done")
+    record_metrics("chunk", files=1, audio_seconds=metadata.get("duration", 0))
+    return chunk_names
+
+
+def _chunk_canonical(date_prefix, audio_file, metadata, file_limit, workers=1):
+    """Convert a recording to 16 kHz 16 bit mono and split the converted copy."""
+    audio_dir = f"{data_dir()}/{date_prefix}/Audio"
+    # Kept out of the audio directory so no stage picks up the converted copy itself.
+    canonical_dir = f"{audio_dir}/.canonical"
+    create_directory(canonical_dir)
+    canonical_path = f"{canonical_dir}/{audio_file}"
+    print(f"Converting {audio_file} to 16 kHz mono...")
+    try:
+        to_canonical(f"{audio_dir}/{audio_file}", canonical_path, metadata)
+        return split_wav_by_size(
+            canonical_path,
+            file_limit,
+            date_prefix,
+            workers,
+            read_wav_header(canonical_path),
+        )
+    finally:
+        if os.path.exists(canonical_path):
+            os.remove(canonical_path)
+
+
+def run_streaming(args, date_prefixes, service, api_key):
+    """
+    Move each recording through download, chunking, transcription and upload on its own.
+
+    The stages run concurrently and are connected by bounded queues (see pipeline), so
+    transcription starts as soon as the first recording has downloaded and uploads as
+    soon as its transcript is written, while a slow stage holds back the ones before it.
+    Each stage uses the worker count of its phase in the batch mode. Recordings and
+    chunks that earlier runs left unfinished are fed in alongside the Drive listing.
+    Only one transcription mode can be streamed at a time.
+
+    The recordings of every date go through the same pipeline, one date after another,
+    so the stages stay busy across date boundaries and share one Drive service, one set
+    of HTTP sessions and one loaded model. Items carry their date through the stages.
+    """
+    api_type = "whisper" if args.whisperapi else "lemonfox" if args.lemonfoxapi else None
+    file_limit = config[f"{api_type}_api_file_size_limit"] if api_type else None
+
+    def seeds(date_prefix):
+        audio_dir = f"{data_dir()}/{date_prefix}/Audio"
+        text_dir = f"{data_dir()}/{date_prefix}/Text"
+        create_directory(audio_dir)
+        create_directory(text_dir)
+        import_directory(date_prefix, audio_dir, text_dir)
+        if api_type:
+            file_paths = [
+                os.path.join(audio_dir, file_name)
+                for file_name in pending_transcription(
+                    date_prefix, "api", ready_stages=("downloaded", "chunked")
+                )
+            ]
+        elif args.whisper:
+            file_paths = get_files_to_transcribe(date_prefix)
+        else:
+            file_paths = []
+        return [file_path for file_path in file_paths if os.path.exists(file_path)]
+
+    def items():
+        for date_prefix in date_prefixes:
+            file_paths = seeds(date_prefix)
+            for file_path in file_paths:
+                yield date_prefix, file_path
+            if args.download:
+                seeded = {os.path.basename(file_path) for file_path in file_paths}
+                for item in list_date_files(
+                    service, date_prefix, "Audio", refresh=args.refresh_listing
+                ):
+                    if item["name"].startswith(".") or item["name"] in seeded:
+                        continue
+                    # Chunked recordings are finished or their chunks were seeded above.
+                    if api_type and stage_done(date_prefix, item["name"], "chunked"):
+                        continue
+                    yield date_prefix, item
+
+    def download(job):
+        date_prefix, item = job
+        if isinstance(item, str):
+            return [job]
+        return [
+            (date_prefix, download_file(get_thread_service(), item, date_prefix, "Audio"))
+        ]
+
+    def prepare(job):
+        date_prefix, file_path = job
+        audio_dir = os.path.dirname(file_path)
+        file_name = os.path.basename(file_path)
+        metadata = get_metadata(file_path)
+        if metadata["status"] == "empty":
+            os.remove(file_path)
+            return []
+        if api_type is None:
+            if metadata["status"] == "corrupt" or "prechunked" in file_name:
+                return []
+            return [job]
+        if stage_done(date_prefix, file_name, "chunked"):
+            chunk_names = [file_name]
+        else:
+            chunk_names = chunk_file(
+                date_prefix,
+                file_name,
+                metadata,
+                file_limit,
+                args.split_workers,
+                args.canonical_audio,
+                args.api_encoding,
+            )
+        return [
+            (date_prefix, os.path.join(audio_dir, chunk_name))
+            for chunk_name in chunk_names
+            if is_api_input(chunk_name, api_type)
+        ]
+
+    transcriber = None
+    if api_type:
+        transcribe_workers = args.api_workers
+
+        def transcribe(job):
+            date_prefix, file_path = job
+            transcript = transcribe_file(
+                date_prefix, file_path, api_type, api_key, transcribe_workers
+            )
+            return [(date_prefix, transcript)] if transcript else []
+
+    else:
+        transcribe_workers = args.whisper_workers
+        if args.whisper:
+            transcriber = LocalTranscriber(
+                args.whispermodel or "base",
+                workers=args.whisper_workers,
+                backend=args.backend,
+                use_daemon=not args.no_daemon,
+            )
+
+        def transcribe(job):
+            date_prefix, file_path = job
+            if transcriber is None:
+                return []
+            return [(date_prefix, transcriber.transcribe(file_path, date_prefix))]
+
+    stages = [
+        Stage("download", download, args.download_workers),
+        Stage("chunk", prepare),
+        Stage("transcribe", transcribe, transcribe_workers),
+    ]
+    if args.upload:
+        targets = {}
+        targets_lock = threading.Lock()
+
+        def upload(job):
+            date_prefix, file_path = job
+            with targets_lock:
+                if date_prefix not in targets:
+                    # Built on this worker's own service, as the main thread keeps
+                    # using the shared one to list later dates.
+                    targets[date_prefix] = UploadTarget(
+                        get_thread_service(),
+                        date_prefix,
+                        model=args.whispermodel,
+                        delta=args.delta_upload,
+                        in_place=args.upload_in_place,
+                    )
+            upload_file(get_thread_service(), file_path, date_prefix, targets[date_prefix])
+            return []
+
+        stages.append(Stage("upload", upload, args.upload_workers))
+
+    try:
+        run_pipeline(items(), stages, args.pipeline_queue_size)
+    finally:
+        if transcriber is not None:
+            transcriber.close()
+
+
+def process_date(args, date_prefix, service, api_key):
+    """
+    Run the selected stages for one date, each stage over all of its files in turn.
+
+    Each stage is timed, and profiled with --profile, see metrics.stage. Dates without
+    an Audio folder, after downloading if that was asked for, are skipped.
+    """
+    if args.download:
+        with stage("download", date_prefix):
+            download_files(
+                service,
+                date_prefix,
+                "Audio",
+                workers=args.download_workers,
+                refresh=args.refresh_listing,
+            )
+            download_files(
+                service,
+                date_prefix,
+                "Logs",
+                workers=args.download_workers,
+                refresh=args.refresh_listing,
+            )
+        print(f"Download completed for date: {date_prefix}")
+    if not os.path.isdir(f"{data_dir()}/{date_prefix}/Audio"):
+        # Ranges of dates cover days without recordings, such as weekends.
+        print(f"No audio for date {date_prefix}, skipping it.")
+        return
+    delete_zero_byte_files(date_prefix)
+
+    create_directory(f"{data_dir()}/{date_prefix}/Text")
+    if args.whisper:
+        with stage("transcribe", date_prefix):
+            transcribe_audio_whisper_local(
+                date_prefix,
+                model_size=args.whispermodel or "base",
+                workers=args.whisper_workers,
+                backend=args.backend,
+                use_daemon=not args.no_daemon,
+                batch_size=args.whisper_batch_size,
+            )
+    if args.whisperapi or args.lemonfoxapi:
+        api_type = "whisper" if args.whisperapi else "lemonfox"
+        with stage("chunk", date_prefix):
+            chunk_for_api(
+                f"{api_type}_api_file_size_limit",
+                date_prefix,
+                args.split_workers,
+                args.canonical_audio,
+                args.api_encoding,
+            )
+        with stage("transcribe", date_prefix):
+            new_transcribe(date_prefix, api_type, api_key, workers=args.api_workers)
+
+    if args.upload:
+        with stage("upload", date_prefix):
+            upload_files(
+                service,
+                date_prefix,
+                "Text",
+                model=args.whispermodel,
+                workers=args.upload_workers,
+                delta=args.delta_upload,
+                in_place=args.upload_in_place,
+                pending_only=args.resume,
             )
 
 
@@ -208,17 +645,96 @@ def parse_args():
     Returns:
         args: command line arguments
         split: split audio files into chunks
-        date_prefix: date in yyyymmdd format
+        date_prefixes: dates in yyyymmdd format
     """
     parser = argparse.ArgumentParser(description="Process and handle audio files.")
     parser.add_argument(
-        "--date", help="The date of the recordings in dd/mm/yyyy format", required=True
+        "--date", help="The date of the recordings in dd/mm/yyyy format"
+    )
+    parser.add_argument(
+        "--dates",
+        help="Comma separated dates of the recordings in dd/mm/yyyy format",
+    )
+    parser.add_argument(
+        "--date-range",
+        help="First and last date of the recordings as dd/mm/yyyy:dd/mm/yyyy",
+    )
+    parser.add_argument(
+        "--resume",
+        help="Repeat the last run that did not finish, skipping work already done",
+        action="store_true",
     )
     parser.add_argument("--download", help="Download files", action="store_true")
+    parser.add_argument(
+        "--download-workers",
+        help="Number of files to download from Google Drive concurrently",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--refresh-listing",
+        help="Ignore the cached Google Drive listing and query Drive again",
+        action="store_true",
+    )
     parser.add_argument(
         "--whisper", help="Transcribe files using local whisper", action="store_true"
     )
+    parser.add_argument(
+        "--whisper-workers",
+        help="Number of local whisper worker processes",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--backend",
+        help="Inference backend for local whisper",
+        choices=BACKENDS,
+        default="pytorch",
+    )
+    parser.add_argument(
+        "--no-daemon",
+        help="Transcribe in this process even if the transcription server is running",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--whisper-batch-size",
+        help="Number of 30 second windows to decode together with local whisper",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--pipeline",
+        help="Stream each recording through the stages instead of running them one after another",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--pipeline-queue-size",
+        help="Number of files that can wait in front of each pipeline stage",
+        type=int,
+        default=4,
+    )
+    parser.add_argument(
+        "--profile",
+        help="Profile each stage with cProfile and tracemalloc",
+        action="store_true",
+    )
     parser.add_argument("--upload", help="Upload files", action="store_true")
+    parser.add_argument(
+        "--upload-workers",
+        help="Number of files to upload to Google Drive concurrently",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--delta-upload",
+        help="Only upload files that are new or changed since earlier uploads",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--upload-in-place",
+        help="Upload into a stable per-model folder, updating changed files in place",
+        action="store_true",
+    )
     parser.add_argument(
         "--whispermodel", help="Version of whisper model to use", type=str
     )
@@ -226,14 +742,52 @@ def parse_args():
         "--lemonfoxapi", help="Use LemonFox's whisper API", action="store_true"
     )
     parser.add_argument("--whisperapi", help="Use Whisper API", action="store_true")
+    parser.add_argument(
+        "--api-workers",
+        help="Number of files to send to the transcription API concurrently",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--split-workers",
+        help="Number of audio chunks to export or encode concurrently for an API",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--canonical-audio",
+        help="Convert recordings to 16 kHz 16 bit mono before chunking them for an API",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--api-encoding",
+        help="Format of the chunks sent to an API: wav, lossless flac or speech opus",
+        choices=["wav", "flac", "opus"],
+        default="wav",
+    )
     args = parser.parse_args()
-
-    date_input = args.date or None
-    date_prefix = validate_date(date_input)
-
-    if not date_prefix:
-        print("Invalid date format. Please enter the date in dd/mm/yyyy format.")
+    args.run_id = None
+
+    if args.resume:
+        run = last_unfinished_run()
+        if not run:
+            print("There is no unfinished run to resume.")
+            sys.exit()
+        print(f"Resuming run {run['run_id']}: {' '.join(run['argv'])}")
+        args = parser.parse_args(run["argv"] + ["--resume"])
+        args.run_id = run["run_id"]
+
+    date_inputs = [args.date] if args.date else []
+    if args.dates:
+        date_inputs += [date.strip() for date in args.dates.split(",") if date.strip()]
+    date_prefixes = [validate_date(date_input) for date_input in date_inputs]
+    if args.date_range:
+        date_prefixes += expand_date_range(args.date_range) or [None]
+
+    if not date_prefixes or not all(date_prefixes):
+        print("Invalid or missing date. Please enter the date in dd/mm/yyyy format.")
         sys.exit()
+    date_prefixes = list(dict.fromkeys(date_prefixes))
     if args.lemonfoxapi and args.whisperapi:
         print("Cannot use both Lemonfox and Whisper API.")
         sys.exit()
@@ -246,11 +800,12 @@ def parse_args():
         print("Cannot transcribe using both local whisper model and API.")
         sys.exit()
 
+    API_KEY = None
     if args.lemonfoxapi:
         API_KEY = config["lemonfox_api_key"]
     elif args.whisperapi:
         API_KEY = config["whisper_api_key"]
-    return args, date_prefix, API_KEY
+    return args, date_prefixes, API_KEY
 
 
 if __name__ == "__main__":
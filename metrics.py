@@ -0,0 +1,228 @@
+"""
+This module records how long each stage of a run takes and how much work it does.
+
+The stages (download, chunk, transcribe and upload) add the files, bytes and seconds of
+audio they handle as they go, and stage() times each call of a stage. At the end of a
+run write_report() saves everything as a JSON report for the run and as a Prometheus
+textfile, so node_exporter can pick up the latest run.
+
+The real-time factor of a stage is the seconds it spent per second of audio it handled,
+as printed by the transcription functions. In the streaming mode the stages overlap, so
+their time is the time their workers were busy (see pipeline.Stage) rather than wall
+time.
+
+With enable_profiling(), every stage() call is also run under cProfile and tracemalloc.
+cProfile only sees the thread that runs the stage, so profile with one worker per stage
+to see the work itself rather than the pool waiting on it.
+
+Functions:
+- record_metrics(stage_name, **values): Add to the counters of a stage.
+- observe_queue_depth(stage_name, depth): Record the depth of the queue in front of a stage.
+- stage(stage_name, label=None): Time a stage, and profile it when profiling is enabled.
+- enable_profiling(directory): Profile every stage and write the profiles to directory.
+- get_stage_metrics(): Return the counters of every stage.
+- write_report(run_id, retries=None): Write the JSON report and the Prometheus textfile.
+"""
+
+import contextlib
+import cProfile
+import json
+import os
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+from settings import config, data_dir
+
+METRICS_DIR_NAME = "metrics"
+PROMETHEUS_FILE_NAME = "transcription.prom"
+TRACEMALLOC_FRAMES = 10
+TRACEMALLOC_TOP_LINES = 25
+
+_stages = {}
+_queue_depths = {}
+_stages_lock = threading.Lock()
+_profile_dir = None
+_started = time.time()
+
+
+def record_metrics(stage_name, **values):
+    """Add values to the counters of a stage, e.g. files=1, bytes=size."""
+    with _stages_lock:
+        _stages.setdefault(stage_name, Counter()).update(values)
+
+
+def observe_queue_depth(stage_name, depth):
+    """Record the depth of the queue in front of a stage, keeping the largest seen."""
+    with _stages_lock:
+        _queue_depths[stage_name] = max(_queue_depths.get(stage_name, 0), depth)
+
+
+def enable_profiling(directory):
+    """Run every later stage() under cProfile and tracemalloc, writing the results to directory."""
+    global _profile_dir
+    os.makedirs(directory, exist_ok=True)
+    _profile_dir = directory
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+
+
+@contextlib.contextmanager
+def stage(stage_name, label=None):
+    """
+    Time the code in the with block as one call of a stage.
+
+    When profiling is enabled, the block is also profiled and the profile is written
+    to <stage>_<label>.prof, which pstats and snakeviz read, along with the lines that
+    allocated the most memory during the block in <stage>_<label>_memory.txt.
+
+    Args:
+        stage_name (str): The stage the time is added to.
+        label (str): Distinguishes the profiles of several calls, e.g. the date.
+    """
+    profiler = None
+    snapshot = None
+    if _profile_dir is not None:
+        tracemalloc.reset_peak()
+        snapshot = tracemalloc.take_snapshot()
+        profiler = cProfile.Profile()
+        profiler.enable()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        record_metrics(stage_name, wall_seconds=elapsed, calls=1)
+        if profiler is not None:
+            profiler.disable()
+            _write_profile(stage_name, label, profiler, snapshot)
+
+
+def _write_profile(stage_name, label, profiler, snapshot):
+    name = f"{stage_name}_{label}" if label else stage_name
+    profiler.dump_stats(os.path.join(_profile_dir, f"{name}.prof"))
+
+    _, peak = tracemalloc.get_traced_memory()
+    with _stages_lock:
+        counters = _stages.setdefault(stage_name, Counter())
+        counters["peak_memory_bytes"] = max(counters["peak_memory_bytes"], peak)
+
+    differences = tracemalloc.take_snapshot().compare_to(snapshot, "lineno")
+    with open(
+        os.path.join(_profile_dir, f"{name}_memory.txt"), "w", encoding="utf-8"
+    ) as file:
+        file.write(f"Peak traced memory: {peak / 1024 / 1024:.1f}mb\n")
+        for difference in differences[:TRACEMALLOC_TOP_LINES]:
+            file.write(f"{difference}\n")
+
+
+def get_stage_metrics():
+    """
+    Return the counters of every stage with their throughput and real-time factor.
+
+    Returns:
+        dict: The counters of each stage, by stage name.
+    """
+    with _stages_lock:
+        stages = {name: dict(counters) for name, counters in _stages.items()}
+        queue_depths = dict(_queue_depths)
+
+    for name, depth in queue_depths.items():
+        stages.setdefault(name, {})["max_queue_depth"] = depth
+    for counters in stages.values():
+        seconds = counters.get("busy_seconds") or counters.get("wall_seconds")
+        if not seconds:
+            continue
+        if counters.get("bytes"):
+            counters["mb_per_second"] = counters["bytes"] / 1024 / 1024 / seconds
+        if counters.get("audio_seconds"):
+            counters["real_time_factor"] = seconds / counters["audio_seconds"]
+    return stages
+
+
+def _metrics_dir():
+    return os.path.join(data_dir(), METRICS_DIR_NAME)
+
+
+def _prometheus_lines(run_id, stages, retries):
+    """Return the metrics of a run in the Prometheus text exposition format."""
+    metrics = {
+        "wall_seconds": ("gauge", "Seconds the stage ran for in the last run."),
+        "busy_seconds": ("gauge", "Seconds the stage's pipeline workers were busy."),
+        "files": ("gauge", "Files the stage handled."),
+        "bytes": ("gauge", "Bytes the stage moved."),
+        "audio_seconds": ("gauge", "Seconds of audio the stage handled."),
+        "real_time_factor": ("gauge", "Seconds the stage took per second of audio."),
+        "requests": ("gauge", "HTTP requests the stage sent."),
+        "rate_limit_wait_seconds": ("gauge", "Seconds the stage waited on rate limits."),
+        "failed": ("gauge", "Files the stage failed on."),
+        "max_queue_depth": ("gauge", "Largest number of files waiting for the stage."),
+        "peak_memory_bytes": ("gauge", "Peak traced memory while the stage ran."),
+    }
+    lines = []
+    for key, (kind, description) in metrics.items():
+        values = [(name, counters[key]) for name, counters in stages.items() if key in counters]
+        if not values:
+            continue
+        lines.append(f"# HELP transcription_stage_{key} {description}")
+        lines.append(f"# TYPE transcription_stage_{key} {kind}")
+        lines.extend(
+            f'transcription_stage_{key}{{stage="{name}"}} {value}' for name, value in values
+        )
+
+    if retries:
+        lines.append("# HELP transcription_api_events Retries and failed statuses per API.")
+        lines.append("# TYPE transcription_api_events gauge")
+        for api_type, counts in retries.items():
+            lines.extend(
+                f'transcription_api_events{{api="{api_type}",event="{event}"}} {count}'
+                for event, count in counts.items()
+            )
+
+    lines.append("# HELP transcription_last_run_id ID of the last run in the job store.")
+    lines.append("# TYPE transcription_last_run_id gauge")
+    lines.append(f"transcription_last_run_id {run_id}")
+    lines.append("# HELP transcription_last_run_timestamp_seconds When the last run finished.")
+    lines.append("# TYPE transcription_last_run_timestamp_seconds gauge")
+    lines.append(f"transcription_last_run_timestamp_seconds {time.time():.0f}")
+    return lines
+
+
+def write_report(run_id, retries=None):
+    """
+    Write the metrics of the run to metrics/run_<run_id>.json in the data directory and
+    to the Prometheus textfile, "metrics_textfile" in config.json or
+    metrics/transcription.prom in the data directory.
+
+    Args:
+        run_id (int): The job store ID of the run.
+        retries (dict): Retry counters per API, see transcribe_api.get_retry_stats.
+
+    Returns:
+        str: The path of the JSON report.
+    """
+    stages = get_stage_metrics()
+    report = {
+        "run_id": run_id,
+        "started_at": _started,
+        "finished_at": time.time(),
+        "stages": stages,
+        "retries": retries or {},
+    }
+    metrics_dir = _metrics_dir()
+    os.makedirs(metrics_dir, exist_ok=True)
+    report_path = os.path.join(metrics_dir, f"run_{run_id}.json")
+    with open(report_path, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2)
+
+    textfile = config.get("metrics_textfile") or os.path.join(
+        metrics_dir, PROMETHEUS_FILE_NAME
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(textfile)), exist_ok=True)
+    # node_exporter may read the file at any moment, so it is replaced in one step.
+    tmp_file = f"{textfile}.tmp"
+    with open(tmp_file, "w", encoding="utf-8") as file:
+        file.write("\n".join(_prometheus_lines(run_id, stages, retries)) + "\n")
+    os.replace(tmp_file, textfile)
+    return report_path
@@ -0,0 +1,82 @@
+"""
+This module decodes the PCM audio of WAV files into NumPy arrays.
+
+Audio is read straight from the data chunk located by audio_metadata, a block of frames
+at a time, so recordings of any length are processed in constant memory. 8, 16, 24 and
+32 bit integer PCM and 32 and 64 bit float PCM are supported. Samples are returned as
+float32 in the range -1 to 1 with one column per channel.
+
+NumPy is imported by the functions that use it, so importing this module is cheap.
+
+Functions:
+- decode_frames(data, metadata): Decode raw PCM bytes in the format of metadata.
+- read_frames(file_path, metadata, start_frame=0, n_frames=None, block_frames=BLOCK_FRAMES): Yield the frames of a WAV file in blocks.
+"""
+
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+BLOCK_FRAMES = 1024 * 1024
+
+
+def decode_frames(data, metadata):
+    """
+    Decode raw PCM bytes in the format of metadata.
+
+    Args:
+        data (bytes): Whole frames of PCM audio.
+        metadata (dict): The header metadata from audio_metadata.
+
+    Returns:
+        numpy.ndarray: float32 samples of shape (frames, channels).
+    """
+    import numpy as np
+
+    bits = metadata["bits_per_sample"]
+    channels = metadata["channels"]
+    if metadata["format_tag"] == WAVE_FORMAT_IEEE_FLOAT:
+        samples = np.frombuffer(data, dtype="<f4" if bits == 32 else "<f8")
+        samples = samples.astype(np.float32)
+    elif bits == 8:
+        # 8 bit WAV is unsigned, centred on 128.
+        samples = (np.frombuffer(data, dtype=np.uint8).astype(np.float32) - 128) / 128
+    elif bits == 16:
+        samples = np.frombuffer(data, dtype="<i2").astype(np.float32) / 32768
+    elif bits == 24:
+        raw = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        values = raw[:, 0] | (raw[:, 1] << 8) | (raw[:, 2] << 16)
+        # Sign extend from 24 bits.
+        values = np.where(values & 0x800000, values - 0x1000000, values)
+        samples = values.astype(np.float32) / 8388608
+    elif bits == 32:
+        samples = np.frombuffer(data, dtype="<i4").astype(np.float32) / 2147483648
+    else:
+        raise ValueError(f"Unsupported sample width: {bits} bits")
+    return samples.reshape(-1, channels)
+
+
+def read_frames(file_path, metadata, start_frame=0, n_frames=None, block_frames=BLOCK_FRAMES):
+    """
+    Yield the frames of a WAV file as float32 arrays of up to block_frames frames.
+
+    Args:
+        file_path (str): Path to the WAV file.
+        metadata (dict): The header metadata of the file from audio_metadata.
+        start_frame (int): The first frame to read.
+        n_frames (int): Number of frames to read, by default up to the end of the file.
+        block_frames (int): Number of frames per yielded block.
+
+    Yields:
+        numpy.ndarray: float32 samples of shape (frames, channels).
+    """
+    frame_size = metadata["block_align"]
+    if n_frames is None:
+        n_frames = metadata["n_frames"] - start_frame
+    with open(file_path, "rb") as file:
+        file.seek(metadata["data_offset"] + start_frame * frame_size)
+        remaining = n_frames
+        while remaining > 0:
+            data = file.read(min(block_frames, remaining) * frame_size)
+            frames = len(data) // frame_size
+            if not frames:
+                break
+            yield decode_frames(data[: frames * frame_size], metadata)
+            remaining -= frames
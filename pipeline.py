@@ -0,0 +1,126 @@
+"""
+This module runs items through a chain of stages connected by bounded queues.
+
+Each stage applies its function to one item at a time on a number of worker threads and
+passes whatever the function returns on to the next stage. Because the queues between
+stages are bounded, a slow stage makes the stages before it wait instead of letting work
+pile up on disk or in memory, while every stage still works on whatever is ready.
+
+Functions:
+- run_pipeline(items, stages, queue_size=4): Feed items through the stages and wait for them to finish.
+"""
+
+import queue
+import threading
+import time
+
+from metrics import observe_queue_depth, record_metrics
+
+_DONE = object()
+
+
+class Stage:
+    """
+    One step of a pipeline.
+
+    Args:
+        name (str): The name the stage is reported under.
+        func (callable): Called with each item, returns the items to pass on to the next
+            stage. Returning an empty list drops the item.
+        workers (int): Number of threads running func.
+    """
+
+    def __init__(self, name, func, workers=1):
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+        self.processed = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+        self.max_queue_depth = 0
+        self._running = self.workers
+        self._lock = threading.Lock()
+
+    def _work(self, inbox, outbox):
+        while True:
+            item = inbox.get()
+            if item is _DONE:
+                # Leave the marker for the other workers of this stage.
+                inbox.put(_DONE)
+                break
+            start = time.perf_counter()
+            try:
+                outputs = self.func(item)
+            except Exception as e:
+                print(f"{self.name} failed for {item}: {e}")
+                with self._lock:
+                    self.failed += 1
+                    self.busy_seconds += time.perf_counter() - start
+                continue
+            with self._lock:
+                self.processed += 1
+                self.busy_seconds += time.perf_counter() - start
+            for output in outputs or ():
+                if outbox is not None:
+                    outbox.put(output)
+                    with self._lock:
+                        self.max_queue_depth = max(self.max_queue_depth, outbox.qsize())
+
+        with self._lock:
+            self._running -= 1
+            last = self._running == 0
+        if last and outbox is not None:
+            outbox.put(_DONE)
+
+
+def run_pipeline(items, stages, queue_size=4):
+    """
+    Feed items through the stages and wait until every stage has finished.
+
+    Items are handed to the first stage as it accepts them, so items can be a generator
+    that is only consumed as fast as the pipeline drains. A failure is printed and only
+    drops the item that caused it.
+
+    Args:
+        items (iterable): The items for the first stage.
+        stages (list): The Stage objects, in order.
+        queue_size (int): Number of items that can wait in front of each stage.
+
+    Returns:
+        list: The stages, with their counters filled in.
+    """
+    queues = [queue.Queue(maxsize=queue_size) for _ in stages] + [None]
+    threads = []
+    for index, stage in enumerate(stages):
+        for worker in range(stage.workers):
+            thread = threading.Thread(
+                target=stage._work,
+                args=(queues[index], queues[index + 1]),
+                name=f"{stage.name}-{worker}",
+                daemon=True,
+            )
+            thread.start()
+            threads.append(thread)
+
+    start = time.perf_counter()
+    for item in items:
+        queues[0].put(item)
+    queues[0].put(_DONE)
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    for index, stage in enumerate(stages):
+        record_metrics(
+            stage.name, busy_seconds=stage.busy_seconds, failed=stage.failed
+        )
+        # A stage's outbox is the queue in front of the stage after it.
+        if index + 1 < len(stages):
+            observe_queue_depth(stages[index + 1].name, stage.max_queue_depth)
+        print(
+            f"{stage.name}: {stage.processed} done, {stage.failed} failed, "
+            f"busy {stage.busy_seconds / (stage.workers * elapsed) if elapsed else 0:.0%}, "
+            f"queue depth up to {stage.max_queue_depth}"
+        )
+    print(f"Pipeline finished in {elapsed:.1f}s.")
+    return stages
@@ -0,0 +1,152 @@
+"""
+This module provides the rate limiting used when sending audio to the transcription APIs.
+
+Each provider limits both the number of requests and the amount of audio sent per minute.
+A token bucket is kept for each of the two, and a request waits until both allow it.
+
+Classes:
+- TokenBucket: A thread-safe token bucket refilled at a constant rate.
+- ProviderLimiter: Request and byte limits for one transcription provider.
+- CircuitBreaker: Stops requests to a provider after repeated failures.
+
+Functions:
+- get_limiter(api_type): Return the shared ProviderLimiter for a provider.
+- get_circuit_breaker(api_type): Return the shared CircuitBreaker for a provider.
+"""
+
+import threading
+import time
+
+from settings import config
+
+_limiters = {}
+_breakers = {}
+_limiters_lock = threading.Lock()
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket.
+
+    The bucket holds at most capacity tokens and is refilled at rate tokens per second.
+    A request larger than the capacity is let through once the bucket is full, leaving it
+    in debt, so oversized requests are slowed down rather than blocked forever.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, amount=1):
+        """Block until amount tokens are available and take them. Returns the time waited."""
+        waited = 0.0
+        while True:
+            with self.lock:
+                self._refill()
+                needed = min(amount, self.capacity)
+                if self.tokens >= needed:
+                    self.tokens -= amount
+                    return waited
+                delay = (needed - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+class ProviderLimiter:
+    """Requests per minute and bytes per minute limits for one transcription provider."""
+
+    def __init__(self, requests_per_minute, bytes_per_minute):
+        self.requests = TokenBucket(requests_per_minute / 60, requests_per_minute)
+        self.bytes = TokenBucket(bytes_per_minute / 60, bytes_per_minute)
+
+    def acquire(self, n_bytes):
+        """Block until a request of n_bytes may be sent. Returns the time waited."""
+        return self.requests.acquire(1) + self.bytes.acquire(n_bytes)
+
+
+def get_limiter(api_type):
+    """
+    Return the shared ProviderLimiter for a provider.
+
+    The limits are read from "<api_type>_api_requests_per_minute" and
+    "<api_type>_api_mb_per_minute" in config.json.
+    """
+    with _limiters_lock:
+        if api_type not in _limiters:
+            _limiters[api_type] = ProviderLimiter(
+                config.get(f"{api_type}_api_requests_per_minute", 50),
+                config.get(f"{api_type}_api_mb_per_minute", 500) * 1024 * 1024,
+            )
+        return _limiters[api_type]
+
+
+class CircuitOpenError(Exception):
+    """Raised when a request is refused because the provider's circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Stops sending requests to a provider after repeated failures.
+
+    After threshold consecutive failures the breaker opens and every request is refused
+    for cooldown seconds. After that a single trial request is let through: success closes
+    the breaker again, failure keeps it open for another cooldown.
+    """
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    def before_request(self):
+        """Raise CircuitOpenError if requests are currently refused."""
+        with self.lock:
+            if self.opened_at is None:
+                return
+            if time.monotonic() - self.opened_at < self.cooldown or self.trial_in_flight:
+                raise CircuitOpenError(
+                    f"Circuit open after {self.failures} consecutive failures."
+                )
+            self.trial_in_flight = True
+
+    def record_success(self):
+        """Record a successful request and close the breaker."""
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        """Record a failed request, opening the breaker once threshold is reached."""
+        with self.lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+
+def get_circuit_breaker(api_type):
+    """
+    Return the shared CircuitBreaker for a provider.
+
+    The breaker opens after "api_circuit_breaker_threshold" consecutive failures and stays
+    open for "api_circuit_breaker_cooldown_seconds".
+    """
+    with _limiters_lock:
+        if api_type not in _breakers:
+            _breakers[api_type] = CircuitBreaker(
+                config.get("api_circuit_breaker_threshold", 5),
+                config.get("api_circuit_breaker_cooldown_seconds", 60),
+            )
+        return _breakers[api_type]
@@ -0,0 +1,180 @@
+"""
+This module converts recordings to 16 kHz 16 bit mono, the format Whisper works in.
+
+Whisper downmixes and resamples everything it is given to 16 kHz mono, so sending it
+stereo, 44.1/48 kHz or 24 bit audio only makes each request bigger. Converting first
+lets every API chunk carry several times more audio, so the same recording takes far
+fewer and smaller requests.
+
+The audio is read in blocks (see pcm), downmixed by averaging the channels, low-pass
+filtered below 8 kHz with a windowed-sinc filter and resampled by linear interpolation.
+The filter state is carried from block to block, so memory use stays flat however long
+the recording is.
+
+Functions:
+- is_canonical(metadata): Check whether a WAV file is already 16 kHz 16 bit mono PCM.
+- output_length(metadata): Return the number of 16 kHz samples a WAV file resamples to.
+- resampled_blocks(file_path, metadata): Yield the audio of a WAV file as 16 kHz mono float32 blocks.
+- to_canonical(file_path, output_path, metadata=None): Write a 16 kHz 16 bit mono copy of a WAV file.
+"""
+
+import math
+
+from audio_metadata import WAV_HEADER_BYTES, get_metadata, wav_header
+from metrics import record_metrics
+from pcm import read_frames
+
+TARGET_SAMPLE_RATE = 16000
+CUTOFF_HZ = 7600
+FILTER_ZERO_CROSSINGS = 16
+WAVE_FORMAT_PCM = 0x0001
+CANONICAL_FORMAT = {
+    "format_tag": WAVE_FORMAT_PCM,
+    "channels": 1,
+    "sample_rate": TARGET_SAMPLE_RATE,
+    "block_align": 2,
+    "bits_per_sample": 16,
+}
+
+
+def is_canonical(metadata):
+    """Check whether the metadata describes 16 kHz 16 bit mono PCM."""
+    return all(metadata.get(key) == value for key, value in CANONICAL_FORMAT.items())
+
+
+def _lowpass_taps(sample_rate):
+    """Return a windowed-sinc low-pass filter for downsampling sample_rate to 16 kHz."""
+    import numpy as np
+
+    cutoff = CUTOFF_HZ / sample_rate
+    n_taps = 2 * math.ceil(FILTER_ZERO_CROSSINGS * sample_rate / TARGET_SAMPLE_RATE) + 1
+    n = np.arange(n_taps) - (n_taps - 1) / 2
+    taps = 2 * cutoff * np.sinc(2 * cutoff * n) * np.blackman(n_taps)
+    return (taps / taps.sum()).astype(np.float32)
+
+
+class _Resampler:
+    """
+    Resamples a stream of mono blocks to 16 kHz.
+
+    Output sample n is taken from source position n * sample_rate / 16000 of the
+    filtered signal, interpolating between the two samples around it. The filtered
+    samples that later output samples still need are kept between blocks.
+    """
+
+    def __init__(self, sample_rate):
+        import numpy as np
+
+        self.ratio = sample_rate / TARGET_SAMPLE_RATE
+        if sample_rate > TARGET_SAMPLE_RATE:
+            self.taps = _lowpass_taps(sample_rate)
+        else:
+            self.taps = np.ones(1, dtype=np.float32)
+        self.history = np.zeros(len(self.taps) - 1, dtype=np.float32)
+        self.delay = (len(self.taps) - 1) // 2
+        # Source position of buffer[0], allowing for the delay of the filter.
+        self.buffer = np.zeros(0, dtype=np.float32)
+        self.buffer_start = -self.delay
+        self.next_output = 0
+
+    def process(self, mono, limit=None):
+        """Feed a block of source samples and return the output samples now complete."""
+        import numpy as np
+
+        signal = np.concatenate((self.history, mono))
+        if len(self.history):
+            self.history = signal[len(signal) - len(self.history) :]
+        filtered = np.convolve(signal, self.taps, mode="valid")
+        self.buffer = np.concatenate((self.buffer, filtered))
+
+        # Output samples whose position has a filtered sample on either side.
+        last_position = self.buffer_start + len(self.buffer) - 2
+        end = math.floor(last_position / self.ratio) + 1 if last_position >= 0 else 0
+        if limit is not None:
+            end = min(end, limit)
+        if end <= self.next_output:
+            return np.zeros(0, dtype=np.float32)
+
+        positions = np.arange(self.next_output, end) * self.ratio - self.buffer_start
+        index = positions.astype(np.int64)
+        fraction = (positions - index).astype(np.float32)
+        output = self.buffer[index] * (1 - fraction) + self.buffer[index + 1] * fraction
+        self.next_output = end
+
+        consumed = max(0, math.floor(end * self.ratio - self.buffer_start) - 1)
+        self.buffer = self.buffer[consumed:]
+        self.buffer_start += consumed
+        return output
+
+
+def output_length(metadata):
+    """Return the number of 16 kHz samples whose position falls within the recording."""
+    n_frames = metadata["n_frames"]
+    if not n_frames:
+        return 0
+    return (n_frames - 1) * TARGET_SAMPLE_RATE // metadata["sample_rate"] + 1
+
+
+def resampled_blocks(file_path, metadata):
+    """
+    Yield the audio of a WAV file downmixed and resampled to 16 kHz.
+
+    Args:
+        file_path (str): Path to the WAV file.
+        metadata (dict): The header metadata of the file from audio_metadata.
+
+    Yields:
+        numpy.ndarray: float32 samples in the range -1 to 1, output_length(metadata) of
+        them in all.
+    """
+    import numpy as np
+
+    n_output = output_length(metadata)
+    resampler = _Resampler(metadata["sample_rate"])
+    produced = 0
+
+    def blocks():
+        for block in read_frames(file_path, metadata):
+            yield resampler.process(block.mean(axis=1), n_output)
+        # Push the tail of the recording through the filter.
+        tail = np.zeros(resampler.delay + 2, dtype=np.float32)
+        yield resampler.process(tail, n_output)
+
+    for samples in blocks():
+        samples = samples[: n_output - produced]
+        produced += len(samples)
+        yield samples
+    if produced < n_output:
+        yield np.zeros(n_output - produced, dtype=np.float32)
+
+
+def to_canonical(file_path, output_path, metadata=None):
+    """
+    Write a 16 kHz 16 bit mono PCM copy of a WAV file.
+
+    Args:
+        file_path (str): Path to the WAV file.
+        output_path (str): Path of the WAV file to write.
+        metadata (dict): The header metadata of the file from audio_metadata, read if
+            not given.
+
+    Returns:
+        int: The size of the written file in bytes.
+    """
+    import numpy as np
+
+    metadata = metadata or get_metadata(file_path)
+    n_output = output_length(metadata)
+    with open(output_path, "wb") as output:
+        output.write(wav_header(CANONICAL_FORMAT, n_output * 2))
+        for samples in resampled_blocks(file_path, metadata):
+            pcm = np.clip(np.round(samples * 32767), -32768, 32767).astype("<i2")
+            output.write(pcm.tobytes())
+
+    record_metrics(
+        "resample",
+        files=1,
+        audio_seconds=metadata["duration"],
+        bytes_saved=metadata["data_bytes"] - n_output * 2,
+    )
+    return WAV_HEADER_BYTES + n_output * 2
@@ -0,0 +1,63 @@
+"""
+This module loads the configuration in config.json once, the first time it is used.
+
+Every module reads its settings through `config` instead of opening config.json when it
+is imported, so importing the pipeline's modules does not touch the disk and a command
+only needs the file once it actually uses a setting.
+
+The file is looked for in the path set by the TRANSCRIBE_CONFIG environment variable,
+then in the current directory, then next to this module.
+
+Functions:
+- config_path(): Return the path of the configuration file in use.
+- data_dir(): Return the directory holding the audio, transcripts and caches.
+"""
+
+import json
+import os
+import threading
+from collections.abc import Mapping
+
+CONFIG_FILE = "config.json"
+
+
+def config_path():
+    """Return the path of the configuration file in use."""
+    if os.environ.get("TRANSCRIBE_CONFIG"):
+        return os.environ["TRANSCRIBE_CONFIG"]
+    if os.path.exists(CONFIG_FILE):
+        return CONFIG_FILE
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), CONFIG_FILE)
+
+
+class _LazyConfig(Mapping):
+    """A read-only mapping of config.json that is loaded on first access."""
+
+    def __init__(self):
+        self._values = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._values is None:
+            with self._lock:
+                if self._values is None:
+                    with open(config_path(), "r", encoding="utf-8") as f:
+                        self._values = json.load(f)
+        return self._values
+
+    def __getitem__(self, key):
+        return self._load()[key]
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self):
+        return len(self._load())
+
+
+config = _LazyConfig()
+
+
+def data_dir():
+    """Return the directory holding the audio, transcripts and caches."""
+    return config["data_dir"]
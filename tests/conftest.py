@@ -0,0 +1,33 @@
+import os
+import sys
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, "benchmarks"))
+
+
+@pytest.fixture
+def workspace(tmp_path):
+    """Point the pipeline's settings at a data directory inside tmp_path."""
+    import audio_metadata
+    from settings import config
+
+    config._values = {"data_dir": str(tmp_path / "data"), "DRIVE_ID": "test-drive"}
+    os.makedirs(config["data_dir"])
+    yield tmp_path
+    audio_metadata._cache = None
+    config._values = None
+
+
+@pytest.fixture
+def fake_drive():
+    """A FakeDrive served on localhost, with a Drive service object talking to it."""
+    from fake_drive import FakeDrive, drive_service
+
+    drive = FakeDrive()
+    drive.start()
+    drive.service = drive_service(drive.root_url)
+    yield drive
+    drive.stop()
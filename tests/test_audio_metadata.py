@@ -0,0 +1,59 @@
+import json
+import os
+
+import audio_metadata
+
+FORMAT = {
+    "format_tag": 1,
+    "channels": 1,
+    "sample_rate": 16000,
+    "block_align": 2,
+    "bits_per_sample": 16,
+}
+
+
+def _write_wav(path, n_frames):
+    with open(path, "wb") as file:
+        file.write(audio_metadata.wav_header(FORMAT, n_frames * 2) + b"\0" * n_frames * 2)
+
+
+def _cache_on_disk(workspace):
+    path = os.path.join(workspace, "data", audio_metadata.METADATA_CACHE_FILE_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def test_get_metadata_does_not_write_the_cache(workspace):
+    path = os.path.join(workspace, "data", "a.wav")
+    _write_wav(path, 16000)
+
+    assert audio_metadata.get_metadata(path)["duration"] == 1
+    assert _cache_on_disk(workspace) is None
+
+
+def test_scan_directory_saves_the_cache_without_deleted_files(workspace):
+    directory = os.path.join(workspace, "Audio")
+    os.makedirs(directory)
+    for name in ("a.wav", "b.wav"):
+        _write_wav(os.path.join(directory, name), 1600)
+    audio_metadata.scan_directory(directory)
+    assert len(_cache_on_disk(workspace)) == 2
+
+    os.remove(os.path.join(directory, "a.wav"))
+    assert set(audio_metadata.scan_directory(directory)) == {"b.wav"}
+    assert list(_cache_on_disk(workspace)) == [os.path.join(directory, "b.wav")]
+
+
+def test_get_metadata_does_not_cache_files_outside_the_data_directory(workspace):
+    inside = os.path.join(workspace, "data", "a.wav")
+    outside = os.path.join(workspace, "vad_trimmed.wav")
+    _write_wav(inside, 1600)
+    _write_wav(outside, 1600)
+
+    audio_metadata.get_metadata(inside)
+    audio_metadata.get_metadata(outside)
+    audio_metadata.scan_directory(os.path.join(workspace, "data"))
+
+    assert list(_cache_on_disk(workspace)) == [inside]
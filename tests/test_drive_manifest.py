@@ -0,0 +1,16 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import drive_manifest
+
+
+def test_concurrent_store_listing_keeps_every_listing(workspace):
+    queries = [f"name contains '{i}'" for i in range(40)]
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(
+            executor.map(
+                lambda query: drive_manifest.store_listing(query, [{"id": query}]),
+                queries,
+            )
+        )
+
+    assert set(drive_manifest.load_manifest()) == set(queries)
@@ -0,0 +1,164 @@
+import os
+
+import drive_manifest
+import google_drive_functions
+from fake_drive import FOLDER_MIME_TYPE
+
+SESSION_PATH = ("Recording Prep", "Pilot recordings", "Recording Sessions")
+
+
+def _folder(drive, name, parent=None):
+    return drive.add_file(name, b"", FOLDER_MIME_TYPE, [parent] if parent else [])
+
+
+def _paths(date_folder):
+    date_path = SESSION_PATH + (date_folder,)
+    return [
+        SESSION_PATH[:1],
+        SESSION_PATH[:2],
+        SESSION_PATH,
+        date_path,
+        date_path + ("Text",),
+    ]
+
+
+def test_resolve_folder_paths_finds_existing_folders_past_the_first_page(
+    workspace, fake_drive
+):
+    parent = None
+    for name in SESSION_PATH:
+        parent = _folder(fake_drive, name, parent)
+    text_ids = {}
+    for day in range(300):
+        date_folder = f"{day:03d}_01_2024"
+        text_ids[date_folder] = _folder(
+            fake_drive, "Text", _folder(fake_drive, date_folder, parent)
+        )
+
+    for date_folder in ("000_01_2024", "150_01_2024", "299_01_2024"):
+        folder_ids = google_drive_functions.resolve_folder_paths(
+            fake_drive.service, _paths(date_folder)
+        )
+        assert folder_ids[_paths(date_folder)[-1]] == text_ids[date_folder]
+        # Resolve again without the folder cache, as on a fresh machine.
+        os.remove(os.path.join(workspace, "data", "drive_folders.json"))
+
+    assert "create" not in fake_drive.request_counts
+
+
+def test_resolve_folder_paths_creates_only_missing_folders(workspace, fake_drive):
+    parent = None
+    for name in SESSION_PATH:
+        parent = _folder(fake_drive, name, parent)
+    # A folder of the same name under another date must not be taken for the new one.
+    _folder(fake_drive, "Text", _folder(fake_drive, "01_01_2024", parent))
+
+    paths = _paths("02_01_2024")
+    folder_ids = google_drive_functions.resolve_folder_paths(fake_drive.service, paths)
+
+    assert fake_drive.request_counts["create"] == 2
+    text = fake_drive.files[folder_ids[paths[-1]]]
+    assert text["parents"] == [folder_ids[paths[-2]]]
+
+
+def test_download_file_returns_the_under_api_copy_it_matched(workspace, fake_drive):
+    fake_drive.add_file("20240101_recording0.wav", b"RIFF audio", "audio/wav")
+    audio_dir = os.path.join(workspace, "data", "20240101", "Audio")
+    os.makedirs(audio_dir)
+    with open(os.path.join(audio_dir, "under_api_20240101_recording0.wav"), "wb") as file:
+        file.write(b"RIFF audio")
+
+    (item,) = google_drive_functions.list_date_files(
+        fake_drive.service, "20240101", "Audio"
+    )
+    local_path = google_drive_functions.download_file(
+        fake_drive.service, item, "20240101", "Audio"
+    )
+
+    assert local_path == f"{audio_dir}/under_api_20240101_recording0.wav"
+    assert "get_media" not in fake_drive.request_counts
+
+
+def test_list_drive_files_does_not_cache_refreshed_listings(workspace, fake_drive):
+    fake_drive.add_file("20240101_recording0.wav", b"RIFF", "audio/wav")
+
+    google_drive_functions.list_drive_files(
+        fake_drive.service, "mimeType = 'audio/wav'", refresh=True
+    )
+    assert drive_manifest.load_manifest() == {}
+
+    google_drive_functions.list_drive_files(fake_drive.service, "mimeType = 'audio/wav'")
+    assert list(drive_manifest.load_manifest()) == ["mimeType = 'audio/wav'"]
+
+
+def test_delta_upload_creates_changed_files_in_the_new_run_folder(workspace, fake_drive):
+    text_dir = os.path.join(workspace, "data", "20240101", "Text")
+    os.makedirs(text_dir)
+    for name in ("a.json", "b.json"):
+        with open(os.path.join(text_dir, name), "w") as file:
+            file.write("{}")
+
+    google_drive_functions.upload_files(fake_drive.service, "20240101", "Text", delta=True)
+    first_run = {
+        file["name"]: file
+        for file in fake_drive.files.values()
+        if file["name"].endswith(".json")
+    }
+    with open(os.path.join(text_dir, "a.json"), "w") as file:
+        file.write('{"text": "edited"}')
+    google_drive_functions.upload_files(fake_drive.service, "20240101", "Text", delta=True)
+
+    assert first_run["a.json"]["content"] == b"{}"
+    second_run = [
+        file
+        for file in fake_drive.files.values()
+        if file["name"].endswith(".json") and file["id"] != first_run[file["name"]]["id"]
+    ]
+    assert [file["name"] for file in second_run] == ["a.json"]
+    assert second_run[0]["content"] == b'{"text": "edited"}'
+    assert second_run[0]["parents"] != first_run["a.json"]["parents"]
+
+
+def _partial_download(workspace, fake_drive, content, partial_content):
+    """List a Drive file of content and leave partial_content as its partial download."""
+    fake_drive.add_file("20240101_recording0.wav", content, "audio/wav")
+    partial_dir = os.path.join(workspace, "data", "20240101", ".partial")
+    os.makedirs(partial_dir)
+    with open(os.path.join(partial_dir, "20240101_recording0.wav"), "wb") as file:
+        file.write(partial_content)
+    (item,) = google_drive_functions.list_date_files(
+        fake_drive.service, "20240101", "Audio"
+    )
+    return item
+
+
+def test_download_file_resumes_a_partial_download(workspace, fake_drive, monkeypatch):
+    monkeypatch.setattr(google_drive_functions, "DOWNLOAD_CHUNK_SIZE", 4)
+    content = b"RIFF0123456789"
+    item = _partial_download(workspace, fake_drive, content, content[:10])
+
+    local_path = google_drive_functions.download_file(
+        fake_drive.service, item, "20240101", "Audio"
+    )
+
+    with open(local_path, "rb") as file:
+        assert file.read() == content
+    # Only the 4 missing bytes were requested.
+    assert fake_drive.request_counts["get_media"] == 1
+
+
+def test_download_file_downloads_again_after_a_checksum_mismatch(
+    workspace, fake_drive, monkeypatch
+):
+    monkeypatch.setattr(google_drive_functions, "DOWNLOAD_CHUNK_SIZE", 4)
+    content = b"RIFF0123456789"
+    item = _partial_download(workspace, fake_drive, content, b"XXXX012345")
+
+    local_path = google_drive_functions.download_file(
+        fake_drive.service, item, "20240101", "Audio"
+    )
+
+    with open(local_path, "rb") as file:
+        assert file.read() == content
+    # The resumed tail, then the whole file again in 4 byte chunks.
+    assert fake_drive.request_counts["get_media"] == 1 + 4
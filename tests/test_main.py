@@ -0,0 +1,16 @@
+import main
+
+
+def test_validate_date_zero_pads_the_prefix():
+    assert main.validate_date("01/10/2024") == "20241001"
+    assert main.validate_date("11/01/2024") == "20240111"
+    assert main.validate_date("01/11/2024") == "20241101"
+    assert main.validate_date("31/02/2024") is None
+
+
+def test_expand_date_range_returns_one_prefix_per_day():
+    prefixes = main.expand_date_range("28/09/2024:12/10/2024")
+    assert prefixes[:3] == ["20240928", "20240929", "20240930"]
+    assert prefixes[-1] == "20241012"
+    assert len(set(prefixes)) == len(prefixes) == 15
+    assert main.expand_date_range("01/10/2024") is None
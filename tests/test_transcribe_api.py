@@ -0,0 +1,53 @@
+import pytest
+
+import transcribe_api
+from fake_transcription import FakeTranscriptionAPI
+
+
+class CountingLimiter:
+    def __init__(self):
+        self.acquired = []
+
+    def acquire(self, n_bytes):
+        self.acquired.append(n_bytes)
+        return 0.0
+
+
+@pytest.fixture
+def fake_api():
+    api = FakeTranscriptionAPI(failure_rate=1.0, retry_after=0)
+    api.start()
+    yield api
+    api.stop()
+
+
+def test_every_attempt_is_rate_limited(workspace, fake_api, monkeypatch):
+    monkeypatch.setattr(transcribe_api.time, "sleep", lambda seconds: None)
+    limiter = CountingLimiter()
+    files = {"file": ("chunk.wav", b"RIFF" + bytes(96))}
+
+    with pytest.raises(Exception, match="Max retries reached"):
+        transcribe_api.send_request(
+            "retry-test", fake_api.url, {}, files, {"language": "en"}, limiter
+        )
+
+    assert fake_api.requests == 5
+    assert limiter.acquired == [100] * 5
+
+
+def test_session_pool_grows_with_the_workers(monkeypatch):
+    monkeypatch.setattr(transcribe_api, "_sessions", {})
+    monkeypatch.setattr(transcribe_api, "_pool_sizes", {})
+
+    def pool_size(session):
+        adapter = session.get_adapter("https://api.example.com")
+        return adapter.poolmanager.connection_pool_kw["maxsize"]
+
+    session = transcribe_api.get_session("pool-test")
+    assert pool_size(session) == transcribe_api.HTTP_POOL_SIZE
+
+    assert transcribe_api.get_session("pool-test", workers=40) is session
+    assert pool_size(session) == 40
+
+    transcribe_api.get_session("pool-test", workers=2)
+    assert pool_size(session) == 40
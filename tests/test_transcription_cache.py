@@ -0,0 +1,32 @@
+import os
+
+import transcription_cache
+from settings import config
+
+
+def test_cache_is_walked_only_when_it_needs_trimming(workspace, monkeypatch):
+    # Room for three entries of 300 bytes.
+    config._values["transcription_cache_max_mb"] = 1000 / (1024 * 1024)
+    walks = []
+    walk = os.walk
+
+    def counting_walk(directory):
+        walks.append(directory)
+        return walk(directory)
+
+    monkeypatch.setattr(os, "walk", counting_walk)
+
+    keys = [f"{index:02d}" * 32 for index in range(4)]
+    for age, key in enumerate(keys):
+        transcription_cache.cache_transcription(key, "x" * 300)
+        path = transcription_cache._entry_path(key)
+        os.utime(path, (age, age))
+    assert len(walks) == 2
+
+    assert transcription_cache.get_cached_transcription(keys[0]) is None
+    for key in keys[1:]:
+        assert transcription_cache.get_cached_transcription(key) == "x" * 300
+
+    # Replacing an entry with one of the same size does not grow the cache.
+    transcription_cache.cache_transcription(keys[1], "y" * 300)
+    assert len(walks) == 2
@@ -0,0 +1,61 @@
+import json
+import threading
+import urllib.request
+from collections import OrderedDict
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+import transcription_daemon
+import wspr_transcribe
+
+
+@pytest.fixture
+def daemon(workspace, monkeypatch):
+    """A transcription server on localhost whose model loads wait for release."""
+    release = threading.Event()
+    loads = []
+
+    def get_backend(backend, model_size):
+        loads.append((backend, model_size))
+        release.wait(10)
+        return object()
+
+    monkeypatch.setattr(wspr_transcribe, "get_backend", get_backend)
+    monkeypatch.setattr(transcription_daemon, "_models", OrderedDict())
+    monkeypatch.setattr(transcription_daemon, "_load_locks", {})
+    monkeypatch.setattr(transcription_daemon, "_loaded", ())
+    server = ThreadingHTTPServer(("127.0.0.1", 0), transcription_daemon._Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}", release, loads
+    release.set()
+    server.shutdown()
+    server.server_close()
+
+
+def _health(url):
+    with urllib.request.urlopen(f"{url}/health", timeout=2) as response:
+        return json.load(response)
+
+
+def test_health_answers_while_a_model_loads(daemon):
+    url, release, loads = daemon
+    models = []
+    threads = [
+        threading.Thread(
+            target=lambda: models.append(transcription_daemon._get_model("openai", "base"))
+        )
+        for _ in range(2)
+    ]
+    for thread in threads:
+        thread.start()
+
+    assert _health(url) == {"status": "ok", "models": []}
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert loads == [("openai", "base")]
+    assert models[0] is models[1]
+    assert _health(url) == {"status": "ok", "models": ["openai:base"]}
@@ -0,0 +1,50 @@
+import importlib.util
+import os
+
+import pytest
+
+import wspr_transcribe
+from audio_metadata import wav_header
+
+PCM_16K_MONO = {
+    "format_tag": 1,
+    "channels": 1,
+    "sample_rate": 16000,
+    "block_align": 2,
+    "bits_per_sample": 16,
+}
+
+
+def _write_recording(workspace, date, name, seconds=1):
+    audio_dir = os.path.join(workspace, "data", date, "Audio")
+    os.makedirs(audio_dir, exist_ok=True)
+    data = bytes(32000 * seconds)
+    with open(os.path.join(audio_dir, name), "wb") as file:
+        file.write(wav_header(PCM_16K_MONO, len(data)) + data)
+
+
+@pytest.mark.skipif(
+    importlib.util.find_spec("faster_whisper") is not None,
+    reason="needs faster-whisper to be missing",
+)
+def test_workers_fail_fast_when_the_backend_is_missing(workspace):
+    for index in range(2):
+        _write_recording(workspace, "20240101", f"20240101_recording{index}.wav")
+
+    with pytest.raises(ImportError, match="faster-whisper"):
+        wspr_transcribe.transcribe_audio_whisper_local(
+            "20240101", workers=2, backend="ctranslate2", use_daemon=False
+        )
+
+
+def test_worker_reports_a_model_that_failed_to_load(monkeypatch):
+    def get_backend(name, model_size, threads):
+        raise RuntimeError("checksum does not match")
+
+    monkeypatch.setattr(wspr_transcribe, "get_backend", get_backend)
+    monkeypatch.setattr(wspr_transcribe, "_worker_error", None)
+
+    wspr_transcribe._init_worker("pytorch", "base", 1)
+    _, _, error = wspr_transcribe._transcribe_in_worker("a.wav", "20240101")
+
+    assert error == "Could not load the pytorch base model: checksum does not match"
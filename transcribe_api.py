@@ -9,7 +9,12 @@ It cannot also utilise "initial_prompt" parameter.
 
 Functions:
 - get_files_to_transcribe(date_prefix): Get a list of audio files to transcribe.
-- transcribe_audio(date_prefix, auth_token): Transcribe audio files using the LemonFox API.
+- is_api_input(file_name, api): Check whether a file is one the API transcribes.
+- transcribe_file(date_prefix, file_path, api_type, auth_token, workers=1): Transcribe one audio file.
+- get_session(api_type, workers=1): Return the pooled keep-alive HTTP session for a provider.
+- get_retry_stats(): Return the retry counters recorded per provider.
+- new_transcribe(date_prefix, api_type, auth_token, workers=1): Transcribe audio files using the
+  LemonFox or Whisper API, optionally with several concurrent requests.
 
 Usage:
 1. Set the configuration in the 'config.json' file.
@@ -21,90 +26,195 @@ Note: The 'config.json' file should contain the 'data_dir' key specifying the di
 audio and text files are stored.
 """
 
+import email.utils
 import json
 import os
 import random
+import threading
 import time
-
-import requests
-
-with open("config.json", "r", encoding="utf-8") as f:
-    config = json.load(f)
-
-DATA_DIR = config["data_dir"]
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from audio_metadata import get_metadata, usable_wav_files
+from encode import is_encoded
+from rate_limit import CircuitOpenError, get_circuit_breaker, get_limiter
+from settings import config, data_dir
+from job_store import import_directory, pending_transcription, record_stage
+from metrics import record_metrics
+from transcription_cache import (
+    cache_transcription,
+    get_cached_transcription,
+    transcription_key,
+)
+from vad import empty_result, restore_timestamps, speech_only, vad_settings
+
+# Both APIs write the same transcribed_api_ files, so they share one job store backend.
+JOB_BACKEND = "api"
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+# The smallest connection pool of a session, see get_session.
+HTTP_POOL_SIZE = 16
+
+RETRY_STATS = {}
+_retry_stats_lock = threading.Lock()
+_sessions = {}
+_pool_sizes = {}
+_sessions_lock = threading.Lock()
 
 
 def get_files_to_transcribe(date_prefix, api):
     """
     Get a list of files to transcribe.
-    """
-    audio_dir = os.path.join(DATA_DIR, date_prefix, "Audio")
-    text_dir = os.path.join(DATA_DIR, date_prefix, "Text")
-
-    files_to_transcribe = [
-        os.path.join(audio_dir, file)
-        for file in os.listdir(audio_dir)
-        if file.endswith(".wav") and "chunk" in file
-    ]
-
-    transcribed_files = {
-        os.path.splitext(file)[0]
-        for file in os.listdir(text_dir)
-        if file.endswith(".json") and file.startswith("transcribed_api")
-    }
-
-    transcribed_files = [s.replace("transcribed_api_", "") for s in transcribed_files]
-
-    files_to_transcribe = [
-        s for s in files_to_transcribe if all(sub not in s for sub in transcribed_files)
-    ]
-
-    if api == "lemonfox":
-        prechunked_files = [
-            os.path.join(audio_dir, file)
-            for file in os.listdir(audio_dir)
-            if file.endswith(".wav") and file.startswith("under_api_")
-        ]
 
-        files_to_transcribe.extend(prechunked_files)
+    The files still to do are selected from the job store: chunks, and for lemonfox the
+    recordings that were small enough to send whole, that have not been transcribed by
+    the API yet. Files the job store does not know about are imported first. Chunks
+    encoded as FLAC or Opus (see encode) are sent as long as they are not empty.
+    """
+    audio_dir = os.path.join(data_dir(), date_prefix, "Audio")
+    text_dir = os.path.join(data_dir(), date_prefix, "Text")
+
+    import_directory(date_prefix, audio_dir, text_dir)
+    usable_files = set(usable_wav_files(audio_dir))
+
+    files_to_transcribe = []
+    for file_name in pending_transcription(date_prefix, JOB_BACKEND):
+        file_path = os.path.join(audio_dir, file_name)
+        if file_path not in usable_files and not (
+            is_encoded(file_name)
+            and os.path.isfile(file_path)
+            and os.path.getsize(file_path) > 0
+        ):
+            continue
+        if is_api_input(file_name, api):
+            files_to_transcribe.append(file_path)
 
     return files_to_transcribe
 
 
+def is_api_input(file_name, api):
+    """Check whether a file is one the API transcribes: a chunk, or for lemonfox a whole small recording."""
+    return "chunk" in file_name or (
+        api == "lemonfox" and file_name.startswith("under_api_")
+    )
+
+
+def get_session(api_type, workers=1):
+    """
+    Return the keep-alive HTTP session for a provider.
+
+    Sessions are shared between worker threads so connections to the provider are reused
+    instead of a new TLS connection being opened for every chunk. The connection pool of
+    a session keeps at least HTTP_POOL_SIZE connections and grows to the largest number
+    of workers it has been asked for, so every worker keeps its connection alive.
+    """
+    import requests
+    import requests.adapters
+
+    with _sessions_lock:
+        if api_type not in _sessions:
+            _sessions[api_type] = requests.Session()
+        pool_size = max(HTTP_POOL_SIZE, workers)
+        if _pool_sizes.get(api_type, 0) < pool_size:
+            # Requests already sent through the old adapter finish on its connections.
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=1, pool_maxsize=pool_size
+            )
+            _sessions[api_type].mount("https://", adapter)
+            _sessions[api_type].mount("http://", adapter)
+            _pool_sizes[api_type] = pool_size
+        return _sessions[api_type]
+
+
+def get_retry_stats():
+    """Return the retry counters recorded so far, per provider."""
+    with _retry_stats_lock:
+        return {api_type: dict(stats) for api_type, stats in RETRY_STATS.items()}
+
+
+def _count(api_type, key):
+    with _retry_stats_lock:
+        RETRY_STATS.setdefault(api_type, Counter())[key] += 1
+
+
+def _retry_after(response):
+    """Return the delay requested by a Retry-After header in seconds, or None."""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
 def exponential_backoff_decorator(max_retries, base_delay):
     """
     Decorator that adds retry functionality to a function.
 
+    The decorated function takes the provider name as its first argument and returns a
+    response. Exceptions and responses with a status in RETRY_STATUS_CODES are retried
+    with exponential backoff and jitter, or after the delay given by a Retry-After header.
+    Other responses are returned as they are. Every attempt goes through the provider's
+    circuit breaker, and retries are counted in RETRY_STATS.
+
     Args:
-        func (callable): The function to be decorated.
+        max_retries (int): Maximum number of attempts.
+        base_delay (float): Base delay in seconds for the exponential backoff.
 
     Returns:
-        callable: The decorated function.
+        callable: The decorator.
 
     Raises:
         Exception: If the maximum number of retries is reached and the operation still fails.
+        CircuitOpenError: If the provider's circuit breaker is open.
 
     Examples:
-        >>> @decorator
-        ... def my_function():
+        >>> @exponential_backoff_decorator(max_retries=5, base_delay=1)
+        ... def my_function(api_type):
         ...     # Function implementation
         ...
-        >>> my_function()
+        >>> my_function("lemonfox")
     """
 
     def decorator(func):
-        def wrapper(*args, **kwargs):
+        def wrapper(api_type, *args, **kwargs):
+            breaker = get_circuit_breaker(api_type)
             retries = 0
             while retries < max_retries:
                 try:
-                    result_func = func(*args, **kwargs)
-                    return result_func
+                    breaker.before_request()
+                except CircuitOpenError:
+                    _count(api_type, "circuit_open")
+                    raise
+                retry_after = None
+                try:
+                    response = func(api_type, *args, **kwargs)
                 except Exception as e:
                     print(f"Attempt {retries + 1} failed: {e}")
-                    retries += 1
-                    delay = base_delay * 2**retries + random.uniform(0, 1)
-                    print(f"Retrying in {delay:.2f} seconds...")
-                    time.sleep(delay)
+                    _count(api_type, "exceptions")
+                else:
+                    if response.status_code not in RETRY_STATUS_CODES:
+                        breaker.record_success()
+                        return response
+                    print(f"Attempt {retries + 1} failed: HTTP {response.status_code}")
+                    _count(api_type, f"status_{response.status_code}")
+                    retry_after = _retry_after(response)
+                breaker.record_failure()
+                retries += 1
+                if retries == max_retries:
+                    break
+                _count(api_type, "retries")
+                if retry_after is None:
+                    delay = base_delay * 2**retries + random.uniform(0, base_delay)
+                else:
+                    delay = retry_after + random.uniform(0, base_delay)
+                print(f"Retrying in {delay:.2f} seconds...")
+                time.sleep(delay)
             raise Exception("Max retries reached, operation failed.")
 
         return wrapper
@@ -113,66 +223,223 @@ def exponential_backoff_decorator(max_retries, base_delay):
 
 
 @exponential_backoff_decorator(max_retries=5, base_delay=1)
-def send_request(url, headers, files, data):
+def send_request(api_type, url, headers, files, data, limiter):
+    """
+    Send a request to the Transcription API over the provider's pooled session.
+
+    files must hold the audio as bytes rather than open files, so a retried request
+    sends the same content without reading the file from disk again. Every attempt takes
+    a request and the bytes of the audio from limiter first, so retries stay within the
+    provider's limits just as first attempts do."""
+    n_bytes = sum(len(content) for _, content in files.values())
+    wait_start = time.perf_counter()
+    limiter.acquire(n_bytes)
+    record_metrics(
+        "transcribe",
+        requests=1,
+        bytes=n_bytes,
+        rate_limit_wait_seconds=time.perf_counter() - wait_start,
+    )
+    return get_session(api_type).post(
+        url, headers=headers, files=files, data=data, timeout=600
+    )
+
+
+def _transcribe_file(file_path, api_type, url, headers, data, text_dir, limiter):
     """
-    Send a request to the Transcription API."""
-    return requests.post(url, headers=headers, files=files, data=data, timeout=600)
+    Send one audio file to the transcription API and write the result to text_dir.
 
+    The transcription cache is consulted first, so audio that has already been
+    transcribed with the same settings is not sent again. With "vad_enabled" set only the
+    speech in the file is sent and the timestamps of the transcript are moved back onto
+    the file, see vad.
 
-def new_transcribe(date_prefix, api_type, auth_token):
+    Returns:
+        str: None if the transcription succeeded, otherwise the reason it failed.
     """
-    Transcribes audio files using different APIs based on the specified API type.
+    file_name = file_path.split("/")[-1].split(".")[0]
+    output_path = os.path.join(text_dir, f"transcribed_api_{file_name}.json")
+    cache_key = transcription_key(
+        file_path,
+        api_type,
+        data.get("model", "large-v3"),
+        data["initial_prompt"],
+        data["language"],
+        vad_settings(),
+    )
+    cached = get_cached_transcription(cache_key)
+    if cached is not None:
+        print(f"Using cached transcription for {file_path}")
+        with open(output_path, "w", encoding="utf-8") as file_obj:
+            file_obj.write(cached)
+        record_metrics("transcribe", cached=1)
+        return None
+
+    with speech_only(file_path) as (audio_path, offsets):
+        if offsets == []:
+            print(f"No speech found in {file_path}")
+            text = json.dumps(empty_result(offsets, get_metadata(file_path)["duration"]))
+        else:
+            with open(audio_path, "rb") as audio_file:
+                audio = audio_file.read()
+            files = {"file": (os.path.basename(file_path), audio)}
+            try:
+                response = send_request(api_type, url, headers, files, data, limiter)
+            except Exception as e:
+                print("Operation failed:", e)
+                return str(e)
 
-    Args:
-        date_prefix (str): The date prefix used to identify the files to transcribe.
-        api_type (str): The type of API to use for transcription.
-        auth_token (str): The authentication token for API authorization.
+            if response.status_code != 200:
+                print(f"Transcription failed for {file_path}")
+                print(response.text)
+                return f"HTTP {response.status_code}: {response.text}"
+            text = response.text
+            if offsets:
+                text = json.dumps(
+                    restore_timestamps(
+                        json.loads(text), offsets, get_metadata(file_path)["duration"]
+                    )
+                )
+
+    print(f"Transcription completed for {file_path}")
+    with open(output_path, "w", encoding="utf-8") as file_obj:
+        file_obj.write(text)
+    cache_transcription(cache_key, text)
+    return None
+
+
+def _transcribe_and_record(date_prefix, file_path, *args):
+    """Run _transcribe_file and record its progress in the job store."""
+    file_name = os.path.basename(file_path)
+    record_stage(date_prefix, file_name, "transcribed", "running", backend=JOB_BACKEND)
+    try:
+        error = _transcribe_file(file_path, *args)
+    except Exception as e:
+        error = str(e)
+        raise
+    finally:
+        if error:
+            record_metrics("transcribe", failed=1)
+        else:
+            record_metrics(
+                "transcribe",
+                files=1,
+                audio_seconds=get_metadata(file_path).get("duration", 0),
+            )
+        record_stage(
+            date_prefix,
+            file_name,
+            "transcribed",
+            "failed" if error else "done",
+            backend=JOB_BACKEND,
+            error=error,
+        )
+    return error is None
+
+
+def _request_settings(api_type):
+    """
+    Return the URL and form fields of transcription requests to a provider.
 
     Raises:
         ValueError: If the specified API type is not supported.
-
-    Examples:
-        >>> new_transcribe("2022-01-01", "lemonfox", "my_auth_token")
     """
-
-    files_to_transcribe = get_files_to_transcribe(date_prefix, api_type)
-
     if api_type == "lemonfox":
-        url = config["lemonfoxAPIURL"]
-        data = {
+        return config["lemonfoxAPIURL"], {
             "language": "en",
             "initial_prompt": config["audio_prompt"],
             "response_format": "verbose_json",
         }
-    elif api_type == "whisper":
-        url = config["whisperAPIURL"]
-        data = {
+    if api_type == "whisper":
+        return config["whisperAPIURL"], {
             "language": "en",
             "initial_prompt": config["audio_prompt"],
             "response_format": "verbose_json",
             "model": "whisper-1",
         }
-    else:
-        raise ValueError("Unsupported API type")
+    raise ValueError("Unsupported API type")
+
+
+def transcribe_file(date_prefix, file_path, api_type, auth_token, workers=1):
+    """
+    Transcribe one audio file with the API and record it in the job store.
+
+    Requests share the provider's session, rate limits and circuit breaker with every
+    other caller, so this can be called from any number of threads. workers is the
+    number of threads calling it, which the session's connection pool is sized for.
+
+    Returns:
+        str: The path of the transcript, or None if the transcription failed.
+    """
+    url, data = _request_settings(api_type)
+    get_session(api_type, workers)
+    text_dir = os.path.join(data_dir(), date_prefix, "Text")
+    transcribed = _transcribe_and_record(
+        date_prefix,
+        file_path,
+        api_type,
+        url,
+        {"Authorization": f"Bearer {auth_token}"},
+        data,
+        text_dir,
+        get_limiter(api_type),
+    )
+    if not transcribed:
+        return None
+    file_name = file_path.split("/")[-1].split(".")[0]
+    return os.path.join(text_dir, f"transcribed_api_{file_name}.json")
+
+
+def new_transcribe(date_prefix, api_type, auth_token, workers=1):
+    """
+    Transcribes audio files using different APIs based on the specified API type.
+
+    Up to workers files are sent at once. Requests are paced by the provider's token
+    buckets (see rate_limit.get_limiter) so concurrent workers stay within the
+    requests per minute and bytes per minute limits, and each transcript is written
+    as soon as its request completes.
+
+    Args:
+        date_prefix (str): The date prefix used to identify the files to transcribe.
+        api_type (str): The type of API to use for transcription.
+        auth_token (str): The authentication token for API authorization.
+        workers (int): Number of files to transcribe concurrently.
+
+    Raises:
+        ValueError: If the specified API type is not supported.
+
+    Examples:
+        >>> new_transcribe("2022-01-01", "lemonfox", "my_auth_token")
+    """
+
+    url, data = _request_settings(api_type)
+    files_to_transcribe = get_files_to_transcribe(date_prefix, api_type)
 
     headers = {"Authorization": f"Bearer {auth_token}"}
+    text_dir = os.path.join(data_dir(), date_prefix, "Text")
+    limiter = get_limiter(api_type)
+    get_session(api_type, workers)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = [
+            executor.submit(
+                _transcribe_and_record,
+                date_prefix,
+                file_path,
+                api_type,
+                url,
+                headers,
+                data,
+                text_dir,
+                limiter,
+            )
+            for file_path in files_to_transcribe
+        ]
+        completed = sum(future.result() for future in as_completed(futures))
 
-    for file_path in files_to_transcribe:
-        with open(file_path, "rb") as audio_file:
-            files = {"file": audio_file}
-            try:
-                response = send_request(url, headers, files, data)
-            except Exception as e:
-                print("Operation failed:", e)
-            if response.status_code == 200:
-                print(f"Transcription completed for {file_path}")
-                file_name = file_path.split("/")[-1].split(".")[0]
-                with open(
-                    f"./data/recordings/{date_prefix}/Text/transcribed_api_{file_name}.json",
-                    "w",
-                    encoding="utf-8",
-                ) as file_obj:
-                    file_obj.write(response.text)
-            else:
-                print(f"Transcription failed for {file_path}")
-                print(response.text)
+    print(
+        f"Transcribed {completed}/{len(files_to_transcribe)} files "
+        f"in {time.perf_counter() - start:.1f}s."
+    )
+    print(f"Retry counts: {get_retry_stats().get(api_type, {})}")
@@ -0,0 +1,195 @@
+"""
+This module provides a content-addressed cache of transcriptions on local disk.
+
+Entries are keyed by a hash of the PCM audio together with the backend, model, prompt and
+language used, so the same audio is never transcribed twice with the same settings, even
+after it has been renamed, re-chunked into an identical file or moved to another date.
+
+The cache is bounded by size. Reading an entry refreshes its modification time, and the
+least recently used entries are evicted once the cache grows past its limit. The size of
+the cache is kept as a running total, so it is only walked when it needs trimming.
+
+Functions:
+- audio_hash(file_path): Return the hash of the PCM audio in a WAV file.
+- transcription_key(file_path, backend, model, prompt, language, preprocessing=None): Return the cache key for a transcription.
+- get_cached_transcription(key): Return a cached transcription, or None.
+- cache_transcription(key, text): Store a transcription in the cache.
+- evict_least_recently_used(directory, extension, max_bytes, added_bytes=0): Trim a cache directory to a size.
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+from audio_metadata import get_metadata
+from settings import config, data_dir
+
+HASH_BLOCK_BYTES = 4 * 1024 * 1024
+# A full cache is trimmed to this share of its limit, so it is not walked on every write.
+EVICT_TO = 0.9
+
+_hashes = {}
+_lock = threading.Lock()
+_sizes = {}
+_sizes_lock = threading.Lock()
+
+
+def audio_hash(file_path):
+    """
+    Return the sha256 of the PCM audio in a WAV file.
+
+    Only the audio format and the data chunk are hashed, so the hash does not change with
+    the file name or with extra header chunks. Files that cannot be parsed are hashed whole.
+    Hashes are remembered for the life of the process, keyed by path, size and mtime.
+    """
+    metadata = get_metadata(file_path)
+    memo_key = (os.path.abspath(file_path), metadata["size"], metadata["mtime"])
+    with _lock:
+        if memo_key in _hashes:
+            return _hashes[memo_key]
+
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        if "data_offset" in metadata:
+            digest.update(
+                json.dumps(
+                    [
+                        metadata["format_tag"],
+                        metadata["channels"],
+                        metadata["sample_rate"],
+                        metadata["bits_per_sample"],
+                    ]
+                ).encode()
+            )
+            file.seek(metadata["data_offset"])
+            remaining = metadata["data_bytes"]
+        else:
+            remaining = metadata["size"]
+        while remaining > 0:
+            block = file.read(min(HASH_BLOCK_BYTES, remaining))
+            if not block:
+                break
+            digest.update(block)
+            remaining -= len(block)
+
+    with _lock:
+        _hashes[memo_key] = digest.hexdigest()
+    return _hashes[memo_key]
+
+
+def transcription_key(file_path, backend, model, prompt, language, preprocessing=None):
+    """
+    Return the cache key for transcribing file_path with the given settings.
+
+    Args:
+        file_path (str): Path to the WAV file.
+        backend (str): The transcription backend, e.g. "lemonfox", "whisper" or "local".
+        model (str): The model name.
+        prompt (str): The initial prompt.
+        language (str): The transcription language.
+        preprocessing (dict): Settings of any processing of the audio before it is
+            transcribed, such as silence trimming (see vad.vad_settings).
+    """
+    key = [audio_hash(file_path), backend, model, prompt, language]
+    if preprocessing:
+        # Only added when set, so entries cached without preprocessing keep their keys.
+        key.append(preprocessing)
+    settings = json.dumps(key, sort_keys=True)
+    return hashlib.sha256(settings.encode()).hexdigest()
+
+
+def _cache_dir():
+    return config.get(
+        "transcription_cache_dir", os.path.join(data_dir(), "transcription_cache")
+    )
+
+
+def _entry_path(key):
+    return os.path.join(_cache_dir(), key[:2], f"{key}.json")
+
+
+def get_cached_transcription(key):
+    """Return the cached transcription for key, or None if it is not cached."""
+    path = _entry_path(key)
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            text = file.read()
+        os.utime(path)
+    except OSError:
+        return None
+    return text
+
+
+def cache_transcription(key, text):
+    """Store a transcription under key and evict old entries if the cache is too large."""
+    path = _entry_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp.{threading.get_ident()}"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        file.write(text)
+    try:
+        replaced_bytes = os.path.getsize(path)
+    except OSError:
+        replaced_bytes = 0
+    added_bytes = os.path.getsize(tmp_path) - replaced_bytes
+    os.replace(tmp_path, path)
+    _evict(added_bytes)
+
+
+def _evict(added_bytes):
+    """Remove the least recently used entries until the cache fits "transcription_cache_max_mb"."""
+    evict_least_recently_used(
+        _cache_dir(),
+        ".json",
+        config.get("transcription_cache_max_mb", 1024) * 1024 * 1024,
+        added_bytes,
+    )
+
+
+def _cache_files(directory, extension):
+    """Return the mtime, size and path of every file ending in extension under directory."""
+    entries = []
+    for root, _, file_names in os.walk(directory):
+        for file_name in file_names:
+            if not file_name.endswith(extension):
+                continue
+            path = os.path.join(root, file_name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+    return entries
+
+
+def evict_least_recently_used(directory, extension, max_bytes, added_bytes=0):
+    """
+    Count added_bytes just written to the files ending in extension under directory, and
+    remove the least recently modified of those files if they no longer fit in max_bytes.
+
+    The total size is counted by walking directory on first use and kept running after
+    that, so directory is only walked again once the total is over max_bytes. The files
+    are then trimmed to EVICT_TO of max_bytes. Writes by other processes are picked up by
+    the next walk. Files that cannot be removed, e.g. because they are open, are skipped.
+    """
+    key = (os.path.abspath(directory), extension)
+    with _sizes_lock:
+        if key in _sizes:
+            _sizes[key] += added_bytes
+        else:
+            _sizes[key] = sum(size for _, size, _ in _cache_files(directory, extension))
+        if _sizes[key] <= max_bytes:
+            return
+
+        entries = _cache_files(directory, extension)
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= max_bytes * EVICT_TO:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+        _sizes[key] = total
@@ -0,0 +1,182 @@
+"""
+This module provides a long-running local transcription server that keeps Whisper models
+loaded between runs, and the client used to submit files to it.
+
+Starting a run of `main.py --whisper` otherwise pays for importing torch and whisper and
+for loading the model every time, which for the larger models takes longer than
+transcribing a short session. The server listens on localhost, keeps the most recently
+used models in memory and transcribes files by path, writing the transcripts exactly as
+in-process transcription would.
+
+Usage:
+    python transcription_daemon.py [--port <port>]
+
+The server must be started from the same directory as main.py so it reads the same
+config.json and writes the transcripts into the same data directory.
+
+Functions:
+- run_server(host, port): Run the transcription server until interrupted.
+- daemon_url(): Return the URL of the transcription server.
+- daemon_available(): Check whether a transcription server is running.
+- submit_to_daemon(file_path, date, backend, model_size): Transcribe a file with the server.
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+import wspr_transcribe
+from settings import config
+
+_models = OrderedDict()
+_models_lock = threading.Lock()
+# One lock per model being loaded, so only requests for that model wait for it.
+_load_locks = {}
+# The keys of _models, replaced whole under _models_lock so /health reads it without it.
+_loaded = ()
+_inference_lock = threading.Lock()
+
+
+def _cached_model(key):
+    """Return the model of key if it is loaded, marking it most recently used. Hold _models_lock."""
+    if key in _models:
+        _models.move_to_end(key)
+        return _models[key]
+    return None
+
+
+def _get_model(backend, model_size):
+    """
+    Return a loaded model, loading it and evicting the least recently used if needed.
+
+    Models are loaded without holding _models_lock, so a slow load never blocks /health or
+    requests for models that are already loaded.
+    """
+    global _loaded
+    key = (backend, model_size)
+    with _models_lock:
+        model = _cached_model(key)
+        if model is not None:
+            return model
+        load_lock = _load_locks.setdefault(key, threading.Lock())
+
+    with load_lock:
+        with _models_lock:
+            model = _cached_model(key)
+        if model is not None:
+            return model
+        print(f"Loading {backend} {model_size} model...")
+        model = wspr_transcribe.get_backend(backend, model_size)
+        with _models_lock:
+            _models[key] = model
+            while len(_models) > config.get("transcription_daemon_max_models", 2):
+                evicted, _ = _models.popitem(last=False)
+                print(f"Unloading {evicted[0]} {evicted[1]} model.")
+            _loaded = tuple(_models)
+            del _load_locks[key]
+    return model
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Serves GET /health and POST /transcribe."""
+
+    def _reply(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path != "/health":
+            self._reply(404, {"error": "not found"})
+            return
+        loaded = [f"{backend}:{model_size}" for backend, model_size in _loaded]
+        self._reply(200, {"status": "ok", "models": loaded})
+
+    def do_POST(self):
+        if self.path != "/transcribe":
+            self._reply(404, {"error": "not found"})
+            return
+        try:
+            job = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            start = time.perf_counter()
+            backend = _get_model(job["backend"], job["model_size"])
+            # One inference at a time, each one already uses every core.
+            with _inference_lock:
+                wspr_transcribe.translate_audio(
+                    job["file_path"], date=job["date"], backend=backend
+                )
+        except Exception as e:
+            self._reply(500, {"error": str(e)})
+            return
+        self._reply(200, {"elapsed": time.perf_counter() - start})
+
+
+def run_server(host, port):
+    """Run the transcription server until interrupted."""
+    server = ThreadingHTTPServer((host, port), _Handler)
+    print(f"Transcription server listening on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def daemon_url():
+    """Return the URL of the transcription server, "transcription_daemon_url" in config.json."""
+    return config.get("transcription_daemon_url", "http://127.0.0.1:8765")
+
+
+def daemon_available():
+    """Check whether a transcription server is answering at the configured URL."""
+    try:
+        with urllib.request.urlopen(f"{daemon_url()}/health", timeout=1) as response:
+            return response.status == 200
+    except (OSError, urllib.error.URLError):
+        return False
+
+
+def submit_to_daemon(file_path, date, backend, model_size):
+    """
+    Transcribe a file with the transcription server and wait for it to finish.
+
+    Raises:
+        RuntimeError: If the server could not transcribe the file.
+    """
+    request = urllib.request.Request(
+        f"{daemon_url()}/transcribe",
+        data=json.dumps(
+            {
+                "file_path": os.path.abspath(file_path),
+                "date": date,
+                "backend": backend,
+                "model_size": model_size,
+            }
+        ).encode(),
+        headers={"Content-Type": "application/json"},
+    )
+    try:
+        with urllib.request.urlopen(request) as response:
+            return json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        raise RuntimeError(json.loads(e.read()).get("error", str(e))) from e
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the local transcription server.")
+    parser.add_argument(
+        "--port", type=int, default=urlparse(daemon_url()).port or 8765
+    )
+    args = parser.parse_args()
+    run_server("127.0.0.1", args.port)
@@ -0,0 +1,242 @@
+"""
+This module finds the speech in a recording so the silence between customers is not sent
+to the API or decoded by the local model.
+
+The audio is read in blocks (see pcm), downmixed and cut into 30ms frames whose energy is
+compared with a threshold: "vad_threshold_db" in config.json, or by default a margin above
+the noise floor of the recording. Pauses shorter than "vad_min_silence_seconds" are kept,
+and every stretch of speech keeps "vad_padding_seconds" of audio on each side, so words
+are not clipped. The speech is copied into a new WAV file in the original format, and an
+offset map records where each stretch of it came from, so the timestamps of its
+transcript can be moved back onto the recording.
+
+Trimming is turned on with "vad_enabled" in config.json. Files where almost everything
+is speech, and chunks already encoded as FLAC or Opus, are transcribed as they are.
+
+Functions:
+- vad_settings(): Return the VAD settings in use, or None if trimming is off.
+- speech_regions(file_path, metadata=None, settings=None): Return the frame ranges of the speech in a WAV file.
+- trim_silence(file_path, output, metadata=None): Write the speech of a WAV file to output.
+- speech_only(file_path): Context manager giving a temporary WAV of the speech in a file.
+- restore_timestamps(result, offsets, duration): Move the timestamps of a transcript back onto the recording.
+- empty_result(offsets, duration): The transcript of a recording without speech.
+"""
+
+import bisect
+import contextlib
+import os
+import tempfile
+
+from audio_metadata import get_metadata, wav_header
+from metrics import record_metrics
+from pcm import read_frames
+from settings import config
+
+FRAME_SECONDS = 0.03
+NOISE_PERCENTILE = 10
+NOISE_MARGIN_DB = 10
+MAX_THRESHOLD_DB = -35
+# Trimming is skipped when the speech is more than this share of the recording.
+MAX_SPEECH_RATIO = 0.9
+COPY_BLOCK_BYTES = 4 * 1024 * 1024
+
+
+def vad_settings():
+    """Return the VAD settings from config.json, or None if trimming is off."""
+    if not config.get("vad_enabled", False):
+        return None
+    return {
+        "threshold_db": config.get("vad_threshold_db"),
+        "min_silence_seconds": config.get("vad_min_silence_seconds", 1.0),
+        "padding_seconds": config.get("vad_padding_seconds", 0.3),
+    }
+
+
+def _frame_energies(file_path, metadata, frame_length):
+    """Return the energy in dBFS of each frame_length frame of the downmixed audio."""
+    import numpy as np
+
+    block_frames = frame_length * max(1, (1024 * 1024) // frame_length)
+    energies = []
+    for block in read_frames(file_path, metadata, block_frames=block_frames):
+        mono = block.mean(axis=1)
+        n = len(mono) // frame_length
+        frames = mono[: n * frame_length].reshape(n, frame_length)
+        energies.append((frames**2).mean(axis=1))
+        if len(mono) > n * frame_length:
+            energies.append(np.array([(mono[n * frame_length :] ** 2).mean()]))
+    if not energies:
+        return np.zeros(0, dtype=np.float32)
+    return 10 * np.log10(np.concatenate(energies) + 1e-10)
+
+
+def speech_regions(file_path, metadata=None, settings=None):
+    """
+    Return the speech in a WAV file as (start_frame, end_frame) ranges of audio frames.
+
+    Args:
+        file_path (str): Path to the WAV file.
+        metadata (dict): The header metadata of the file, read if not given.
+        settings (dict): The VAD settings, see vad_settings.
+
+    Returns:
+        list: Sorted, non-overlapping frame ranges, empty if there is no speech.
+    """
+    import numpy as np
+
+    metadata = metadata or get_metadata(file_path)
+    settings = settings or vad_settings() or {}
+    sample_rate = metadata["sample_rate"]
+    frame_length = max(1, round(sample_rate * FRAME_SECONDS))
+
+    energies = _frame_energies(file_path, metadata, frame_length)
+    if not len(energies):
+        return []
+    threshold = settings.get("threshold_db")
+    if threshold is None:
+        threshold = min(
+            np.percentile(energies, NOISE_PERCENTILE) + NOISE_MARGIN_DB,
+            MAX_THRESHOLD_DB,
+        )
+
+    speech = np.concatenate(([0], (energies > threshold).astype(np.int8), [0]))
+    edges = np.diff(speech)
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+
+    min_silence = settings.get("min_silence_seconds", 1.0) / FRAME_SECONDS
+    padding = settings.get("padding_seconds", 0.3) / FRAME_SECONDS
+    regions = []
+    for start, end in zip(starts, ends):
+        start = max(0, int(start - padding))
+        end = min(len(energies), int(end + padding))
+        if regions and start - regions[-1][1] < min_silence:
+            regions[-1][1] = end
+        else:
+            regions.append([start, end])
+
+    return [
+        (start * frame_length, min(end * frame_length, metadata["n_frames"]))
+        for start, end in regions
+    ]
+
+
+def trim_silence(file_path, output, metadata=None):
+    """
+    Write the speech of a WAV file to output as a WAV file in the same format.
+
+    Args:
+        file_path (str): Path to the WAV file.
+        output: A binary file object to write to.
+        metadata (dict): The header metadata of the file, read if not given.
+
+    Returns:
+        list: The offset map, one [trimmed_start, original_start, duration] entry in
+        seconds per stretch of speech, empty if there is no speech. None if trimming
+        would save little, in which case nothing is written.
+    """
+    metadata = metadata or get_metadata(file_path)
+    regions = speech_regions(file_path, metadata)
+    speech_frames = sum(end - start for start, end in regions)
+    if speech_frames > MAX_SPEECH_RATIO * metadata["n_frames"]:
+        return None
+
+    frame_size = metadata["block_align"]
+    sample_rate = metadata["sample_rate"]
+    output.write(wav_header(metadata, speech_frames * frame_size))
+    offsets = []
+    trimmed_frame = 0
+    with open(file_path, "rb") as source:
+        for start, end in regions:
+            offsets.append(
+                [trimmed_frame / sample_rate, start / sample_rate, (end - start) / sample_rate]
+            )
+            trimmed_frame += end - start
+            source.seek(metadata["data_offset"] + start * frame_size)
+            remaining = (end - start) * frame_size
+            while remaining > 0:
+                block = source.read(min(COPY_BLOCK_BYTES, remaining))
+                if not block:
+                    break
+                output.write(block)
+                remaining -= len(block)
+
+    record_metrics(
+        "vad",
+        files=1,
+        audio_seconds=metadata["duration"],
+        speech_seconds=speech_frames / sample_rate,
+        bytes_saved=(metadata["n_frames"] - speech_frames) * frame_size,
+    )
+    return offsets
+
+
+@contextlib.contextmanager
+def speech_only(file_path):
+    """
+    Give a temporary WAV file holding only the speech in file_path.
+
+    Yields:
+        tuple: The path to transcribe and the offset map of its audio (see trim_silence).
+        When trimming is off, would save little or the file is not a WAV file this is
+        file_path and None. An empty offset map means the recording has no speech and
+        there is nothing to transcribe.
+    """
+    if vad_settings() is None or "data_offset" not in get_metadata(file_path):
+        yield file_path, None
+        return
+
+    descriptor, trimmed_path = tempfile.mkstemp(suffix=".wav", prefix="vad_")
+    try:
+        with os.fdopen(descriptor, "wb") as output:
+            offsets = trim_silence(file_path, output)
+        yield (file_path if offsets is None else trimmed_path), offsets
+    finally:
+        os.remove(trimmed_path)
+
+
+def _to_original(time, offsets, end=False):
+    """Map a time in the trimmed audio to the recording."""
+    starts = [offset[0] for offset in offsets]
+    # An end time on a boundary belongs to the stretch before it.
+    index = (bisect.bisect_left if end else bisect.bisect_right)(starts, time) - 1
+    trimmed_start, original_start, duration = offsets[max(index, 0)]
+    return round(original_start + min(max(time - trimmed_start, 0), duration), 3)
+
+
+def restore_timestamps(result, offsets, duration):
+    """
+    Move the segment and word timestamps of a transcript of trimmed audio back onto the
+    recording it was cut from, and note the offset map in the transcript.
+
+    Args:
+        result (dict): A verbose_json transcript, changed in place.
+        offsets (list): The offset map from trim_silence.
+        duration (float): Length of the recording in seconds.
+
+    Returns:
+        dict: The transcript.
+    """
+    timed = list(result.get("segments") or [])
+    timed += list(result.get("words") or [])
+    for segment in result.get("segments") or []:
+        timed += list(segment.get("words") or [])
+    for item in timed:
+        if isinstance(item, dict) and "start" in item and "end" in item:
+            item["start"] = _to_original(item["start"], offsets)
+            item["end"] = _to_original(item["end"], offsets, end=True)
+
+    if "duration" in result:
+        result["duration"] = duration
+    result["vad"] = {
+        "speech_seconds": round(sum(offset[2] for offset in offsets), 3),
+        "offsets": offsets,
+    }
+    return result
+
+
+def empty_result(offsets, duration):
+    """Return the transcript of a recording in which no speech was found."""
+    return restore_timestamps(
+        {"text": "", "segments": [], "duration": duration}, offsets, duration
+    )
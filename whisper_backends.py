@@ -0,0 +1,282 @@
+"""
+This module provides the inference backends used for local Whisper transcription.
+
+Every backend loads a model once and transcribes files into the same verbose JSON shape
+that openai-whisper's `model.transcribe` returns, so the rest of the pipeline does not
+depend on which one is used. Files given by path to transcribe_batch are loaded from the
+decoded-audio cache (see audio_cache) rather than decoded by ffmpeg.
+
+Backends:
+- "pytorch": openai-whisper running in fp32 with PyTorch.
+- "ctranslate2": faster-whisper's CTranslate2 engine with int8 quantized weights, which is
+  several times faster on CPU and uses far less memory for the same model size.
+
+Functions:
+- get_backend(name, model_size, threads=0): Load a model with the named backend.
+- prepare_backend(name, model_size): Check that a backend can be used and download its model.
+"""
+
+import math
+import os
+
+from audio_cache import load_audio
+
+BACKENDS = ("pytorch", "ctranslate2")
+
+
+class PytorchBackend:
+    """openai-whisper running in fp32 with PyTorch."""
+
+    name = "pytorch"
+
+    def __init__(self, model_size, threads=0):
+        import torch
+        import whisper
+
+        if threads:
+            torch.set_num_threads(threads)
+        self.model_size = model_size
+        self.model = whisper.load_model(model_size)
+
+    def transcribe(self, audio, initial_prompt, language):
+        """Transcribe audio, a file path or array, into openai-whisper's verbose JSON."""
+        return self.model.transcribe(
+            audio,
+            initial_prompt=initial_prompt,
+            language=language,
+            fp16=False,
+            verbose=True,
+        )
+
+    def transcribe_batch(self, audio_paths, initial_prompt, language, batch_size):
+        """
+        Transcribe several files, decoding their 30 second windows in batches.
+
+        Windows from consecutive files are stacked into one encoder/decoder forward pass
+        of up to batch_size windows, and the timestamps of each window are shifted by its
+        offset within its own file. Unlike transcribe, every window is conditioned on
+        initial_prompt only and there is no temperature fallback, and words crossing a
+        window boundary may be split.
+
+        Yields:
+            tuple: Each file path with its verbose JSON result, as soon as all of the
+            file's windows have been decoded.
+        """
+        import torch
+        import whisper
+        from whisper.audio import CHUNK_LENGTH, N_FRAMES, N_SAMPLES, SAMPLE_RATE
+
+        options = whisper.DecodingOptions(
+            language=language, prompt=initial_prompt, fp16=False
+        )
+        tokenizer = whisper.tokenizer.get_tokenizer(
+            self.model.is_multilingual,
+            num_languages=self.model.num_languages,
+            language=language,
+            task="transcribe",
+        )
+        files = {}
+        batch = []
+
+        def decode_batch():
+            mel = torch.stack([window_mel for window_mel, _ in batch])
+            results = whisper.decode(self.model, mel.to(self.model.device), options)
+            for (_, (path, window_index, duration)), result in zip(batch, results):
+                files[path]["segments"].extend(
+                    _window_segments(
+                        result,
+                        tokenizer,
+                        offset=window_index * CHUNK_LENGTH,
+                        duration=duration,
+                        seek=window_index * N_FRAMES,
+                    )
+                )
+                files[path]["windows_left"] -= 1
+            batch.clear()
+            for path in [path for path, state in files.items() if not state["windows_left"]]:
+                yield path, _verbose_result(files.pop(path)["segments"], language)
+
+        for path in audio_paths:
+            audio = load_audio(path) if isinstance(path, str) else path
+            if isinstance(audio, str):
+                audio = whisper.load_audio(audio)
+            n_windows = max(1, math.ceil(len(audio) / N_SAMPLES))
+            files[path] = {"windows_left": n_windows, "segments": []}
+            for window_index in range(n_windows):
+                window = audio[window_index * N_SAMPLES : (window_index + 1) * N_SAMPLES]
+                window_mel = whisper.log_mel_spectrogram(
+                    whisper.pad_or_trim(window), n_mels=self.model.dims.n_mels
+                )
+                batch.append(
+                    (window_mel, (path, window_index, len(window) / SAMPLE_RATE))
+                )
+                if len(batch) == batch_size:
+                    yield from decode_batch()
+        if batch:
+            yield from decode_batch()
+
+
+def _window_segments(result, tokenizer, offset, duration, seek):
+    """
+    Turn the tokens decoded for one 30 second window into timestamped segments.
+
+    Whisper brackets each segment with timestamp tokens, a segment that is still open at
+    the end of the window runs to the end of the window's audio.
+    """
+    segments = []
+
+    def add_segment(start, end, tokens):
+        text = tokenizer.decode(tokens)
+        if not text.strip():
+            return
+        segments.append(
+            {
+                "seek": seek,
+                "start": round(offset + start, 3),
+                "end": round(offset + min(end, duration), 3),
+                "text": text,
+                "tokens": tokens,
+                "temperature": result.temperature,
+                "avg_logprob": result.avg_logprob,
+                "compression_ratio": result.compression_ratio,
+                "no_speech_prob": result.no_speech_prob,
+            }
+        )
+
+    start = None
+    last_time = 0.0
+    text_tokens = []
+    for token in result.tokens:
+        if token < tokenizer.timestamp_begin:
+            text_tokens.append(token)
+            continue
+        last_time = (token - tokenizer.timestamp_begin) * 0.02
+        if start is not None and text_tokens:
+            add_segment(start, last_time, text_tokens)
+            text_tokens = []
+            start = None
+        else:
+            start = last_time
+    if text_tokens:
+        add_segment(last_time if start is None else start, duration, text_tokens)
+    return segments
+
+
+def _verbose_result(segments, language):
+    """Assemble segments into openai-whisper's verbose JSON shape."""
+    for segment_id, segment in enumerate(segments):
+        segment["id"] = segment_id
+    return {
+        "text": "".join(segment["text"] for segment in segments),
+        "segments": segments,
+        "language": language,
+    }
+
+
+def _import_faster_whisper():
+    try:
+        import faster_whisper
+    except ImportError as e:
+        raise ImportError(
+            "The ctranslate2 backend needs faster-whisper: pip install faster-whisper"
+        ) from e
+    return faster_whisper
+
+
+class CTranslate2Backend:
+    """faster-whisper's CTranslate2 engine with int8 quantized weights on the CPU."""
+
+    name = "ctranslate2"
+
+    def __init__(self, model_size, threads=0, compute_type="int8"):
+        faster_whisper = _import_faster_whisper()
+        self.model_size = model_size
+        self.model = faster_whisper.WhisperModel(
+            model_size, device="cpu", compute_type=compute_type, cpu_threads=threads
+        )
+
+    def transcribe(self, audio, initial_prompt, language):
+        """Transcribe audio, a file path or array, into openai-whisper's verbose JSON."""
+        segments, info = self.model.transcribe(
+            audio, initial_prompt=initial_prompt, language=language
+        )
+        result_segments = []
+        for segment in segments:
+            print(f"[{segment.start:.3f} --> {segment.end:.3f}] {segment.text}")
+            result_segments.append(
+                {
+                    "id": segment.id,
+                    "seek": segment.seek,
+                    "start": segment.start,
+                    "end": segment.end,
+                    "text": segment.text,
+                    "tokens": list(segment.tokens),
+                    "temperature": segment.temperature,
+                    "avg_logprob": segment.avg_logprob,
+                    "compression_ratio": segment.compression_ratio,
+                    "no_speech_prob": segment.no_speech_prob,
+                }
+            )
+        return {
+            "text": "".join(segment["text"] for segment in result_segments),
+            "segments": result_segments,
+            "language": info.language,
+        }
+
+    def transcribe_batch(self, audio_paths, initial_prompt, language, batch_size):
+        """
+        Transcribe several files one after another.
+
+        CTranslate2 already batches the work inside each file efficiently on the CPU, so
+        files are not stacked together here. batch_size is accepted for compatibility.
+
+        Yields:
+            tuple: Each file path with its verbose JSON result.
+        """
+        for path in audio_paths:
+            yield path, self.transcribe(load_audio(path), initial_prompt, language)
+
+
+def get_backend(name, model_size, threads=0):
+    """
+    Load a model with the named backend.
+
+    Args:
+        name (str): One of BACKENDS.
+        model_size (str): The Whisper model size, e.g. "base" or "large-v3".
+        threads (int): Number of CPU threads for inference, 0 for the backend default.
+
+    Raises:
+        ValueError: If the backend is not supported.
+    """
+    if name == "pytorch":
+        return PytorchBackend(model_size, threads)
+    if name == "ctranslate2":
+        return CTranslate2Backend(model_size, threads)
+    raise ValueError(f"Unsupported backend {name}, choose from {', '.join(BACKENDS)}")
+
+
+def prepare_backend(name, model_size):
+    """
+    Check that a backend can be used and download its model into the local cache.
+
+    Worker processes load their model from the cache when they start. Doing this in the
+    parent first means a missing library fails the run before any worker is spawned,
+    instead of failing in every worker, and workers never download the same checkpoint
+    at the same time.
+
+    Raises:
+        ImportError: If the library of the backend is not installed.
+        ValueError: If the backend is not supported.
+    """
+    if name == "pytorch":
+        import whisper
+
+        # Loading is how openai-whisper downloads and verifies a checkpoint.
+        whisper.load_model(model_size, device="cpu")
+    elif name == "ctranslate2":
+        faster_whisper = _import_faster_whisper()
+        if not os.path.isdir(model_size):
+            faster_whisper.download_model(model_size)
+    else:
+        raise ValueError(f"Unsupported backend {name}, choose from {', '.join(BACKENDS)}")
@@ -1,54 +1,437 @@
 """Take an audiofile and transcibe it to text using Whisper API."""
-import glob
+import contextlib
+import functools
 import json
-import wave
+import multiprocessing
+import os
+import threading
+import time
 
-import whisper
 from tqdm import tqdm
 
-with open("config.json", "r", encoding="utf-8") as f:
-    config = json.load(f)
+from audio_cache import load_audio
+from audio_metadata import get_metadata, usable_wav_files
+from job_store import import_directory, pending_transcription, record_stage
+from metrics import record_metrics
+from transcription_cache import (
+    cache_transcription,
+    get_cached_transcription,
+    transcription_key,
+)
+from settings import config, data_dir
+from vad import empty_result, restore_timestamps, speech_only, vad_settings
+from whisper_backends import get_backend, prepare_backend
 
+JOB_BACKEND = "local"
 
-DATA_DIR = config["data_dir"]
-PROMPT = config["audio_prompt"]
+_worker_backend = None
+_worker_error = None
+_loaded_backends = {}
+_loaded_backends_lock = threading.Lock()
 
 
-def translate_audio(file_path, date, model):
-    """Translate audio to text."""
-    result = model.transcribe(
-        file_path, initial_prompt=PROMPT, language="en", fp16=False, verbose=True
-    )
+def translate_audio(file_path, date, backend):
+    """
+    Translate audio to text, reusing a cached transcription of the same audio if there is one.
+
+    With "vad_enabled" set only the speech in the file is decoded, see vad. The audio is
+    given to the model as samples from the decoded-audio cache, see audio_cache.
+
+    Args:
+        file_path (str): Path to the audio file.
+        date (str): Date of the recording.
+        backend: A loaded backend from whisper_backends.get_backend.
+    """
+    cache_key = _cache_key(file_path, backend)
+    text = get_cached_transcription(cache_key)
+    if text is None:
+        with speech_only(file_path) as (audio_path, offsets):
+            if offsets == []:
+                result = empty_result(offsets, get_duration_wave(file_path))
+            else:
+                result = backend.transcribe(
+                    load_audio(audio_path),
+                    initial_prompt=config["audio_prompt"],
+                    language="en",
+                )
+                if offsets:
+                    restore_timestamps(result, offsets, get_duration_wave(file_path))
+        text = json.dumps(result)
+        cache_transcription(cache_key, text)
     print(file_path)
+    _write_transcript(file_path, date, text)
+
+
+def translate_audio_batch(file_paths, date, backend, batch_size):
+    """
+    Translate several audio files to text, decoding their windows together in batches.
+
+    Cached transcriptions are written straight away, the remaining files go through
+    backend.transcribe_batch and each transcript is written as soon as its file is done.
+    With "vad_enabled" set only the speech in each file is decoded, see vad.
+
+    Args:
+        file_paths (list): Paths to the audio files.
+        date (str): Date of the recordings.
+        backend: A loaded backend from whisper_backends.get_backend.
+        batch_size (int): Number of 30 second windows to decode in one forward pass.
+
+    Yields:
+        str: Each file path once its transcript has been written.
+    """
+    cache_keys = {}
+    for file_path in file_paths:
+        cache_key = _cache_key(file_path, backend)
+        text = get_cached_transcription(cache_key)
+        if text is None:
+            cache_keys[file_path] = cache_key
+            continue
+        _write_transcript(file_path, date, text)
+        yield file_path
+
+    with contextlib.ExitStack() as stack:
+        speech = {}
+        for file_path in list(cache_keys):
+            audio_path, offsets = stack.enter_context(speech_only(file_path))
+            if offsets == []:
+                text = json.dumps(empty_result(offsets, get_duration_wave(file_path)))
+                cache_transcription(cache_keys.pop(file_path), text)
+                _write_transcript(file_path, date, text)
+                yield file_path
+            else:
+                speech[audio_path] = (file_path, offsets)
+
+        for audio_path, result in backend.transcribe_batch(
+            list(speech), initial_prompt=config["audio_prompt"], language="en", batch_size=batch_size
+        ):
+            file_path, offsets = speech[audio_path]
+            if offsets:
+                restore_timestamps(result, offsets, get_duration_wave(file_path))
+            text = json.dumps(result)
+            cache_transcription(cache_keys[file_path], text)
+            print(file_path)
+            _write_transcript(file_path, date, text)
+            yield file_path
 
+
+def _cache_key(file_path, backend):
+    return transcription_key(
+        file_path,
+        f"local-{backend.name}",
+        backend.model_size,
+        config["audio_prompt"],
+        "en",
+        vad_settings(),
+    )
+
+
+def _write_transcript(file_path, date, text):
     with open(
-        f"{DATA_DIR}/{date}/Text/transcribed_{file_path.split('/')[-1].split('.')[0]}.json",
+        f"{data_dir()}/{date}/Text/transcribed_{file_path.split('/')[-1].split('.')[0]}.json",
         "w",
         encoding="utf-8",
     ) as file:
-        file.write(json.dumps(result))
+        file.write(text)
+
+
+def load_backend(backend, model_size):
+    """
+    Return a model loaded in this process, loading it only the first time it is asked for.
+
+    This lets a run over several dates load the model once rather than once per date.
+    """
+    with _loaded_backends_lock:
+        if (backend, model_size) not in _loaded_backends:
+            _loaded_backends[(backend, model_size)] = get_backend(backend, model_size)
+        return _loaded_backends[(backend, model_size)]
 
 
 def get_duration_wave(file_path):
     """Get duration of wave file."""
-    with wave.open(file_path, "r") as audio_file:
-        frame_rate = audio_file.getframerate()
-        n_frames = audio_file.getnframes()
-        return n_frames / float(frame_rate)
+    return get_metadata(file_path)["duration"]
+
+
+def get_files_to_transcribe(date):
+    """
+    Get the audio files of a date that the local model has not transcribed yet.
+
+    Downloaded recordings and chunks are both transcribed, as before, selected from the
+    job store after importing any files it does not know about.
+    """
+    audio_dir = f"{data_dir()}/{date}/Audio"
+    import_directory(date, audio_dir, f"{data_dir()}/{date}/Text")
+    usable_files = set(usable_wav_files(audio_dir))
+    audio_files = [
+        os.path.join(audio_dir, file_name)
+        for file_name in pending_transcription(
+            date, JOB_BACKEND, ready_stages=("downloaded", "chunked")
+        )
+        if "prechunked" not in file_name
+    ]
+    audio_files = [file for file in audio_files if file in usable_files]
+    print(f"Found {len(audio_files)} audio files.")
+    return audio_files
 
 
-def transcribe_audio_whisper_local(date, model_size="base"):
+def _transcribe_tracked(date, file_path, transcribe):
+    """Call transcribe(file_path) and record its progress in the job store."""
+    file_name = os.path.basename(file_path)
+    record_stage(date, file_name, "transcribed", "running", backend=JOB_BACKEND)
+    try:
+        transcribe(file_path)
+    except Exception as e:
+        record_stage(
+            date, file_name, "transcribed", "failed", backend=JOB_BACKEND, error=str(e)
+        )
+        raise
+    record_stage(date, file_name, "transcribed", "done", backend=JOB_BACKEND)
+
+
+def _init_worker(backend_name, model_size, threads):
+    """
+    Load the model once per worker process and cap its intra-op threads.
+
+    A pool replaces a worker whose initializer raises and never gives up, so a model that
+    fails to load is kept as an error that every file handed to the worker reports.
+    """
+    global _worker_backend, _worker_error
+    try:
+        _worker_backend = get_backend(backend_name, model_size, threads)
+    except Exception as e:
+        _worker_error = f"Could not load the {backend_name} {model_size} model: {e}"
+
+
+def _transcribe_in_worker(file_path, date):
+    """
+    Transcribe one file with the worker's model.
+
+    Returns:
+        tuple: The file path, the time taken and the error message if it failed.
+    """
+    start = time.perf_counter()
+    if _worker_error:
+        return file_path, 0.0, _worker_error
+    try:
+        translate_audio(file_path, date=date, backend=_worker_backend)
+    except Exception as e:
+        return file_path, time.perf_counter() - start, str(e)
+    return file_path, time.perf_counter() - start, None
+
+
+class LocalTranscriber:
+    """
+    Transcribes single files with a model that stays loaded, from any number of threads.
+
+    With one worker, files go to the transcription server when one is running and
+    use_daemon is set, otherwise to a model loaded in this process, one file at a time.
+    With more workers, each file is handed to a spawned worker process of a pool, as in
+    transcribe_audio_whisper_local, so up to workers files are transcribed at once.
+    """
+
+    def __init__(self, model_size="base", workers=1, backend="pytorch", use_daemon=True):
+        self.model_size = model_size
+        self.backend_name = backend
+        self._backend = None
+        self._daemon = None
+        self._pool = None
+        self._lock = threading.Lock()
+        if workers > 1:
+            threads = config.get(
+                "whisper_threads_per_worker", max(1, (os.cpu_count() or 1) // workers)
+            )
+            prepare_backend(backend, model_size)
+            self._pool = multiprocessing.get_context("spawn").Pool(
+                workers,
+                initializer=_init_worker,
+                initargs=(backend, model_size, threads),
+            )
+        elif use_daemon:
+            # Imported here as the server module itself imports this one.
+            import transcription_daemon
+
+            if transcription_daemon.daemon_available():
+                self._daemon = transcription_daemon
+
+    def transcribe(self, file_path, date):
+        """
+        Transcribe one file and record it in the job store.
+
+        Returns:
+            str: The path of the transcript.
+        """
+        _transcribe_tracked(date, file_path, functools.partial(self._transcribe, date=date))
+        record_metrics("transcribe", files=1, audio_seconds=get_duration_wave(file_path))
+        return (
+            f"{data_dir()}/{date}/Text/transcribed_{file_path.split('/')[-1].split('.')[0]}.json"
+        )
+
+    def _transcribe(self, file_path, date):
+        if self._pool is not None:
+            _, _, error = self._pool.apply(_transcribe_in_worker, (file_path, date))
+            if error:
+                raise RuntimeError(error)
+        elif self._daemon is not None:
+            self._daemon.submit_to_daemon(
+                file_path, date, self.backend_name, self.model_size
+            )
+        else:
+            with self._lock:
+                if self._backend is None:
+                    self._backend = load_backend(self.backend_name, self.model_size)
+                translate_audio(file_path, date=date, backend=self._backend)
+
+    def close(self):
+        """Shut down the worker processes, if any."""
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+
+
+def transcribe_audio_whisper_local(
+    date,
+    model_size="base",
+    workers=1,
+    backend="pytorch",
+    use_daemon=True,
+    batch_size=1,
+):
     """Transcribe audio to text.
+
+    With more than one worker the files are spread over a process pool. Each worker loads
+    the model once, uses an equal share of the CPU cores for its inference threads and pulls
+    files from a shared queue, longest first so the pool finishes evenly. Transcripts are
+    written by the workers as soon as each file completes.
+
+    With a single worker, files are submitted to the transcription server from
+    transcription_daemon when one is running, so the model does not have to be loaded
+    again. Otherwise they are transcribed in this process, and with a batch_size above one
+    the 30 second windows of consecutive files are decoded together in batches (see
+    whisper_backends.PytorchBackend.transcribe_batch).
+
     Args:
         date (str): Date of the recordings to transcribe.
         model_size (str, optional): Size of the model to use, options "base, medium, large"
         Defaults to "base".
+        workers (int, optional): Number of worker processes. Defaults to 1.
+        backend (str, optional): Inference backend, see whisper_backends.BACKENDS.
+        Defaults to "pytorch".
+        use_daemon (bool, optional): Use the transcription server if it is running.
+        Defaults to True.
+        batch_size (int, optional): Number of 30 second windows to decode in one forward
+        pass when transcribing in this process. Defaults to 1.
 
     """
     print(f"Transcribing {date}...")
-    model = whisper.load_model(model_size)
-    audio_files = glob.glob(f"{DATA_DIR}/{date}/Audio/*.wav")
-    audio_files = [file for file in audio_files if "prechunked" not in file]
-    print(f"Found {len(audio_files)} audio files.")
-    for file in tqdm(audio_files):
-        translate_audio(file, model=model, date=date)
+    audio_files = get_files_to_transcribe(date)
+    durations = {file: get_duration_wave(file) for file in audio_files}
+    start = time.perf_counter()
+
+    if use_daemon and workers <= 1 and batch_size <= 1 and audio_files:
+        # Imported here as the server module itself imports this one.
+        import transcription_daemon
+
+        if transcription_daemon.daemon_available():
+            print("Submitting files to the transcription server.")
+            for file in tqdm(audio_files):
+                _transcribe_tracked(
+                    date,
+                    file,
+                    lambda file: transcription_daemon.submit_to_daemon(
+                        file, date, backend, model_size
+                    ),
+                )
+            audio_files = []
+
+    if audio_files and workers <= 1 and batch_size > 1:
+        loaded_backend = load_backend(backend, model_size)
+        for file in audio_files:
+            record_stage(
+                date,
+                os.path.basename(file),
+                "transcribed",
+                "running",
+                backend=JOB_BACKEND,
+            )
+        remaining = set(audio_files)
+        try:
+            for file in tqdm(
+                translate_audio_batch(audio_files, date, loaded_backend, batch_size),
+                total=len(audio_files),
+            ):
+                remaining.discard(file)
+                record_stage(
+                    date,
+                    os.path.basename(file),
+                    "transcribed",
+                    "done",
+                    backend=JOB_BACKEND,
+                )
+        except Exception as e:
+            for file in remaining:
+                record_stage(
+                    date,
+                    os.path.basename(file),
+                    "transcribed",
+                    "failed",
+                    backend=JOB_BACKEND,
+                    error=str(e),
+                )
+            raise
+    elif audio_files and workers <= 1:
+        loaded_backend = load_backend(backend, model_size)
+        for file in tqdm(audio_files):
+            _transcribe_tracked(
+                date,
+                file,
+                lambda file: translate_audio(file, date=date, backend=loaded_backend),
+            )
+    elif audio_files:
+        audio_files.sort(key=durations.get, reverse=True)
+        threads = config.get(
+            "whisper_threads_per_worker", max(1, (os.cpu_count() or 1) // workers)
+        )
+        print(f"Transcribing with {workers} workers, {threads} threads each.")
+        prepare_backend(backend, model_size)
+        for file in audio_files:
+            record_stage(
+                date,
+                os.path.basename(file),
+                "transcribed",
+                "running",
+                backend=JOB_BACKEND,
+            )
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(
+            workers,
+            initializer=_init_worker,
+            initargs=(backend, model_size, threads),
+        ) as pool:
+            results = pool.imap_unordered(
+                functools.partial(_transcribe_in_worker, date=date),
+                audio_files,
+            )
+            for file, elapsed, error in tqdm(results, total=len(audio_files)):
+                record_stage(
+                    date,
+                    os.path.basename(file),
+                    "transcribed",
+                    "failed" if error else "done",
+                    backend=JOB_BACKEND,
+                    error=error,
+                )
+                if error:
+                    print(f"Transcription failed for {file}: {error}")
+                else:
+                    print(
+                        f"Transcribed {file} in {elapsed:.1f}s "
+                        f"(real-time factor {elapsed / max(durations[file], 1e-9):.2f})"
+                    )
+
+    elapsed = time.perf_counter() - start
+    audio_seconds = sum(durations.values())
+    record_metrics("transcribe", files=len(durations), audio_seconds=audio_seconds)
+    if audio_seconds:
+        print(
+            f"Transcribed {audio_seconds:.0f}s of audio in {elapsed:.0f}s, "
+            f"real-time factor {elapsed / audio_seconds:.3f}."
+        )